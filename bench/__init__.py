@@ -0,0 +1 @@
+"""Benchmarks and synthetic workloads for the indexers and the API."""
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Replay a mixed request trace against the API and profile it.
+
+In-process (default): a throwaway database is created and seeded, and the
+trace runs through the Flask test client. Queries per request are counted
+with the sqltap middleware the app already installs.
+
+    python -m bench.bench_api --server postgresql://postgres@localhost/postgres --json api.json
+
+Against a running server (e.g. gunicorn with ENGINE_CONFIG_FILE pointing at a
+database seeded by bench.seed with the same plan arguments):
+
+    python -m bench.bench_api --url http://127.0.0.1:5000 --concurrency 8
+
+Pass --compare with an earlier --json file to print regressions.
+"""
+
+import argparse
+import json
+import os
+import queue
+import random
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from builtins import object
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from bench.harness import connect, percentile, throwaway_database, write_results
+from bench.seed import add_plan_arguments, plan_from_args, seed_database
+
+# endpoint name -> weight in the trace
+TRACE_MIX = {
+    "trending": 20,
+    "created": 10,
+    "hot": 8,
+    "promoted": 3,
+    "payout": 3,
+    "feed": 15,
+    "blog": 8,
+    "thread": 10,
+    "account_history": 10,
+    "post": 6,
+    "account": 4,
+    "follow_count": 3,
+}
+
+
+def build_trace(plan, requests, seed=1):
+    """List of (endpoint name, path) drawn from TRACE_MIX."""
+    rng = random.Random(seed)
+    names = list(TRACE_MIX)
+    weights = [TRACE_MIX[n] for n in names]
+    trace = []
+    for name in rng.choices(names, weights, k=requests):
+        root = rng.choice(plan.root_posts)
+        token = rng.choice(root["tokens"])
+        reader = plan.readers.draw()
+        params = {"token": token, "limit": 20}
+        if name in ("trending", "created", "hot", "promoted", "payout"):
+            path = {
+                "trending": "/get_discussions_by_trending",
+                "created": "/get_discussions_by_created",
+                "hot": "/get_discussions_by_hot",
+                "promoted": "/get_discussions_by_promoted",
+                "payout": "/get_discussions_by_payout",
+            }[name]
+            if rng.random() < 0.3:
+                params["tag"] = rng.choice(root["tags"])
+            if name == "created" and rng.random() < 0.2:
+                params["start_author"] = root["author"]
+                params["start_permlink"] = root["permlink"]
+        elif name == "feed":
+            path = "/get_feed"
+            params["tag"] = reader
+        elif name == "blog":
+            path = "/get_discussions_by_blog"
+            params["tag"] = root["author"]
+        elif name == "thread":
+            path = "/get_thread"
+            params = {
+                "token": token,
+                "author": root["author"],
+                "permlink": root["permlink"],
+            }
+        elif name == "account_history":
+            path = "/get_account_history"
+            params = {"account": reader, "token": token, "limit": 50}
+        elif name == "post":
+            path = f"/{root['authorperm']}"
+            params = {"token": token}
+        elif name == "account":
+            path = f"/@{reader}"
+            params = {}
+        else:
+            path = "/get_follow_count"
+            params = {"account": reader}
+        trace.append((name, f"{path}?{urlencode(params)}" if params else path))
+    return trace
+
+
+class InProcessClient(object):
+    """Runs requests through the Flask test client and counts queries with sqltap."""
+
+    def __init__(self, databaseConnector, cache_dir):
+        config_file = os.path.join(cache_dir, "config.json")
+        with open(config_file, "w") as f:
+            json.dump(
+                {
+                    "engine_api": "http://127.0.0.1:9/",
+                    "databaseConnector": databaseConnector,
+                    "apiCacheDir": os.path.join(cache_dir, "cache"),
+                },
+                f,
+            )
+        os.environ["ENGINE_CONFIG_FILE"] = config_file
+        from server.app import app, cache
+
+        cache.clear()
+        self.client = app.test_client()
+        self.sqltap = app.wsgi_app
+        self.sqltap.start()
+
+    def drain(self):
+        count = 0
+        while True:
+            try:
+                self.sqltap.collector.get_nowait()
+            except queue.Empty:
+                return count
+            count += 1
+
+    def get(self, path):
+        self.drain()
+        start = time.perf_counter()
+        response = self.client.get(path)
+        response.get_data()
+        return response.status_code, time.perf_counter() - start, self.drain()
+
+    def close(self):
+        self.sqltap.stop()
+
+
+class HttpClient(object):
+    """Runs requests against a server; queries per request are not available."""
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+
+    def get(self, path):
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(self.url + path, timeout=60) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except Exception:
+            status = 0
+        return status, time.perf_counter() - start, None
+
+    def close(self):
+        pass
+
+
+def replay(client, trace, concurrency=1):
+    samples = []
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = pool.map(lambda item: client.get(item[1]), trace)
+            samples = [(name,) + result for (name, _), result in zip(trace, results)]
+    else:
+        samples = [(name,) + client.get(path) for name, path in trace]
+    return samples, time.perf_counter() - start
+
+
+def summarize(samples, elapsed):
+    def stats(rows):
+        latency = [r[2] for r in rows]
+        queries = [r[3] for r in rows if r[3] is not None]
+        return {
+            "requests": len(rows),
+            "errors": sum(1 for r in rows if r[1] >= 400 or r[1] == 0),
+            "p50_ms": percentile(latency, 50) * 1000,
+            "p90_ms": percentile(latency, 90) * 1000,
+            "p99_ms": percentile(latency, 99) * 1000,
+            "queries_per_request": sum(queries) / len(queries) if queries else None,
+            "max_queries": max(queries) if queries else None,
+        }
+
+    by_endpoint = {}
+    for row in samples:
+        by_endpoint.setdefault(row[0], []).append(row)
+    total = stats(samples)
+    total["seconds"] = elapsed
+    total["requests_per_s"] = len(samples) / elapsed if elapsed > 0 else 0.0
+    return {
+        "total": total,
+        "endpoints": {name: stats(rows) for name, rows in by_endpoint.items()},
+    }
+
+
+def print_results(results):
+    total = results["total"]
+    print(
+        f"{total['requests']} requests in {total['seconds']:.2f} s "
+        f"({total['requests_per_s']:.1f} req/s, {total['errors']} errors)"
+    )
+    print(
+        f"{'endpoint':<18} {'reqs':>6} {'err':>5} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'q/req':>7} {'q max':>6}"
+    )
+    for name, s in sorted(results["endpoints"].items()):
+        q = (
+            "-"
+            if s["queries_per_request"] is None
+            else f"{s['queries_per_request']:.1f}"
+        )
+        qmax = "-" if s["max_queries"] is None else s["max_queries"]
+        print(
+            f"{name:<18} {s['requests']:>6} {s['errors']:>5} {s['p50_ms']:>9.2f} {s['p90_ms']:>9.2f} {s['p99_ms']:>9.2f} {q:>7} {qmax:>6}"
+        )
+
+
+def compare(old, new, threshold):
+    """Print per endpoint changes; returns the number of regressions."""
+    regressions = 0
+    changed = [
+        key
+        for key in (
+            "seed",
+            "tokens",
+            "accounts",
+            "posts",
+            "requests",
+            "trace_seed",
+            "url",
+        )
+        if old.get("args", {}).get(key) != new["args"].get(key)
+    ]
+    if changed:
+        print(f"Warning: baseline was run with different {', '.join(changed)}")
+    print(f"Compared to baseline (threshold {threshold:.0%}):")
+    for name, s in sorted(new["endpoints"].items()):
+        base = old["endpoints"].get(name)
+        if base is None:
+            print(f"{name:<18} new endpoint")
+            continue
+        notes = []
+        for key in ("p50_ms", "p99_ms"):
+            if base[key] > 0:
+                change = s[key] / base[key] - 1
+                notes.append(f"{key} {change:+.0%}")
+                if change > threshold:
+                    regressions += 1
+                    notes[-1] += " REGRESSION"
+        if (
+            s["queries_per_request"] is not None
+            and base["queries_per_request"] is not None
+        ):
+            change = s["queries_per_request"] - base["queries_per_request"]
+            notes.append(f"queries {change:+.1f}")
+            if change > 0.5:
+                regressions += 1
+                notes[-1] += " REGRESSION"
+        print(f"{name:<18} " + ", ".join(notes))
+    change = new["total"]["requests_per_s"] / old["total"]["requests_per_s"] - 1
+    print(f"{'throughput':<18} {change:+.0%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the API endpoints.")
+    parser.add_argument(
+        "--server",
+        default=os.environ.get(
+            "BENCH_DATABASE", "postgresql://postgres@localhost/postgres"
+        ),
+        help="Connector of any database on the Postgres server to seed next to",
+    )
+    parser.add_argument("--url", help="Replay over HTTP against this server instead")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--trace-seed", type=int, default=1)
+    parser.add_argument(
+        "--concurrency", type=int, default=1, help="Parallel requests (--url only)"
+    )
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--compare", help="Baseline results to diff against")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    parser.add_argument(
+        "--keep", action="store_true", help="Keep the database afterwards"
+    )
+    add_plan_arguments(parser)
+    args = parser.parse_args()
+
+    plan = plan_from_args(args)
+    trace = build_trace(plan, args.requests, seed=args.trace_seed)
+
+    if args.url:
+        client = HttpClient(args.url)
+        samples, elapsed = replay(client, trace, args.concurrency)
+    else:
+        with (
+            throwaway_database(args.server, keep=args.keep) as databaseConnector,
+            tempfile.TemporaryDirectory() as tmp,
+        ):
+            start_time = time.time()
+            db = connect(databaseConnector)
+            seed_database(db, plan)
+            db.executable.close()
+            print(f"Seeding took {time.time() - start_time:.2f} s")
+            client = InProcessClient(databaseConnector, tmp)
+            try:
+                samples, elapsed = replay(client, trace)
+            finally:
+                client.close()
+
+    results = summarize(samples, elapsed)
+    results["args"] = vars(args)
+    print_results(results)
+    if args.json:
+        write_results(args.json, results)
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(json.load(f), results, args.threshold) > 0:
+                return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
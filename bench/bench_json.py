@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Microbenchmark of the JSON decoding of sidechain blocks and Hive ops.
+
+Decodes the fields the streamers and processors parse (contract payloads and
+logs, custom_json payloads, comment json_metadata) the way the pipeline did
+before engine.json_codec, and through engine.json_codec with each backend.
+
+    python -m bench.bench_json --rounds 20
+
+Samples are generated by bench.workload unless --samples points at a file with
+one sidechain block (get_block_info) or Hive op per line, e.g. recorded from a
+node or written with --record.
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from bench.harness import write_results
+from bench.workload import SyntheticWorkload
+from engine import json_codec
+from engine.json_codec import DECODED_KEY, decode_field, encode_field
+
+
+def load_samples(path):
+    blocks, ops = [], []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            sample = json.loads(line)
+            if "transactions" in sample:
+                blocks.append(sample)
+            else:
+                ops.append(sample)
+    return blocks, ops
+
+
+def record_samples(path, blocks, ops):
+    with open(path, "w") as f:
+        for sample in blocks + ops:
+            # Hive ops carry datetime timestamps
+            f.write(json.dumps(sample, default=str) + "\n")
+
+
+def flatten(blocks, ops):
+    """Ops with at least one JSON field, sidechain transactions first."""
+    items = []
+    for block in blocks:
+        items.extend(block["transactions"])
+        items.extend(block.get("virtualTransactions") or [])
+    items.extend(op for op in ops if op["type"] in ("custom_json", "comment"))
+    return items
+
+
+def decode_stdlib(op):
+    """The json.loads / json.dumps calls of the pipeline before json_codec."""
+    if "contract" in op:
+        if op["payload"]:
+            json.loads(op["payload"])
+        if op.get("logs"):
+            json.loads(op["logs"])
+            if op["contract"] == "tokens" and op["action"] == "transfer":
+                # check_engine_op of the promotion processor
+                json.loads(op["logs"])
+    elif op["type"] == "custom_json":
+        json_data = json.loads(op["json"])
+        if isinstance(json_data, str):
+            json.loads(json_data)
+    else:
+        json_metadata = json.loads(op["json_metadata"])
+        if isinstance(json_metadata, str):
+            json_metadata = json.loads(json_metadata)
+        json.dumps(json_metadata)
+
+
+def decode_codec(op):
+    """The same fields through the decode-once layer."""
+    op.pop(DECODED_KEY, None)
+    if "contract" in op:
+        if op["payload"]:
+            decode_field(op, "payload")
+        if op.get("logs"):
+            decode_field(op, "logs")
+            if op["contract"] == "tokens" and op["action"] == "transfer":
+                decode_field(op, "logs")
+    elif op["type"] == "custom_json":
+        decode_field(op, "json")
+    else:
+        encode_field(op, "json_metadata", decode_field(op, "json_metadata"))
+
+
+def measure(decode, items, rounds):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for op in items:
+            decode(op)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {
+        "seconds": best,
+        "us_per_op": best / len(items) * 1e6,
+        "ops_per_s": len(items) / best if best > 0 else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the JSON decoding of the stream processors."
+    )
+    parser.add_argument("--samples", help="JSON lines file of blocks and Hive ops")
+    parser.add_argument("--record", help="Write the samples to this file")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--posts", type=int, default=300)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    if args.samples:
+        blocks, ops = load_samples(args.samples)
+    else:
+        workload = SyntheticWorkload(seed=args.seed, posts=args.posts)
+        blocks, ops = workload.engine_blocks(), workload.hive_ops()
+    if args.record:
+        record_samples(args.record, blocks, ops)
+    items = flatten(blocks, ops)
+    if not items:
+        print("No ops with JSON fields in the samples")
+        return 1
+    print(f"{len(items)} ops from {len(blocks)} blocks and {len(ops)} Hive ops")
+
+    results = {"stdlib (before)": measure(decode_stdlib, items, args.rounds)}
+    backends = ["json"] + (["orjson"] if json_codec.orjson is not None else [])
+    previous = json_codec.backend()
+    try:
+        for name in backends:
+            json_codec.set_backend(name)
+            results[f"json_codec ({name})"] = measure(decode_codec, items, args.rounds)
+    finally:
+        json_codec.set_backend(previous)
+
+    baseline = results["stdlib (before)"]["seconds"]
+    print(f"{'decoder':<24} {'us/op':>8} {'ops/s':>12} {'speedup':>8}")
+    for name, result in results.items():
+        print(
+            f"{name:<24} {result['us_per_op']:>8.2f} {result['ops_per_s']:>12.0f} {baseline / result['seconds']:>7.2f}x"
+        )
+    if args.json:
+        write_results(args.json, {"args": vars(args), "decoders": results})
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
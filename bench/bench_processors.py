@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmark the Hive and sidechain processors on a synthetic workload.
+
+Run from the repository root:
+
+    python -m bench.bench_processors --server postgresql://postgres@localhost/postgres
+
+A scratch database is created on the server, loaded with sql/engine.sql,
+fed the generated engine blocks and Hive ops, and dropped again.
+"""
+
+import argparse
+import contextlib
+import logging
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+from nectar import Hive
+
+from bench.harness import (
+    QueryCounter,
+    Recorder,
+    connect,
+    print_summary,
+    throwaway_database,
+    write_results,
+)
+from bench.workload import SyntheticWorkload
+from engine.config_storage import ConfigurationDB
+from engine.token_metadata import LazyTokenObjects
+from engine.follow_storage import FollowsDB
+from engine.post_storage import PostsTrx
+from engine.reblog_storage import ReblogsDB
+from engine.token_config_storage import TokenConfigDB
+from stream_blocks import HiveStreamProcessor
+from stream_engine_sidechain_blocks import EngineStreamProcessor
+
+
+def build_token_metadata(db, rows):
+    """Token metadata as initialize_token_metadata builds it, without the API calls."""
+    tokenConfigStorage = TokenConfigDB(db)
+    for row in rows:
+        tokenConfigStorage.upsert(row)
+    token_config = tokenConfigStorage.get_all()
+    return {
+        "config": token_config,
+        "objects": LazyTokenObjects(None, token_config),
+        "config_by_id": {c["reward_pool_id"]: c for c in token_config.values()},
+    }
+
+
+def run_engine(db, token_metadata, blocks, recorder):
+    processor = EngineStreamProcessor(db, None, token_metadata, ConfigurationDB(db))
+    recorder.instrument(processor.comments_processor, "process", "engine.comments")
+    recorder.instrument(processor.promote_post_processor, "process", "engine.promote")
+    recorder.instrument(processor.stake_processor, "process", "engine.stake")
+    recorder.instrument(processor, "process_engine_block", "engine.block")
+    for block in blocks:
+        processor.process_engine_block(block)
+
+
+def run_hive(db, token_metadata, ops, recorder):
+    confStorage = ConfigurationDB(db)
+    # let every op pass the engine watermark check
+    confStorage.upsert_engine(
+        {
+            "last_engine_streamed_block": 0,
+            "last_engine_streamed_timestamp": datetime(2100, 1, 1, tzinfo=timezone.utc),
+        }
+    )
+    processor = HiveStreamProcessor(
+        db,
+        Hive(offline=True),
+        token_metadata,
+        confStorage,
+        PostsTrx(db),
+        ReblogsDB(db),
+        FollowsDB(db),
+    )
+    processor.last_streamed_block = ops[0]["block_num"] - 1 if ops else 0
+    recorder.instrument(
+        processor.comment_processor_for_engine, "process", "hive.comment"
+    )
+    recorder.instrument(processor.reblog_processor, "process", "hive.reblog")
+    recorder.instrument(processor.follow_processor, "process", "hive.follow")
+    recorder.instrument(processor, "process_op", "hive.op")
+    for op in ops:
+        processor.process_op(op)
+    db.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the stream processors against a throwaway database."
+    )
+    parser.add_argument(
+        "--server",
+        default=os.environ.get(
+            "BENCH_DATABASE", "postgresql://postgres@localhost/postgres"
+        ),
+        help="Connector of any database on the Postgres server to use",
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--tokens", type=int, default=2)
+    parser.add_argument("--accounts", type=int, default=500)
+    parser.add_argument("--posts", type=int, default=300)
+    parser.add_argument("--votes-per-post", type=int, default=8)
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument(
+        "--keep", action="store_true", help="Keep the database afterwards"
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="Show the processor output"
+    )
+    args = parser.parse_args()
+
+    workload = SyntheticWorkload(
+        seed=args.seed,
+        tokens=args.tokens,
+        accounts=args.accounts,
+        posts=args.posts,
+        votes_per_post=args.votes_per_post,
+    )
+    blocks = workload.engine_blocks()
+    ops = workload.hive_ops()
+    print(f"Generated {len(blocks)} engine blocks and {len(ops)} Hive ops")
+
+    with throwaway_database(args.server, keep=args.keep) as databaseConnector:
+        db = connect(databaseConnector)
+        token_metadata = build_token_metadata(db, workload.token_config_rows())
+        counter = QueryCounter(db.engine)
+        recorder = Recorder(counter)
+        phases = {}
+        if not args.verbose:
+            logging.disable(logging.INFO)
+        quiet = (
+            contextlib.nullcontext()
+            if args.verbose
+            else contextlib.redirect_stdout(open(os.devnull, "w"))
+        )
+        with quiet:
+            for name, run, items in (
+                ("engine", run_engine, blocks),
+                ("hive", run_hive, ops),
+            ):
+                queries = counter.count
+                start = time.perf_counter()
+                run(db, token_metadata, items, recorder)
+                elapsed = time.perf_counter() - start
+                phases[name] = {
+                    "items": len(items),
+                    "seconds": elapsed,
+                    "items_per_s": len(items) / elapsed if elapsed > 0 else 0.0,
+                    "queries": counter.count - queries,
+                }
+        counter.close()
+        db.executable.close()
+
+    summary = recorder.summary()
+    for name, phase in phases.items():
+        print(
+            f"{name}: {phase['items']} in {phase['seconds']:.2f} s "
+            f"({phase['items_per_s']:.1f}/s, {phase['queries']} queries)"
+        )
+    print_summary(summary, "Per processor")
+    if args.json:
+        write_results(
+            args.json,
+            {"args": vars(args), "phases": phases, "processors": summary},
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Plan and execution time of every post listing variant.
+
+Seeds a throwaway database like bench.bench_api and runs EXPLAIN ANALYZE on
+each variant of engine.post_queries (tag, hive_select, last_timestamp,
+reblog, score and full_metadata combinations):
+
+    python -m bench.bench_queries --posts 5000 --json queries.json
+    python -m bench.bench_queries --listing feed --listing blog
+"""
+
+import argparse
+import os
+import sys
+from datetime import timedelta
+
+from bench.harness import connect, percentile, throwaway_database, write_results
+from bench.seed import add_plan_arguments, plan_from_args, seed_database
+from engine import post_queries
+
+
+def sample_params(plan):
+    """Bind parameters covering all listings, drawn from the seed plan."""
+    root = plan.root_posts[len(plan.root_posts) // 2]
+    last_timestamp = plan.now - timedelta(days=1)
+    readers = sorted({plan.readers.draw() for _ in range(20)})
+    return {
+        "token": root["tokens"][0],
+        "tags": [root["tags"][0]],
+        "accounts": tuple(readers),
+        "last_timestamp": last_timestamp,
+        "last_authorperm": f"@{root['author']}/{root['permlink']}",
+        "last_hive_authorperm": f"h@{root['author']}/{root['permlink']}",
+        "limit": 20,
+        "main_post": True,
+        "current_time": plan.now,
+        "cutoff": last_timestamp + timedelta(days=-30),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="EXPLAIN ANALYZE the post listing queries on a seeded database."
+    )
+    parser.add_argument(
+        "--server",
+        default=os.environ.get(
+            "BENCH_DATABASE", "postgresql://postgres@localhost/postgres"
+        ),
+        help="Connector of any database on the Postgres server to use",
+    )
+    add_plan_arguments(parser)
+    parser.add_argument(
+        "--listing",
+        action="append",
+        choices=sorted(post_queries.LISTINGS),
+        help="Only these listings (repeatable)",
+    )
+    parser.add_argument(
+        "--runs", type=int, default=3, help="EXPLAIN runs per variant, best is kept"
+    )
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument(
+        "--keep", action="store_true", help="Keep the database afterwards"
+    )
+    args = parser.parse_args()
+
+    plan = plan_from_args(args)
+    results = []
+    with throwaway_database(args.server, keep=args.keep) as databaseConnector:
+        db = connect(databaseConnector)
+        seed_database(db, plan)
+        params = sample_params(plan)
+        for name, flags in post_queries.variants(args.listing):
+            runs = [
+                post_queries.explain(db, name, params, **flags)
+                for _ in range(args.runs)
+            ]
+            best = min(runs, key=lambda run: run["execution_ms"])
+            best["planning_ms"] = min(run["planning_ms"] for run in runs)
+            del best["plan"]
+            results.append(best)
+        db.executable.close()
+
+    print(f"{'variant':<64} {'plan ms':>8} {'exec ms':>8} {'rows':>6}  node")
+    for result in results:
+        print(
+            f"{result['variant']:<64} {result['planning_ms']:>8.2f} {result['execution_ms']:>8.2f} {result['rows']:>6}  {result['node']}"
+        )
+    for key in ("planning_ms", "execution_ms"):
+        values = [result[key] for result in results]
+        print(
+            f"{key}: p50 {percentile(values, 50):.2f} p99 {percentile(values, 99):.2f}"
+        )
+    if args.json:
+        write_results(args.json, {"args": vars(args), "variants": results})
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
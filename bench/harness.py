@@ -0,0 +1,149 @@
+# This Python file uses the following encoding: utf-8
+
+import functools
+import json
+import os
+import time
+from builtins import object
+from contextlib import contextmanager
+
+import dataset
+import psycopg2
+import psycopg2.extensions
+from psycopg2 import sql
+from sqlalchemy import event
+
+from engine.notify import dsn_from_connector
+
+SCHEMA_FILE = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "sql", "engine.sql"
+)
+
+
+def _with_database(databaseConnector, name):
+    base, _, _ = databaseConnector.rpartition("/")
+    return f"{base}/{name}"
+
+
+@contextmanager
+def throwaway_database(server_connector, keep=False):
+    """Create a scratch database loaded with sql/engine.sql and drop it afterwards.
+
+    server_connector points at any database on the target server, e.g.
+    postgresql://postgres@localhost/postgres
+    """
+    name = f"engine_bench_{os.getpid()}_{int(time.time())}"
+    admin = psycopg2.connect(dsn_from_connector(server_connector))
+    admin.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    with admin.cursor() as cur:
+        cur.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(name)))
+    databaseConnector = _with_database(server_connector, name)
+    try:
+        conn = psycopg2.connect(dsn_from_connector(databaseConnector))
+        with conn, conn.cursor() as cur, open(SCHEMA_FILE) as f:
+            cur.execute(f.read())
+        conn.close()
+        yield databaseConnector
+    finally:
+        if keep:
+            print(f"Keeping benchmark database {name}")
+        else:
+            with admin.cursor() as cur:
+                cur.execute(
+                    sql.SQL("DROP DATABASE IF EXISTS {} WITH (FORCE)").format(
+                        sql.Identifier(name)
+                    )
+                )
+        admin.close()
+
+
+def connect(databaseConnector):
+    return dataset.connect(databaseConnector, ensure_schema=False)
+
+
+class QueryCounter(object):
+    """Counts statements sent by a SQLAlchemy engine (or all engines)."""
+
+    def __init__(self, engine=None):
+        from sqlalchemy.engine import Engine
+
+        self.count = 0
+        self.target = engine if engine is not None else Engine
+        event.listen(self.target, "before_cursor_execute", self._before)
+
+    def _before(self, *args, **kwargs):
+        self.count += 1
+
+    def close(self):
+        event.remove(self.target, "before_cursor_execute", self._before)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an unsorted list."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class Recorder(object):
+    """Collects latency and query counts per named stage."""
+
+    def __init__(self, counter):
+        self.counter = counter
+        self.samples = {}
+
+    def record(self, name, seconds, queries):
+        stage = self.samples.setdefault(name, {"latency": [], "queries": 0})
+        stage["latency"].append(seconds)
+        stage["queries"] += queries
+
+    def wrap(self, name, func):
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            queries = self.counter.count
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(
+                    name, time.perf_counter() - start, self.counter.count - queries
+                )
+
+        return timed
+
+    def instrument(self, obj, method, name):
+        setattr(obj, method, self.wrap(name, getattr(obj, method)))
+
+    def summary(self):
+        result = {}
+        for name, stage in self.samples.items():
+            latency = stage["latency"]
+            total = sum(latency)
+            result[name] = {
+                "calls": len(latency),
+                "total_s": total,
+                "ops_per_s": len(latency) / total if total > 0 else 0.0,
+                "queries_per_op": stage["queries"] / len(latency) if latency else 0.0,
+                "p50_ms": percentile(latency, 50) * 1000,
+                "p99_ms": percentile(latency, 99) * 1000,
+            }
+        return result
+
+
+def print_summary(summary, title):
+    print(title)
+    print(
+        f"{'stage':<40} {'calls':>8} {'ops/s':>10} {'q/op':>8} {'p50 ms':>9} {'p99 ms':>9}"
+    )
+    for name in sorted(summary):
+        s = summary[name]
+        print(
+            f"{name:<40} {s['calls']:>8} {s['ops_per_s']:>10.1f} {s['queries_per_op']:>8.2f} {s['p50_ms']:>9.2f} {s['p99_ms']:>9.2f}"
+        )
+
+
+def write_results(path, results):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
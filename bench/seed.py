@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Seed a database with synthetic tokens, posts, votes, follows and reblogs.
+
+Accounts and posts are fully determined by the arguments, so bench.bench_api
+can rebuild the plan to generate request traces for a database seeded earlier:
+
+    python -m bench.seed --database postgresql://postgres@localhost/engine_bench --posts 5000
+"""
+
+import argparse
+import json
+import random
+import time
+from builtins import object
+from datetime import datetime, timedelta, timezone
+
+import dataset
+
+from bench.harness import SCHEMA_FILE
+from bench.workload import TAGS, WORDS, Zipf
+from engine.post_metadata_storage import thread_path_segment
+from engine.utils import _score, insert_rows
+
+HISTORY_TYPES = ["author_reward", "curation_reward"]
+
+
+class SeedPlan(object):
+    """Deterministic content of a seeded database."""
+
+    def __init__(
+        self,
+        seed=42,
+        tokens=2,
+        accounts=1000,
+        posts=5000,
+        votes_per_post=10,
+        follows_per_account=20,
+        reblog_ratio=0.1,
+        history_per_account=20,
+        reply_ratio=0.5,
+        now=None,
+    ):
+        self.rng = random.Random(seed)
+        self.now = (now or datetime.now(timezone.utc)).replace(
+            tzinfo=None, microsecond=0
+        )
+        self.tokens = [f"BENCH{i}" for i in range(tokens)]
+        self.accounts = [f"user{i:05d}" for i in range(accounts)]
+        self.authors = Zipf(self.rng, self.accounts)
+        self.readers = Zipf(
+            self.rng, self.rng.sample(self.accounts, len(self.accounts))
+        )
+        self.n_posts = posts
+        self.votes_per_post = votes_per_post
+        self.follows_per_account = follows_per_account
+        self.reblog_ratio = reblog_ratio
+        self.history_per_account = history_per_account
+        self.reply_ratio = reply_ratio
+        self.posts = self._plan_posts()
+        self.root_posts = [p for p in self.posts if p["parent"] is None]
+
+    def _plan_posts(self):
+        posts = []
+        ages = sorted(
+            (self.rng.uniform(0, 30 * 86400) for _ in range(self.n_posts)),
+            reverse=True,
+        )
+        for i, age in enumerate(ages):
+            parent = None
+            if posts and self.rng.random() < self.reply_ratio:
+                parent = posts[max(0, len(posts) - 1 - int(self.rng.expovariate(0.02)))]
+            root = parent["root"] if parent else None
+            author = self.authors.draw()
+            post = {
+                "author": author,
+                "permlink": f"seed-post-{i}",
+                "authorperm": f"@{author}/seed-post-{i}",
+                "parent": parent,
+                "created": self.now - timedelta(seconds=age),
+                "tags": self.rng.sample(TAGS, 3),
+            }
+            post["root"] = root or post
+            if parent is not None:
+                post["tokens"] = parent["tokens"]
+                post["depth"] = parent["depth"] + 1
+                parent["children"] += 1
+            else:
+                post["tokens"] = (
+                    self.rng.sample(self.tokens, 2)
+                    if len(self.tokens) > 1 and self.rng.random() < 0.2
+                    else [self.rng.choice(self.tokens)]
+                )
+                post["depth"] = 0
+            post["children"] = 0
+            posts.append(post)
+        return posts
+
+    def _text(self, low, high):
+        return " ".join(
+            self.rng.choice(WORDS) for _ in range(self.rng.randint(low, high))
+        )
+
+    def tables(self):
+        """Yield (table, rows) batches in insertion order."""
+        yield (
+            "token_config",
+            [{"token": t, "reward_pool_id": i + 1} for i, t in enumerate(self.tokens)],
+        )
+        yield (
+            "accounts",
+            [
+                {"name": a, "symbol": t, "last_follow_refresh_time": self.now}
+                for a in self.accounts
+                for t in self.tokens
+            ],
+        )
+
+        follows = {}
+        for follower in self.accounts:
+            for _ in range(self.rng.randint(0, 2 * self.follows_per_account)):
+                following = self.authors.draw()
+                if following != follower:
+                    follows[(follower, following)] = (
+                        2 if self.rng.random() < 0.02 else 1
+                    )
+        yield (
+            "follows",
+            [
+                {"follower": f, "following": g, "state": s}
+                for (f, g), s in follows.items()
+            ],
+        )
+
+        posts, metadata, votes = [], [], []
+        for p in self.posts:
+            root = p["root"]
+            body = self._text(50, 400)
+            p["sort_path"] = thread_path_segment(p["authorperm"], p["created"])
+            if p["parent"]:
+                p["sort_path"] = f"{p['parent']['sort_path']}.{p['sort_path']}"
+            metadata.append(
+                {
+                    "authorperm": p["authorperm"],
+                    "body": body,
+                    "json_metadata": json.dumps(
+                        {"tags": p["tags"], "app": "bench/1.0", "format": "markdown"}
+                    ),
+                    "tags": ",".join(p["tags"]),
+                    "children": p["children"],
+                    "parent_authorperm": p["parent"]["authorperm"]
+                    if p["parent"]
+                    else None,
+                    "url": f"/{root['tags'][0]}/{root['authorperm']}",
+                    "depth": p["depth"],
+                    "root_authorperm": root["authorperm"],
+                    "sort_path": p["sort_path"],
+                }
+            )
+            voters = {
+                self.readers.draw()
+                for _ in range(
+                    int(self.rng.paretovariate(1.5) * self.votes_per_post / 3)
+                )
+            }
+            for token in p["tokens"]:
+                rshares = 0
+                for voter in voters:
+                    vote_rshares = self.rng.randint(1, 10**9)
+                    rshares += vote_rshares
+                    votes.append(
+                        {
+                            "authorperm": p["authorperm"],
+                            "voter": voter,
+                            "token": token,
+                            "timestamp": p["created"]
+                            + timedelta(seconds=self.rng.randint(1, 86400)),
+                            "rshares": vote_rshares,
+                            "percent": 10000,
+                        }
+                    )
+                cashout_time = p["created"] + timedelta(days=7)
+                paid_out = cashout_time < self.now
+                created_ts = p["created"].replace(tzinfo=timezone.utc).timestamp()
+                posts.append(
+                    {
+                        "authorperm": p["authorperm"],
+                        "author": p["author"],
+                        "created": p["created"],
+                        "tags": ",".join(p["tags"]),
+                        "app": "bench/1.0",
+                        "format": "markdown",
+                        "main_post": p["parent"] is None,
+                        "token": token,
+                        "vote_rshares": 0 if paid_out else rshares,
+                        "cashout_time": cashout_time,
+                        "last_payout": cashout_time
+                        if paid_out
+                        else datetime(1970, 1, 1),
+                        "total_payout_value": self.rng.uniform(0, 100)
+                        if paid_out
+                        else 0,
+                        "score_trend": 0
+                        if paid_out
+                        else _score(rshares, created_ts, 480000),
+                        "score_hot": 0
+                        if paid_out
+                        else _score(rshares, created_ts, 10000),
+                        "promoted": self.rng.choice([0] * 30 + [1, 10]),
+                        "title": self._text(3, 10) if p["parent"] is None else "",
+                        "desc": body[:300],
+                        "children": p["children"],
+                        "parent_author": p["parent"]["author"] if p["parent"] else "",
+                        "parent_permlink": p["parent"]["permlink"]
+                        if p["parent"]
+                        else p["tags"][0],
+                    }
+                )
+        yield "posts", posts
+        yield "post_metadata", metadata
+        yield "votes", votes
+
+        reblogs = set()
+        for p in self.root_posts:
+            if self.rng.random() < self.reblog_ratio:
+                for _ in range(self.rng.randint(1, 5)):
+                    account = self.readers.draw()
+                    if account != p["author"]:
+                        reblogs.add((account, p["authorperm"], p["created"]))
+        yield (
+            "reblogs",
+            [
+                {"account": a, "authorperm": ap, "timestamp": ts + timedelta(hours=1)}
+                for a, ap, ts in reblogs
+            ],
+        )
+
+        history = []
+        for account in self.accounts:
+            for _ in range(self.rng.randint(0, 2 * self.history_per_account)):
+                p = self.rng.choice(self.posts)
+                history.append(
+                    {
+                        "account": account,
+                        "token": self.rng.choice(p["tokens"]),
+                        "timestamp": p["created"] + timedelta(days=7),
+                        "quantity": round(self.rng.uniform(0, 10), 8),
+                        "type": self.rng.choice(HISTORY_TYPES),
+                        "authorperm": p["authorperm"],
+                        "trx": f"{self.rng.getrandbits(64):016x}",
+                    }
+                )
+        yield "account_history", history
+
+
+def load_schema(databaseConnector):
+    db = dataset.connect(databaseConnector, ensure_schema=False)
+    try:
+        with open(SCHEMA_FILE) as f:
+            db.executable.exec_driver_sql(f.read())
+    finally:
+        db.executable.close()
+
+
+def seed_database(db, plan):
+    """Insert the plan; returns the number of rows per table."""
+    counts = {}
+    db.begin()
+    for table, rows in plan.tables():
+        insert_rows(db, table, rows)
+        counts[table] = counts.get(table, 0) + len(rows)
+    db.query(
+        "UPDATE configuration SET last_streamed_timestamp = :now, "
+        "last_engine_streamed_timestamp = :now, last_engine_streamed_block = 1",
+        now=plan.now,
+    )
+    db.commit()
+    db.query("ANALYZE")
+    return counts
+
+
+def add_plan_arguments(parser):
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--tokens", type=int, default=2)
+    parser.add_argument("--accounts", type=int, default=1000)
+    parser.add_argument("--posts", type=int, default=5000)
+    parser.add_argument("--votes-per-post", type=int, default=10)
+    parser.add_argument("--follows-per-account", type=int, default=20)
+
+
+def plan_from_args(args):
+    return SeedPlan(
+        seed=args.seed,
+        tokens=args.tokens,
+        accounts=args.accounts,
+        posts=args.posts,
+        votes_per_post=args.votes_per_post,
+        follows_per_account=args.follows_per_account,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed a database for benchmarks.")
+    parser.add_argument("--database", required=True, help="Database connector")
+    parser.add_argument(
+        "--schema", action="store_true", help="Load sql/engine.sql first"
+    )
+    add_plan_arguments(parser)
+    args = parser.parse_args()
+
+    plan = plan_from_args(args)
+    if args.schema:
+        load_schema(args.database)
+    db = dataset.connect(args.database, ensure_schema=False)
+    start_time = time.time()
+    counts = seed_database(db, plan)
+    for table, count in counts.items():
+        print(f"{table}: {count} rows")
+    print(f"Seeding took {time.time() - start_time:.2f} s")
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Fail when a post listing query reads a table with a sequential scan.
+
+Seeds a throwaway database and runs EXPLAIN ANALYZE on every variant of
+engine.post_queries. Sequential scans are disabled in the session unless
+--planner-defaults is given, so on a small seed a Seq Scan in a plan means
+that no index matches the query at all:
+
+    python -m bench.verify_query_plans --posts 2000
+
+With --migrations the scratch database is brought up to date by
+sql/migrations instead of being created from the current sql/engine.sql,
+to check an upgraded installation.
+"""
+
+import argparse
+import os
+import sys
+
+from bench.bench_queries import sample_params
+from bench.harness import connect, throwaway_database
+from bench.seed import add_plan_arguments, plan_from_args, seed_database
+from engine import post_queries
+from engine.migrations import MigrationRunner
+
+
+def seq_scans(node):
+    """Relations read by Seq Scan nodes of an EXPLAIN (FORMAT JSON) plan."""
+    relations = []
+    if node["Node Type"] == "Seq Scan":
+        relations.append(node["Relation Name"])
+    for child in node.get("Plans", []):
+        relations.extend(seq_scans(child))
+    return relations
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that no listing query needs a sequential scan."
+    )
+    parser.add_argument(
+        "--server",
+        default=os.environ.get(
+            "BENCH_DATABASE", "postgresql://postgres@localhost/postgres"
+        ),
+        help="Connector of any database on the Postgres server to use",
+    )
+    add_plan_arguments(parser)
+    parser.add_argument(
+        "--listing",
+        action="append",
+        choices=sorted(post_queries.LISTINGS),
+        help="Only these listings (repeatable)",
+    )
+    parser.add_argument(
+        "--planner-defaults",
+        action="store_true",
+        help="Keep enable_seqscan on, for seeds large enough to plan like production",
+    )
+    parser.add_argument(
+        "--migrations",
+        action="store_true",
+        help="Apply sql/migrations to the scratch database before seeding",
+    )
+    args = parser.parse_args()
+
+    plan = plan_from_args(args)
+    failures = []
+    checked = 0
+    with throwaway_database(args.server) as databaseConnector:
+        if args.migrations:
+            runner = MigrationRunner(databaseConnector)
+            try:
+                runner.migrate()
+            finally:
+                runner.close()
+        db = connect(databaseConnector)
+        seed_database(db, plan)
+        if not args.planner_defaults:
+            db.query("SET enable_seqscan = off")
+        params = sample_params(plan)
+        for name, flags in post_queries.variants(args.listing):
+            result = post_queries.explain(db, name, params, **flags)
+            checked += 1
+            relations = seq_scans(result["plan"])
+            if relations:
+                failures.append((result["variant"], relations))
+        db.executable.close()
+
+    for variant, relations in failures:
+        print(f"FAIL {variant}: Seq Scan on {', '.join(sorted(set(relations)))}")
+    print(f"{checked} listing variants checked, {len(failures)} with sequential scans")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,370 @@
+# This Python file uses the following encoding: utf-8
+
+import bisect
+import itertools
+import json
+import random
+from builtins import object
+from datetime import datetime, timedelta, timezone
+
+from diff_match_patch import diff_match_patch
+
+WORDS = (
+    "hive engine token stake vote reward curation post reply tribe market "
+    "block witness chain night photo travel music crypto game art music food "
+    "garden coffee city mountain river code python update release weekly "
+    "contest community support delegation power down market price chart"
+).split()
+TAGS = ["hive", "photography", "travel", "crypto", "gaming", "art", "music", "food"]
+NOISE_IDS = [
+    "sm_find_match",
+    "sm_submit_team",
+    "community",
+    "notify",
+    "ssc-mainnet-hive",
+    "pp_video_upload",
+]
+HIVE_BLOCK_START = 90000000
+ENGINE_BLOCK_START = 80000000
+BLOCK_SECONDS = 3
+
+
+class Zipf(object):
+    """Draws items with a Zipf-like skew, so a few accounts and posts dominate."""
+
+    def __init__(self, rng, items, exponent=1.1):
+        self.rng = rng
+        self.items = list(items)
+        self.cum_weights = list(
+            itertools.accumulate(
+                1.0 / (rank**exponent) for rank in range(1, len(self.items) + 1)
+            )
+        )
+
+    def draw(self):
+        x = self.rng.random() * self.cum_weights[-1]
+        return self.items[bisect.bisect_left(self.cum_weights, x)]
+
+
+class SyntheticWorkload(object):
+    """Seeded generator of matching Hive ops and sidechain blocks.
+
+    The engine blocks create the posts (newComment), vote on them in bursts,
+    promote some of them and pay out the older ones. The Hive ops carry the
+    matching comment ops, diff_match_patch edits and follow / reblog custom_json
+    mixed with custom_json ids no processor handles, as on mainnet.
+    """
+
+    def __init__(
+        self,
+        seed=42,
+        tokens=2,
+        accounts=500,
+        posts=300,
+        votes_per_post=8,
+        reply_ratio=0.4,
+        edit_ratio=0.3,
+        multi_token_ratio=0.2,
+        payout_ratio=0.5,
+        promotion_ratio=0.05,
+        noise_per_block=15,
+        start=None,
+    ):
+        self.rng = random.Random(seed)
+        self.dmp = diff_match_patch()
+        self.tokens = [f"BENCH{i}" for i in range(tokens)]
+        self.accounts = [f"user{i:05d}" for i in range(accounts)]
+        self.n_posts = posts
+        self.votes_per_post = votes_per_post
+        self.reply_ratio = reply_ratio
+        self.edit_ratio = edit_ratio
+        self.multi_token_ratio = multi_token_ratio
+        self.payout_ratio = payout_ratio
+        self.promotion_ratio = promotion_ratio
+        self.noise_per_block = noise_per_block
+        self.start = start or datetime(2026, 1, 1, tzinfo=timezone.utc)
+        self.authors = Zipf(self.rng, self.accounts)
+        self.voters = Zipf(self.rng, self.rng.sample(self.accounts, len(self.accounts)))
+        self.posts = self._plan_posts()
+
+    def token_config_rows(self):
+        return [
+            {
+                "token": token,
+                "reward_pool_id": i + 1,
+                "promoted_post_account": "null",
+                "cashout_window_days": 7,
+            }
+            for i, token in enumerate(self.tokens)
+        ]
+
+    def _text(self, low, high):
+        return " ".join(
+            self.rng.choice(WORDS) for _ in range(self.rng.randint(low, high))
+        )
+
+    def _plan_posts(self):
+        posts = []
+        for i in range(self.n_posts):
+            parent = None
+            if posts and self.rng.random() < self.reply_ratio:
+                # replies cluster on recent posts
+                parent = posts[max(0, len(posts) - 1 - int(self.rng.expovariate(0.1)))]
+            if parent is not None:
+                tokens = parent["tokens"]
+            elif self.rng.random() < self.multi_token_ratio and len(self.tokens) > 1:
+                tokens = self.rng.sample(self.tokens, 2)
+            else:
+                tokens = [self.rng.choice(self.tokens)]
+            posts.append(
+                {
+                    "author": self.authors.draw(),
+                    "permlink": f"bench-post-{i}",
+                    "parent": parent,
+                    "tokens": tokens,
+                    "title": self._text(3, 10) if parent is None else "",
+                    "body": self._text(50, 400),
+                    "tags": self.rng.sample(TAGS, 3),
+                    "votes": max(
+                        0, int(self.rng.paretovariate(1.5) * self.votes_per_post / 3)
+                    ),
+                }
+            )
+        return posts
+
+    @staticmethod
+    def authorperm(post):
+        return f"@{post['author']}/{post['permlink']}"
+
+    def _engine_op(self, action, payload, sender, events, contract="comments"):
+        return {
+            "contract": contract,
+            "action": action,
+            "sender": sender,
+            "payload": json.dumps(payload),
+            "logs": json.dumps({"events": events}),
+            "transactionId": f"{self.rng.getrandbits(64):016x}",
+        }
+
+    def _vote_op(self, post, voter, update=False):
+        events = [
+            {
+                "contract": "comments",
+                "event": "updateVote" if update else "newVote",
+                "data": {"symbol": token, "rshares": str(self.rng.randint(1, 10**6))},
+            }
+            for token in post["tokens"]
+        ]
+        payload = {
+            "voter": voter,
+            "author": post["author"],
+            "permlink": post["permlink"],
+            "weight": self.rng.choice([10000, 10000, 5000, 2500, 100]),
+        }
+        return self._engine_op("vote", payload, voter, events)
+
+    def _payout_events(self, post, voters):
+        events = []
+        for token in post["tokens"]:
+            data = {"symbol": token, "authorperm": self.authorperm(post)}
+            events.append(
+                {
+                    "contract": "comments",
+                    "event": "authorReward",
+                    "data": dict(
+                        data,
+                        account=post["author"],
+                        quantity=f"{self.rng.uniform(0, 50):.8f}",
+                    ),
+                }
+            )
+            for voter in voters:
+                events.append(
+                    {
+                        "contract": "comments",
+                        "event": "curationReward",
+                        "data": dict(
+                            data,
+                            account=voter,
+                            quantity=f"{self.rng.uniform(0, 5):.8f}",
+                        ),
+                    }
+                )
+            if self.rng.random() < 0.2:
+                events.append(
+                    {
+                        "contract": "comments",
+                        "event": "beneficiaryReward",
+                        "data": dict(
+                            data,
+                            account=self.rng.choice(self.accounts),
+                            quantity=f"{self.rng.uniform(0, 5):.8f}",
+                        ),
+                    }
+                )
+        return events
+
+    def engine_blocks(self, txs_per_block=10):
+        """Sidechain blocks in the format of get_block_info."""
+        transactions = []
+        voters_of = {}
+        for post in self.posts:
+            author = post["author"]
+            payload = {
+                "author": author,
+                "permlink": post["permlink"],
+                "rewardPools": [],
+            }
+            events = [
+                {
+                    "contract": "comments",
+                    "event": "newComment",
+                    "data": {"symbol": token},
+                }
+                for token in post["tokens"]
+            ]
+            transactions.append(self._engine_op("comment", payload, author, events))
+            # vote burst right after the post was created
+            voters = voters_of.setdefault(self.authorperm(post), [])
+            for _ in range(post["votes"]):
+                voter = self.voters.draw()
+                transactions.append(self._vote_op(post, voter, update=voter in voters))
+                voters.append(voter)
+            if self.rng.random() < self.promotion_ratio:
+                token = post["tokens"][0]
+                payload = {
+                    "symbol": token,
+                    "to": "null",
+                    "quantity": f"{self.rng.uniform(1, 100):.3f}",
+                    "memo": self.authorperm(post),
+                }
+                events = [{"contract": "tokens", "event": "transfer", "data": payload}]
+                transactions.append(
+                    self._engine_op(
+                        "transfer", payload, author, events, contract="tokens"
+                    )
+                )
+
+        # payouts arrive with later votes
+        for post in self.posts:
+            if self.rng.random() >= self.payout_ratio:
+                continue
+            voters = sorted(set(voters_of[self.authorperm(post)]))
+            op = self._vote_op(self.rng.choice(self.posts), self.voters.draw())
+            logs = json.loads(op["logs"])
+            logs["events"] = self._payout_events(post, voters) + logs["events"]
+            op["logs"] = json.dumps(logs)
+            transactions.append(op)
+
+        blocks = []
+        for i in range(0, len(transactions), txs_per_block):
+            n = len(blocks)
+            blocks.append(
+                {
+                    "blockNumber": ENGINE_BLOCK_START + n,
+                    "timestamp": (
+                        self.start + timedelta(seconds=BLOCK_SECONDS * n)
+                    ).strftime("%Y-%m-%dT%H:%M:%S"),
+                    "transactions": transactions[i : i + txs_per_block],
+                    "virtualTransactions": [],
+                }
+            )
+        return blocks
+
+    def _comment_op(self, post, body):
+        parent = post["parent"]
+        return {
+            "type": "comment",
+            "author": post["author"],
+            "permlink": post["permlink"],
+            "parent_author": parent["author"] if parent else "",
+            "parent_permlink": parent["permlink"] if parent else post["tags"][0],
+            "title": post["title"],
+            "body": body,
+            "json_metadata": json.dumps(
+                {"tags": post["tags"], "app": "bench/1.0", "format": "markdown"}
+            ),
+        }
+
+    def _custom_json_op(self, id, user, data):
+        return {
+            "type": "custom_json",
+            "id": id,
+            "json": json.dumps(data),
+            "required_auths": [],
+            "required_posting_auths": [user],
+        }
+
+    def _edit(self, post):
+        words = post["body"].split()
+        for _ in range(self.rng.randint(1, 5)):
+            words[self.rng.randrange(len(words))] = self.rng.choice(WORDS)
+        new_body = " ".join(words) + "\n\nEdit: " + self._text(5, 30)
+        patch = self.dmp.patch_toText(self.dmp.patch_make(post["body"], new_body))
+        post["body"] = new_body
+        return patch
+
+    def hive_ops(self, posts_per_block=3):
+        """Virtual op stream in the format of Blockchain.stream."""
+        blocks = []
+        root_posts = [p for p in self.posts if p["parent"] is None]
+        for i in range(0, len(self.posts), posts_per_block):
+            ops = [
+                self._comment_op(post, post["body"])
+                for post in self.posts[i : i + posts_per_block]
+            ]
+            # edits only touch posts from earlier blocks
+            created = self.posts[:i]
+            for post in self.rng.sample(created, min(len(created), posts_per_block)):
+                if self.rng.random() < self.edit_ratio:
+                    ops.append(self._comment_op(post, self._edit(post)))
+            user = self.voters.draw()
+            ops.append(
+                self._custom_json_op(
+                    "follow",
+                    user,
+                    [
+                        "follow",
+                        {
+                            "follower": user,
+                            "following": self.authors.draw(),
+                            "what": [self.rng.choice(["blog", "blog", "ignore", ""])],
+                        },
+                    ],
+                )
+            )
+            post = self.rng.choice(root_posts)
+            user = self.voters.draw()
+            ops.append(
+                self._custom_json_op(
+                    self.rng.choice(["follow", "reblog"]),
+                    user,
+                    [
+                        "reblog",
+                        {
+                            "account": user,
+                            "author": post["author"],
+                            "permlink": post["permlink"],
+                        },
+                    ],
+                )
+            )
+            for _ in range(self.noise_per_block):
+                ops.append(
+                    self._custom_json_op(
+                        self.rng.choice(NOISE_IDS),
+                        self.voters.draw(),
+                        {"data": self._text(2, 20)},
+                    )
+                )
+            self.rng.shuffle(ops)
+            blocks.append(ops)
+
+        stream = []
+        for n, ops in enumerate(blocks):
+            timestamp = self.start + timedelta(seconds=BLOCK_SECONDS * n)
+            for op in ops:
+                op["block_num"] = HIVE_BLOCK_START + n
+                op["timestamp"] = timestamp
+                stream.append(op)
+        return stream
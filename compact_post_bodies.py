@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse
+import logging
+import time
+import traceback
+
+import dataset
+
+from engine.post_body_storage import PostBodyStorage
+from engine.utils import initialize_config, setup_logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logging.basicConfig()
+
+
+def compact_bodies(postBodyStorage, threshold, batch_size):
+    """Squash the patch logs of posts with at least threshold patches."""
+    compacted = 0
+    skipped = set()
+    while True:
+        candidates = [
+            authorperm
+            for authorperm in postBodyStorage.get_compaction_candidates(
+                threshold, limit=batch_size + len(skipped)
+            )
+            if authorperm not in skipped
+        ]
+        if not candidates:
+            return compacted
+        for authorperm in candidates:
+            try:
+                if postBodyStorage.compact(authorperm):
+                    compacted += 1
+                else:
+                    # edited while we were at it, retry on the next pass
+                    skipped.add(authorperm)
+            except Exception:
+                traceback.print_exc()
+                skipped.add(authorperm)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Fold logged post edit patches back into the stored bodies."
+    )
+    parser.add_argument(
+        "--threshold",
+        type=int,
+        default=20,
+        help="Compact posts with at least this many patches",
+    )
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=0,
+        help="Keep running and compact every INTERVAL seconds (default: run once)",
+    )
+    args = parser.parse_args()
+
+    setup_logging("logger.json")
+
+    config_file = "config.json"
+    config_data = initialize_config(config_file)
+
+    db = dataset.connect(config_data["databaseConnector"], ensure_schema=False)
+    postBodyStorage = PostBodyStorage(db)
+
+    while True:
+        start_time = time.time()
+        compacted = compact_bodies(postBodyStorage, args.threshold, args.batch_size)
+        if compacted:
+            logger.info(
+                "Compacted %d post bodies in %.2f s",
+                compacted,
+                time.time() - start_time,
+            )
+        if args.interval <= 0:
+            break
+        time.sleep(args.interval)
@@ -2,6 +2,8 @@
 import logging
 from builtins import object
 
+from engine.utils import insert_rows
+
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 log.addHandler(logging.StreamHandler())
@@ -37,6 +39,13 @@ class AccountHistoryTrx(object):
         table = self.db[self.__tablename__]
         table.insert(data)
 
+    def insert_batch(self, data):
+        """Append rows with a single multi-row INSERT.
+
+        account_history is append-only, so no lookup before the write is needed.
+        """
+        insert_rows(self.db, self.__tablename__, data)
+
     def add_batch(self, data):
         """Add a new data set"""
         table = self.db[self.__tablename__]
@@ -73,106 +82,80 @@ class AccountHistoryTrx(object):
         table = self.db[self.__tablename__]
         return table.find_one(account=account, token=token, order_by="-id")
 
+    def find_history(
+        self,
+        account,
+        token=None,
+        types=None,
+        author=None,
+        start_time=None,
+        end_time=None,
+        cursor=None,
+        limit=100,
+        offset=0,
+    ):
+        """Returns history newest first, filtered in SQL.
+
+        :param list types: only return these history types
+        :param tuple cursor: (timestamp, id) of the last row of the previous
+            page; only rows strictly older are returned
+        """
+        limit = min(limit, 1000)
+        clauses = ["account = :account"]
+        if token is not None:
+            clauses.append("token = :token")
+        if types:
+            clauses.append("type IN :types")
+        if author is not None:
+            clauses.append("authorperm LIKE :authorperm_prefix")
+        if start_time is not None:
+            clauses.append("timestamp >= :start_time")
+        if end_time is not None:
+            clauses.append("timestamp < :end_time")
+        cursor_timestamp, cursor_id = cursor if cursor is not None else (None, None)
+        if cursor is not None:
+            # timestamp bound first so the (account, token, timestamp) index is used
+            clauses.append(
+                "timestamp <= :cursor_timestamp AND (timestamp, id) < (:cursor_timestamp, :cursor_id)"
+            )
+        return self.db.query(
+            f"SELECT * FROM account_history WHERE {' AND '.join(clauses)} ORDER BY timestamp DESC, id DESC LIMIT :limit OFFSET :offset",
+            account=account,
+            token=token,
+            types=tuple(types) if types else None,
+            authorperm_prefix=f"@{author}/%",
+            start_time=start_time,
+            end_time=end_time,
+            cursor_timestamp=cursor_timestamp,
+            cursor_id=cursor_id,
+            limit=limit,
+            offset=offset,
+        )
+
     def get_history(self, account, limit=1000, offset=0, hist_type=None, author=None):
-        table = self.db[self.__tablename__]
-        ret = []
-        if limit > 1000:
-            limit = 1000
-
-        index = 0
-        if hist_type is None and author is None:
-            for data in table.find(
-                account=account, order_by="-timestamp", _limit=limit + offset
-            ):
-                if index >= offset and len(ret) < limit:
-                    ret.append(data)
-                index += 1
-        elif hist_type is None and author is not None:
-            for data in table.find(
-                account=account,
-                author=author,
-                order_by="-timestamp",
-                _limit=limit + offset,
-            ):
-                if index >= offset and len(ret) < limit:
-                    ret.append(data)
-                index += 1
-        elif hist_type is not None and author is None:
-            for data in table.find(
-                account=account,
-                type=hist_type,
-                order_by="-timestamp",
-                _limit=limit + offset,
-            ):
-                if index >= offset and len(ret) < limit:
-                    ret.append(data)
-                index += 1
-        else:
-            for data in table.find(
-                account=account,
-                type=hist_type,
+        return list(
+            self.find_history(
+                account,
+                types=[hist_type] if hist_type is not None else None,
                 author=author,
-                order_by="-timestamp",
-                _limit=limit + offset,
-            ):
-                if index >= offset and len(ret) < limit:
-                    ret.append(data)
-                index += 1
-        return ret
+                limit=limit,
+                offset=offset,
+            )
+        )
 
     def get_token_history(
         self, token, account, limit=1000, offset=0, hist_type=None, author=None
     ):
-        table = self.db[self.__tablename__]
-        ret = []
-        if limit > 1000:
-            limit = 1000
-        index = 0
-        if hist_type is None and author is None:
-            for data in table.find(
-                account=account,
-                token=token,
-                order_by="-timestamp",
-                _limit=limit + offset,
-            ):
-                if index >= offset and len(ret) < limit:
-                    ret.append(data)
-                index += 1
-        elif hist_type is None and author is not None:
-            for data in table.find(
-                account=account,
-                token=token,
-                author=author,
-                order_by="-timestamp",
-                _limit=limit + offset,
-            ):
-                if index >= offset and len(ret) < limit:
-                    ret.append(data)
-                index += 1
-        elif hist_type is not None and author is None:
-            for data in table.find(
-                account=account,
-                token=token,
-                type=hist_type,
-                order_by="-timestamp",
-                _limit=limit + offset,
-            ):
-                if index >= offset and len(ret) < limit:
-                    ret.append(data)
-                index += 1
-        else:
-            for data in table.find(
-                account=account,
+        return list(
+            self.find_history(
+                account,
                 token=token,
-                type=hist_type,
+                types=[hist_type] if hist_type is not None else None,
                 author=author,
-                order_by="-timestamp",
-                _limit=limit + offset,
-            ):
-                if index >= offset and len(ret) < limit:
-                    ret.append(data)
-                index += 1
-        return ret
+                limit=limit,
+                offset=offset,
+            )
+        )
 
     def delete(self, token, account, hist_id):
         table = self.db[self.__tablename__]
@@ -0,0 +1,92 @@
+# This Python file uses the following encoding: utf-8
+
+import json
+import logging
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+log.addHandler(logging.StreamHandler())
+
+# parsed fields are kept on the op dict under this key
+DECODED_KEY = "_decoded"
+
+_orjson = orjson
+
+
+def backend():
+    """Name of the JSON library in use."""
+    return "orjson" if _orjson is not None else "json"
+
+
+def set_backend(name):
+    """Switch between orjson and json, e.g. to compare them in benchmarks."""
+    global _orjson
+    if name == "orjson" and orjson is None:
+        raise ValueError("orjson is not installed")
+    if name not in ("orjson", "json"):
+        raise ValueError(f"Unknown JSON backend {name}")
+    _orjson = orjson if name == "orjson" else None
+
+
+def loads(data):
+    """Parse a JSON document with orjson when it is installed."""
+    if _orjson is not None:
+        try:
+            return _orjson.loads(data)
+        except _orjson.JSONDecodeError:
+            # NaN, Infinity and integers beyond 64 bit are only read by json
+            pass
+    return json.loads(data)
+
+
+def dumps(obj):
+    """Serialize to a str with orjson when it is installed."""
+    if _orjson is not None:
+        try:
+            return _orjson.dumps(obj).decode()
+        except _orjson.JSONEncodeError:
+            # non-str keys and integers beyond 64 bit
+            pass
+    return json.dumps(obj)
+
+
+def decode_json(data):
+    """Parse a JSON document, unwrapping a payload that was encoded twice."""
+    value = loads(data)
+    if isinstance(value, str):
+        return loads(value), True
+    return value, False
+
+
+def decode_field(op, key):
+    """Parsed value of a JSON string field of an op.
+
+    Each field is parsed once per op, later calls return the same object, so
+    the stream and its processors can all ask for it. Invalid JSON raises
+    ValueError on every call.
+    """
+    decoded = op.get(DECODED_KEY)
+    if decoded is None:
+        decoded = op[DECODED_KEY] = {}
+    if key not in decoded:
+        try:
+            decoded[key] = decode_json(op[key])
+        except ValueError as e:
+            decoded[key] = e
+    value = decoded[key]
+    if isinstance(value, ValueError):
+        raise value
+    return value[0]
+
+
+def encode_field(op, key, value):
+    """Text of value for storage, the field as it came when it parses to value."""
+    decoded = (op.get(DECODED_KEY) or {}).get(key)
+    if isinstance(decoded, tuple) and decoded[0] is value and not decoded[1]:
+        return op[key]
+    return dumps(value)
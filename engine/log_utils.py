@@ -0,0 +1,104 @@
+# This Python file uses the following encoding: utf-8
+
+import logging
+import threading
+import time
+from builtins import object
+
+
+class StructuredFormatter(logging.Formatter):
+    """Appends the ``fields`` passed in ``extra`` as sorted key=value pairs."""
+
+    def format(self, record):
+        message = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            message += " " + " ".join(f"{k}={fields[k]}" for k in sorted(fields))
+        return message
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per logger and message template.
+
+    Records at or above ``max_level`` always pass. Below it, each template
+    may emit ``burst`` records at once and ``rate`` records per second after
+    that; the next record that passes reports how many were dropped.
+    A record logged with ``extra={"sample": n}`` is additionally sampled,
+    so only every n-th record of that template is considered.
+    """
+
+    def __init__(self, rate=1.0, burst=10, max_level="WARNING"):
+        super().__init__()
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.max_level = logging.getLevelName(max_level)
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+    def filter(self, record):
+        if record.levelno >= self.max_level:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = {
+                    "tokens": self.burst,
+                    "updated": now,
+                    "seen": 0,
+                    "dropped": 0,
+                }
+            bucket["seen"] += 1
+            sample = getattr(record, "sample", 1)
+            if sample > 1 and bucket["seen"] % sample != 1:
+                bucket["dropped"] += 1
+                return False
+            bucket["tokens"] = min(
+                self.burst, bucket["tokens"] + (now - bucket["updated"]) * self.rate
+            )
+            bucket["updated"] = now
+            if bucket["tokens"] < 1:
+                bucket["dropped"] += 1
+                return False
+            bucket["tokens"] -= 1
+            dropped, bucket["dropped"] = bucket["dropped"], 0
+        if dropped:
+            record.msg = f"{record.msg} [{dropped} similar suppressed]"
+        return True
+
+
+class ProgressSummary(object):
+    """Collects per-block statistics and logs one summary line per interval."""
+
+    def __init__(self, logger, stream, interval=10.0):
+        self.logger = logger
+        self.stream = stream
+        self.interval = interval
+        self._reset(time.monotonic())
+
+    def _reset(self, now):
+        self.started = now
+        self.blocks = 0
+        self.ops = 0
+
+    def block(self, block_num, timestamp=None, ops=0, lag_seconds=None):
+        self.blocks += 1
+        self.ops += ops
+        now = time.monotonic()
+        elapsed = now - self.started
+        if elapsed < self.interval:
+            return
+        fields = {
+            "stream": self.stream,
+            "block": block_num,
+            "blocks": self.blocks,
+            "ops": self.ops,
+            "blocks_per_s": f"{self.blocks / elapsed:.1f}",
+        }
+        if timestamp is not None:
+            fields["timestamp"] = timestamp.isoformat()
+        if lag_seconds is not None:
+            fields["lag_s"] = int(lag_seconds)
+        self.logger.info("progress", extra={"fields": fields})
+        self._reset(now)
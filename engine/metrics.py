@@ -0,0 +1,261 @@
+# This Python file uses the following encoding: utf-8
+
+import logging
+import threading
+import time
+from builtins import object
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from sqlalchemy import event
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+log.addHandler(logging.StreamHandler())
+
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(object):
+    """Base class of labelled metrics kept in process memory."""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, key, value) for key, value in self.values.items()]
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for name, key, value in self.samples():
+            lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None
+    ):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        result = []
+        with self.lock:
+            for key, (counts, total, count) in self.values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    result.append(
+                        (
+                            f"{self.name}_bucket",
+                            key + (("le", _format_value(bound)),),
+                            cumulative,
+                        )
+                    )
+                result.append((f"{self.name}_sum", key, total))
+                result.append((f"{self.name}_count", key, count))
+        return result
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# shared by both streamers, told apart by the stream label ("hive" / "engine")
+OPS = Counter("indexer_ops_total", "Operations processed by type", ["stream", "type"])
+BLOCKS = Counter("indexer_blocks_total", "Blocks processed", ["stream"])
+OPS_PER_BLOCK = Histogram(
+    "indexer_ops_per_block",
+    "Relevant operations per block",
+    ["stream"],
+    buckets=COUNT_BUCKETS,
+)
+FETCH_SECONDS = Histogram(
+    "indexer_fetch_seconds", "Time spent waiting for blocks from the node", ["stream"]
+)
+DECODE_SECONDS = Histogram(
+    "indexer_decode_seconds", "Time spent decoding JSON payloads", ["stream"]
+)
+PROCESSOR_SECONDS = Histogram(
+    "indexer_processor_seconds", "Time spent in each processor", ["processor"]
+)
+ROUTED_OPS = Counter(
+    "indexer_routed_ops_total",
+    "Operations by the route that handled them, or unhandled",
+    ["stream", "route"],
+)
+DB_SECONDS = Histogram(
+    "indexer_db_query_seconds", "Database statement latency", ["statement"]
+)
+LISTING_SECONDS = Histogram(
+    "api_listing_query_seconds", "Latency of the post listing queries", ["variant"]
+)
+LAG_BLOCKS = Gauge("indexer_lag_blocks", "Blocks behind the chain head", ["stream"])
+LAG_SECONDS = Gauge(
+    "indexer_lag_seconds", "Age of the last processed block", ["stream"]
+)
+LAST_BLOCK = Gauge("indexer_last_block", "Last processed block number", ["stream"])
+CACHE_LOOKUPS = Counter(
+    "cache_lookups_total", "Cache lookups by result", ["cache", "result"]
+)
+
+
+def track_db_time(engine, histogram=DB_SECONDS):
+    """Observe the latency of every statement sent through a SQLAlchemy engine."""
+
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+    def after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("metrics_query_start")
+        if not starts:
+            return
+        kind = statement.lstrip().split(None, 1)[0].upper() if statement else ""
+        histogram.observe(time.perf_counter() - starts.pop(), statement=kind)
+
+    event.listen(engine, "before_cursor_execute", before)
+    event.listen(engine, "after_cursor_execute", after)
+
+
+def timed_iter(iterable, histogram, **labels):
+    """Yield from iterable, observing how long each item took to arrive."""
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        histogram.observe(time.perf_counter() - start, **labels)
+        yield item
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """Serve /metrics in the Prometheus text format from a daemon thread."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    print(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,178 @@
+# This Python file uses the following encoding: utf-8
+
+import hashlib
+import logging
+import os
+import re
+from builtins import object
+
+import psycopg2
+
+from engine.notify import dsn_from_connector
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+log.addHandler(logging.StreamHandler())
+
+MIGRATIONS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "sql", "migrations"
+)
+# first line of migrations that run outside a transaction, e.g. to build
+# indexes concurrently; their statements are split at line ending semicolons
+NO_TRANSACTION = "-- migrate:no-transaction"
+# pg_advisory_lock key, so only one migrate.py works on a database at a time
+LOCK_KEY = 4708310
+
+MIGRATION_FILE = re.compile(r"^(\d{4})_(\w+)\.sql$")
+CONCURRENT_INDEX = re.compile(
+    r'^CREATE (?:UNIQUE )?INDEX CONCURRENTLY IF NOT EXISTS "?(\w+)"?', re.I
+)
+
+
+class Migration(object):
+    """One sql/migrations/NNNN_name.sql file."""
+
+    def __init__(self, path):
+        match = MIGRATION_FILE.match(os.path.basename(path))
+        if match is None:
+            raise ValueError(f"{path} is not named NNNN_name.sql")
+        self.version = int(match.group(1))
+        self.name = match.group(2)
+        self.path = path
+        with open(path) as f:
+            self.sql = f.read()
+        self.checksum = hashlib.md5(self.sql.encode()).hexdigest()
+
+    @property
+    def transactional(self):
+        return not self.sql.startswith(NO_TRANSACTION)
+
+    def statements(self):
+        """Statements of a no-transaction migration, without comment lines."""
+        lines = [
+            line for line in self.sql.splitlines() if not line.lstrip().startswith("--")
+        ]
+        return [
+            statement.strip()
+            for statement in re.split(r";\s*$", "\n".join(lines), flags=re.M)
+            if statement.strip()
+        ]
+
+
+def discover(directory=MIGRATIONS_DIR):
+    """Migrations of a directory ordered by version."""
+    migrations = [
+        Migration(os.path.join(directory, name))
+        for name in sorted(os.listdir(directory))
+        if name.endswith(".sql")
+    ]
+    versions = [migration.version for migration in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError(f"Duplicate migration versions in {directory}")
+    return migrations
+
+
+class MigrationRunner(object):
+    """Applies pending migrations and records them in schema_migrations."""
+
+    def __init__(self, databaseConnector, migrations=None):
+        self.conn = psycopg2.connect(dsn_from_connector(databaseConnector))
+        self.migrations = discover() if migrations is None else migrations
+
+    def close(self):
+        self.conn.close()
+
+    def ensure_table(self):
+        self.conn.autocommit = True
+        with self.conn.cursor() as cur:
+            cur.execute(
+                'CREATE TABLE IF NOT EXISTS "public"."schema_migrations" ("version" integer NOT NULL, "name" character varying(200) NOT NULL, "checksum" character(32) NOT NULL, "applied_at" timestamp DEFAULT now() NOT NULL, CONSTRAINT "schema_migrations_version" PRIMARY KEY ("version"))'
+            )
+
+    def applied(self):
+        """Rows of schema_migrations keyed by version."""
+        self.ensure_table()
+        with self.conn.cursor() as cur:
+            cur.execute(
+                "SELECT version, name, checksum, applied_at FROM schema_migrations"
+            )
+            return {
+                row[0]: {"name": row[1], "checksum": row[2], "applied_at": row[3]}
+                for row in cur.fetchall()
+            }
+
+    def status(self):
+        """(migration, applied row or None) of every migration."""
+        applied = self.applied()
+        return [
+            (migration, applied.get(migration.version)) for migration in self.migrations
+        ]
+
+    def pending(self, target=None):
+        applied = self.applied()
+        return [
+            migration
+            for migration in self.migrations
+            if migration.version not in applied
+            and (target is None or migration.version <= target)
+        ]
+
+    def _record(self, cur, migration):
+        cur.execute(
+            "INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s)",
+            (migration.version, migration.name, migration.checksum),
+        )
+
+    def apply(self, migration):
+        if migration.transactional:
+            self.conn.autocommit = False
+            try:
+                with self.conn.cursor() as cur:
+                    cur.execute(migration.sql)
+                    self._record(cur, migration)
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+            return
+        self.conn.autocommit = True
+        with self.conn.cursor() as cur:
+            for statement in migration.statements():
+                # Postgres refuses CONCURRENTLY on a partitioned table before
+                # looking at IF NOT EXISTS, so existing indexes are skipped here
+                match = CONCURRENT_INDEX.match(statement)
+                if match is not None:
+                    cur.execute("SELECT to_regclass(%s)", (match.group(1),))
+                    if cur.fetchone()[0] is not None:
+                        continue
+                cur.execute(statement)
+            # an interrupted CREATE INDEX CONCURRENTLY leaves an invalid index
+            # that IF NOT EXISTS would skip on the next run
+            cur.execute(
+                "SELECT indexrelid::regclass::text FROM pg_index WHERE NOT indisvalid"
+            )
+            invalid = [row[0] for row in cur.fetchall()]
+            if invalid:
+                raise RuntimeError(
+                    f"Invalid indexes after {migration.path}, drop them and rerun: {', '.join(invalid)}"
+                )
+            self._record(cur, migration)
+
+    def migrate(self, target=None, dry_run=False):
+        """Apply the pending migrations up to target and return them."""
+        self.ensure_table()
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_lock(%s)", (LOCK_KEY,))
+        try:
+            pending = self.pending(target)
+            for migration in pending:
+                if dry_run:
+                    log.info(f"Would apply {os.path.basename(migration.path)}")
+                    continue
+                log.info(f"Applying {os.path.basename(migration.path)}")
+                self.apply(migration)
+            return pending
+        finally:
+            self.conn.autocommit = True
+            with self.conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (LOCK_KEY,))
@@ -0,0 +1,89 @@
+# This Python file uses the following encoding: utf-8
+
+import logging
+import os
+import select
+from builtins import object
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2 import sql
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+log.addHandler(logging.StreamHandler())
+
+# payload: token symbol whose reward pool / token config changed
+TOKEN_METADATA_CHANNEL = "engine_token_metadata"
+# payload: ISO timestamp of the last committed sidechain block
+ENGINE_PROGRESS_CHANNEL = "engine_progress"
+
+
+def notify(db, channel, payload=""):
+    """Queue a notification; Postgres delivers it when the transaction commits."""
+    db.query("SELECT pg_notify(:channel, :payload)", channel=channel, payload=payload)
+
+
+def dsn_from_connector(databaseConnector):
+    """Turn a SQLAlchemy database URL into a libpq URI."""
+    scheme, sep, rest = databaseConnector.partition("://")
+    return scheme.split("+")[0] + sep + rest
+
+
+class NotificationListener(object):
+    """LISTENs on a set of channels over a dedicated autocommit connection.
+
+    ``poll()`` only reads what is already buffered on the socket, so it can be
+    called on every request or op without a database round-trip. Whenever the
+    connection is (re)established a ``(channel, None)`` notification is
+    returned for each channel, since anything sent while disconnected is lost
+    and listeners must resync.
+    """
+
+    def __init__(self, databaseConnector, channels):
+        self.dsn = dsn_from_connector(databaseConnector)
+        self.channels = list(channels)
+        self.conn = None
+        self.pid = None
+
+    def _connect(self):
+        self.close()
+        conn = psycopg2.connect(self.dsn)
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cur:
+            for channel in self.channels:
+                cur.execute(sql.SQL("LISTEN {}").format(sql.Identifier(channel)))
+        self.conn = conn
+        self.pid = os.getpid()
+        return [(channel, None) for channel in self.channels]
+
+    def poll(self):
+        """Returns a list of (channel, payload) received since the last call."""
+        try:
+            if self.conn is None or self.conn.closed or self.pid != os.getpid():
+                return self._connect()
+            self.conn.poll()
+        except psycopg2.Error as e:
+            log.warning(f"Notification connection lost: {e}")
+            self.close()
+            return [(channel, None) for channel in self.channels]
+        notifications = [(n.channel, n.payload) for n in self.conn.notifies]
+        self.conn.notifies.clear()
+        return notifications
+
+    def wait(self, timeout):
+        """Block up to timeout seconds for a notification, then poll."""
+        if self.conn is not None and not self.conn.closed:
+            try:
+                select.select([self.conn], [], [], timeout)
+            except (OSError, ValueError):
+                pass
+        return self.poll()
+
+    def close(self):
+        if self.conn is not None and self.pid == os.getpid():
+            try:
+                self.conn.close()
+            except psycopg2.Error:
+                pass
+        self.conn = None
@@ -0,0 +1,129 @@
+# This Python file uses the following encoding: utf-8
+
+import gzip
+import logging
+import os
+import re
+from builtins import object
+from datetime import datetime
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+log.addHandler(logging.StreamHandler())
+
+# partitioned table -> partition key, see sql/migrations/0003_partition_by_month.sql
+PARTITIONED_TABLES = {
+    "posts": "created",
+    "votes": "timestamp",
+    "account_history": "timestamp",
+}
+
+_BOUNDS = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def month_start(timestamp, months=0):
+    """First day of the month of timestamp, shifted by months."""
+    index = timestamp.year * 12 + timestamp.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+class PartitionStorage(object):
+    """Monthly range partitions of posts, votes and account_history."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def partitions(self, table):
+        """Partitions of a table ordered by range, the default one last.
+
+        Each is a dict with name, lower and upper; both bounds are None for
+        the default partition.
+        """
+        partitions = []
+        for row in self.db.query(
+            "SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bound FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(:table)",
+            table=table,
+        ):
+            match = _BOUNDS.search(row["bound"])
+            partitions.append(
+                {
+                    "name": row["name"],
+                    "lower": datetime.fromisoformat(match.group(1)) if match else None,
+                    "upper": datetime.fromisoformat(match.group(2)) if match else None,
+                }
+            )
+        return sorted(
+            partitions, key=lambda p: (p["lower"] is None, p["lower"] or datetime.min)
+        )
+
+    def is_partitioned(self, table):
+        return (
+            self.db.query(
+                "SELECT count(*) c FROM pg_partitioned_table WHERE partrelid = to_regclass(:table)",
+                table=table,
+            ).next()["c"]
+            > 0
+        )
+
+    def create_month(self, table, month):
+        """Create the partition of a month, moving its rows out of the default."""
+        # a SELECT is not autocommitted, the partition has to be committed here
+        self.db.begin()
+        try:
+            name = self.db.query(
+                "SELECT engine_create_month_partition(:table, :key, :month) AS name",
+                table=table,
+                key=PARTITIONED_TABLES[table],
+                month=month.date(),
+            ).next()["name"]
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        return name
+
+    def default_months(self, table):
+        """Months with rows in the default partition, i.e. without a partition."""
+        key = PARTITIONED_TABLES[table]
+        return [
+            row["month"]
+            for row in self.db.query(
+                f'SELECT DISTINCT date_trunc(\'month\', "{key}") AS month FROM "{table}_default" ORDER BY 1'
+            )
+        ]
+
+    def expired(self, table, keep_months, now):
+        """Partitions that end before the first of the kept months."""
+        cutoff = month_start(now, -keep_months)
+        return [
+            partition
+            for partition in self.partitions(table)
+            if partition["upper"] is not None and partition["upper"] <= cutoff
+        ]
+
+    def archive(self, partition, directory):
+        """Write a partition as gzipped CSV with a header line; returns the path."""
+        path = os.path.join(directory, f"{partition['name']}.csv.gz")
+        cursor = self.db.executable.connection.cursor()
+        try:
+            with gzip.open(path, "wt") as f:
+                cursor.copy_expert(
+                    f'COPY "{partition["name"]}" TO STDOUT WITH (FORMAT csv, HEADER)',
+                    f,
+                )
+        finally:
+            cursor.close()
+        return path
+
+    def drop(self, table, partition):
+        """Detach and drop a partition in one transaction."""
+        self.db.begin()
+        try:
+            self.db.query(
+                f'ALTER TABLE "{table}" DETACH PARTITION "{partition["name"]}"'
+            )
+            self.db.query(f'DROP TABLE "{partition["name"]}"')
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
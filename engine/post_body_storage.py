@@ -0,0 +1,205 @@
+# This Python file uses the following encoding: utf-8
+
+import logging
+import threading
+from builtins import object
+from collections import OrderedDict
+
+from diff_match_patch import diff_match_patch
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+log.addHandler(logging.StreamHandler())
+
+_dmp = diff_match_patch()
+
+
+def apply_patch(body, patch_text):
+    """Apply a diff_match_patch text patch the way the comment processor does."""
+    return _dmp.patch_apply(_dmp.patch_fromText(patch_text), body)[0]
+
+
+class BodyCache(object):
+    """Thread-safe LRU of materialized bodies.
+
+    Keys contain the patch count and a hash of the base body, so entries of a
+    post that was compacted or rewritten since are never returned.
+    """
+
+    def __init__(self, size=256):
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    @staticmethod
+    def key(authorperm, base, patch_count):
+        return (authorperm, patch_count, hash(base))
+
+    def get(self, key):
+        with self.lock:
+            body = self.entries.get(key)
+            if body is not None:
+                self.entries.move_to_end(key)
+            return body
+
+    def put(self, key, body):
+        with self.lock:
+            self.entries[key] = body
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+# shared by all storages of a process, e.g. the API request handlers
+body_cache = BodyCache()
+
+
+class PostBodyStorage(object):
+    """Post bodies kept as a base version plus a log of edit patches.
+
+    ``post_metadata.body`` holds the base body and ``post_metadata.patch_count``
+    the number of patches in ``post_body_patches`` that apply on top of it, so
+    an edit of a long post writes one small row instead of the whole body.
+    """
+
+    __tablename__ = "post_body_patches"
+
+    def __init__(self, db, cache=body_cache):
+        self.db = db
+        self.cache = cache
+
+    def get_patches(self, authorperms):
+        """Patch texts of each authorperm in the order they were applied."""
+        patches = {}
+        if not authorperms:
+            return patches
+        for row in self.db.query(
+            "SELECT authorperm, patch FROM post_body_patches WHERE authorperm IN :authorperms ORDER BY authorperm, seq",
+            authorperms=tuple(authorperms),
+        ):
+            patches.setdefault(row["authorperm"], []).append(row["patch"])
+        return patches
+
+    def _apply(self, authorperm, base, patch_count, patches):
+        body = base
+        for patch_text in patches[:patch_count]:
+            body = apply_patch(body, patch_text)
+        self.cache.put(self.cache.key(authorperm, base, patch_count), body)
+        return body
+
+    def materialize(self, post_metadata):
+        """Current body of a post_metadata row."""
+        return self.materialize_rows([post_metadata])[0]["body"]
+
+    def materialize_rows(self, rows, body_key="body"):
+        """Current bodies of rows with authorperm, body and patch_count.
+
+        Rows are returned as dicts with body_key replaced; the patches of all
+        rows that miss the cache are read with one query.
+        """
+        rows = [dict(row) for row in rows]
+        pending = []
+        for row in rows:
+            patch_count = row.get("patch_count") or 0
+            if patch_count == 0 or row[body_key] is None:
+                continue
+            body = self.cache.get(
+                self.cache.key(row["authorperm"], row[body_key], patch_count)
+            )
+            if body is None:
+                pending.append(row)
+            else:
+                row[body_key] = body
+        if pending:
+            patches = self.get_patches({row["authorperm"] for row in pending})
+            for row in pending:
+                row[body_key] = self._apply(
+                    row["authorperm"],
+                    row[body_key],
+                    row["patch_count"],
+                    patches.get(row["authorperm"], []),
+                )
+        return rows
+
+    def get_bodies(self, authorperms):
+        """Current bodies keyed by authorperm, read with one query."""
+        if not authorperms:
+            return {}
+        rows = self.db.query(
+            "SELECT authorperm, body, patch_count FROM post_metadata WHERE authorperm IN :authorperms",
+            authorperms=tuple(authorperms),
+        )
+        return {row["authorperm"]: row["body"] for row in self.materialize_rows(rows)}
+
+    def append(self, post_metadata, patch_text, timestamp):
+        """Log an edit patch and return the new body and patch count.
+
+        The caller stores the returned patch count in post_metadata.
+        """
+        authorperm = post_metadata["authorperm"]
+        base = post_metadata["body"]
+        old_body = self.materialize(post_metadata)
+        new_body = apply_patch(old_body, patch_text)
+        patch_count = (post_metadata.get("patch_count") or 0) + 1
+        self.db[self.__tablename__].insert(
+            {
+                "authorperm": authorperm,
+                "seq": patch_count,
+                "patch": patch_text,
+                "timestamp": timestamp,
+            }
+        )
+        self.cache.put(self.cache.key(authorperm, base, patch_count), new_body)
+        return new_body, patch_count
+
+    def delete_patches(self, authorperm):
+        self.db.query(
+            "DELETE FROM post_body_patches WHERE authorperm = :authorperm",
+            authorperm=authorperm,
+        )
+
+    def delete_patches_many(self, authorperms):
+        if not authorperms:
+            return
+        self.db.query(
+            "DELETE FROM post_body_patches WHERE authorperm IN :authorperms",
+            authorperms=tuple(authorperms),
+        )
+
+    def get_compaction_candidates(self, threshold, limit=100):
+        return [
+            x["authorperm"]
+            for x in self.db.query(
+                "SELECT authorperm FROM post_metadata WHERE patch_count >= :threshold ORDER BY patch_count DESC LIMIT :limit",
+                threshold=threshold,
+                limit=limit,
+            )
+        ]
+
+    def compact(self, authorperm):
+        """Squash the patch log of a post into its base body.
+
+        Returns False when the post was edited meanwhile; it is picked up
+        again on the next pass.
+        """
+        row = self.db["post_metadata"].find_one(authorperm=authorperm)
+        if row is None or not row["patch_count"]:
+            return True
+        body = self.materialize(row)
+        self.db.begin()
+        try:
+            updated = self.db.query(
+                "UPDATE post_metadata SET body = :body, patch_count = 0 WHERE authorperm = :authorperm AND patch_count = :patch_count",
+                body=body,
+                authorperm=authorperm,
+                patch_count=row["patch_count"],
+            ).result_proxy.rowcount
+            if updated:
+                self.delete_patches(authorperm)
+                self.db.commit()
+            else:
+                self.db.rollback()
+        except Exception:
+            self.db.rollback()
+            raise
+        return bool(updated)
@@ -1,6 +1,8 @@
 # This Python file uses the following encoding: utf-8
+import hashlib
 import logging
 from builtins import object
+from datetime import timezone
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
@@ -9,6 +11,50 @@ log.addHandler(logging.StreamHandler())
 timeformat = "%Y%m%d-%H%M%S"
 
 
+def thread_path_segment(authorperm, created):
+    """Fixed-width sort_path segment of a post: creation second plus a hash.
+
+    Replies sort by creation time under their parent.
+    sql/migrations/0001_upgrade.sql and engine_fill_thread_paths() build the
+    same segments in SQL.
+    """
+    if created.tzinfo is None:
+        created = created.replace(tzinfo=timezone.utc)
+    digest = hashlib.md5(authorperm.encode("utf-8")).hexdigest()
+    return f"{int(created.timestamp()):010d}{digest[:8]}"
+
+
+def thread_path_end(sort_path):
+    """Upper bound of the sort_path range of a post and its replies.
+
+    Segments are digits and hex letters joined by ".", so every descendant
+    sorts between the path itself and the path followed by "/".
+    """
+    return sort_path + "/"
+
+
+def metadata_projection(json_metadata):
+    """The json_metadata fields listings need, stored on each posts row.
+
+    sql/migrations/0001_upgrade.sql extracts the same fields for rows indexed
+    before.
+    """
+    image = json_metadata.get("image")
+    if isinstance(image, list):
+        image = image[0] if image else None
+    app = json_metadata.get("app")
+    if isinstance(app, dict):
+        app = app.get("name")
+    body_format = json_metadata.get("format")
+    return {
+        "image": image if isinstance(image, str) and len(image) <= 512 else None,
+        "app": app[:256] if isinstance(app, str) else None,
+        "format": body_format
+        if isinstance(body_format, str) and len(body_format) <= 20
+        else None,
+    }
+
+
 class PostMetadataStorage(object):
     """This is the post metadata storage class"""
 
@@ -66,6 +112,37 @@ class PostMetadataStorage(object):
         table = self.db[self.__tablename__]
         table.upsert(data, ["authorperm"])
 
+    def upsert_many(self, rows, chunk_size=500):
+        """Upsert rows that all have the same keys with multi-row statements."""
+        if not rows:
+            return
+        columns = list(rows[0])
+        column_list = ", ".join(f'"{c}"' for c in columns)
+        updates = ", ".join(
+            f'"{c}" = EXCLUDED."{c}"' for c in columns if c != "authorperm"
+        )
+        for start in range(0, len(rows), chunk_size):
+            values = []
+            params = {}
+            for i, row in enumerate(rows[start : start + chunk_size]):
+                values.append("(" + ", ".join(f":{c}_{i}" for c in columns) + ")")
+                for c in columns:
+                    params[f"{c}_{i}"] = row[c]
+            self.db.query(
+                f"INSERT INTO post_metadata ({column_list}) VALUES {', '.join(values)} ON CONFLICT (authorperm) DO UPDATE SET {updates}",
+                **params,
+            )
+
+    def fill_thread_paths(self, authorperms):
+        """Give the replies below authorperms that have no sort_path yet theirs.
+
+        Returns the number of rows filled.
+        """
+        return self.db.query(
+            "SELECT engine_fill_thread_paths(CAST(:authorperms AS varchar[])) AS filled",
+            authorperms=list(authorperms),
+        ).next()["filled"]
+
     def get(self, authorperm):
         table = self.db[self.__tablename__]
         return table.find_one(authorperm=authorperm)
@@ -0,0 +1,150 @@
+# This Python file uses the following encoding: utf-8
+
+import logging
+import time
+from builtins import object
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+log.addHandler(logging.StreamHandler())
+
+# keyed by authorperm alone, their rows go with the last token post
+AUTHORPERM_TABLES = (
+    "post_metadata",
+    "post_body_patches",
+    "post_repair_queue",
+    "reblogs",
+)
+
+
+class PostPruner(object):
+    """Deletes token posts together with the rows that depend on them.
+
+    Every batch is one transaction of set based DELETEs: the posts, the votes
+    of each (authorperm, token) left without a post and the rows of
+    AUTHORPERM_TABLES of authorperms left without any post. Batches hold at
+    most batch_size posts and are pause seconds apart, so row locks are short
+    and the streamers keep up while a live node is pruned.
+    """
+
+    def __init__(self, db, batch_size=500, pause=0.0, progress=None):
+        self.db = db
+        self.batch_size = batch_size
+        self.pause = pause
+        # called with (batch number, counts of the batch, totals) after each batch
+        self.progress = progress
+        self.totals = dict.fromkeys(("posts", "votes") + AUTHORPERM_TABLES, 0)
+
+    def _count(self, statement, **params):
+        return self.db.query(statement, **params).result_proxy.rowcount
+
+    def _delete_dependents(self, authorperms):
+        counts = {
+            "votes": self._count(
+                "DELETE FROM votes v WHERE v.authorperm = ANY(CAST(:authorperms AS varchar[])) AND NOT EXISTS (SELECT 1 FROM posts p WHERE p.authorperm = v.authorperm AND p.token = v.token)",
+                authorperms=authorperms,
+            )
+        }
+        for table in AUTHORPERM_TABLES:
+            counts[table] = self._count(
+                f'DELETE FROM "{table}" t WHERE t.authorperm = ANY(CAST(:authorperms AS varchar[])) AND NOT EXISTS (SELECT 1 FROM posts p WHERE p.authorperm = t.authorperm)',
+                authorperms=authorperms,
+            )
+        return counts
+
+    def _transaction(self, work):
+        self.db.begin()
+        try:
+            result = work()
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        return result
+
+    def _delete_posts(self, select, **params):
+        """Delete the posts rows picked by select (authorperm, token, created)
+        and their dependents; returns the counts per table."""
+        deleted = [
+            row["authorperm"]
+            for row in self.db.query(
+                f"WITH picked AS ({select}) DELETE FROM posts p USING picked WHERE p.authorperm = picked.authorperm AND p.token = picked.token AND p.created = picked.created RETURNING p.authorperm",
+                **params,
+            )
+        ]
+        counts = {"posts": len(deleted)}
+        if deleted:
+            counts.update(self._delete_dependents(sorted(set(deleted))))
+        return counts
+
+    def _report(self, batch, counts):
+        for table, count in counts.items():
+            self.totals[table] += count
+        if self.progress is not None:
+            self.progress(batch, counts, self.totals)
+
+    def _batches(self, run_batch, max_batches):
+        """Call run_batch until it handled less than batch_size rows."""
+        batch = 0
+        while max_batches is None or batch < max_batches:
+            batch += 1
+            counts, handled = run_batch()
+            self._report(batch, counts)
+            if handled < self.batch_size:
+                break
+            if self.pause:
+                time.sleep(self.pause)
+        return self.totals
+
+    def delete(self, authorperm):
+        """Delete the posts of authorperm in every token, e.g. on delete_comment.
+
+        Runs in the transaction of the caller.
+        """
+        counts = self._delete_posts(
+            "SELECT authorperm, token, created FROM posts WHERE authorperm = :authorperm",
+            authorperm=authorperm,
+        )
+        self._report(1, counts)
+        return counts
+
+    def prune(self, cutoff, token=None, max_batches=None):
+        """Delete the posts created before cutoff, optionally of one token.
+
+        Rows locked by a streamer are skipped and left for the next run.
+        """
+        select = "SELECT authorperm, token, created FROM posts WHERE created < :cutoff"
+        params = {"cutoff": cutoff, "limit": self.batch_size}
+        if token is not None:
+            select += " AND token = :token"
+            params["token"] = token
+        select += " LIMIT :limit FOR UPDATE SKIP LOCKED"
+
+        def run_batch():
+            counts = self._transaction(lambda: self._delete_posts(select, **params))
+            return counts, counts["posts"]
+
+        return self._batches(run_batch, max_batches)
+
+    def sweep_orphans(self, max_batches=None):
+        """Delete votes and post_metadata, body patch, repair queue and reblog
+        rows that no post is left for, e.g. after partitions.py dropped the
+        posts of old months. Walks post_metadata in authorperm order."""
+        after = {"authorperm": ""}
+
+        def run_batch():
+            authorperms = [
+                row["authorperm"]
+                for row in self.db.query(
+                    "SELECT authorperm FROM post_metadata WHERE authorperm > :after ORDER BY authorperm LIMIT :limit",
+                    after=after["authorperm"],
+                    limit=self.batch_size,
+                )
+            ]
+            if not authorperms:
+                return {}, 0
+            after["authorperm"] = authorperms[-1]
+            counts = self._transaction(lambda: self._delete_dependents(authorperms))
+            return counts, len(authorperms)
+
+        return self._batches(run_batch, max_batches)
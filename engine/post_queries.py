@@ -0,0 +1,243 @@
+# This Python file uses the following encoding: utf-8
+
+import functools
+import itertools
+import json
+import logging
+import warnings
+
+from sqlalchemy import text
+from sqlalchemy.exc import SAWarning
+
+from engine.metrics import LISTING_SECONDS
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+log.addHandler(logging.StreamHandler())
+
+# dataset reflects posts, whose tag filter index posts_listing_tags is on an
+# expression SQLAlchemy does not reflect
+warnings.filterwarnings(
+    "ignore",
+    message="Skipped unsupported reflection of expression-based index",
+    category=SAWarning,
+)
+
+# score columns get_discussions_by_score may order by
+SCORE_KEYS = ("score_trend", "score_hot", "promoted", "vote_rshares")
+# hive_select of the API: no filter, posts without the h prefix, Hive posts
+HIVE_FILTERS = (None, False, True)
+BOOLS = (False, True)
+
+ACTIVE_POSTS = "p.muted = 'false' AND (acc is NULL OR acc.muted = 'false')"
+ACCOUNT_JOIN = "LEFT JOIN accounts acc ON p.author = acc.name AND p.token = acc.symbol"
+
+# listing name -> (builder, flag name -> values)
+LISTINGS = {}
+
+
+def listing(name, **domains):
+    """Register the SQL builder of a listing and the values of its flags."""
+
+    def register(builder):
+        LISTINGS[name] = (builder, domains)
+        return builder
+
+    return register
+
+
+def hive_filter(hive_select):
+    """The hive flag of a listing from the hive_select argument of the API."""
+    if hive_select is None:
+        return None
+    return bool(hive_select) and hive_select != "0"
+
+
+def metadata_select(alias, full_metadata):
+    """Select list entry and join adding json_metadata to listed posts.
+
+    Listings return the image, app and format columns of posts; the full
+    json_metadata is only joined in from post_metadata on request.
+    """
+    if not full_metadata:
+        return "", ""
+    return (
+        ", pm.json_metadata",
+        f"LEFT JOIN post_metadata pm ON {alias}.authorperm = pm.authorperm",
+    )
+
+
+def _hive_clause(hive):
+    if hive is None:
+        return ""
+    if hive:
+        return "AND p.authorperm like 'h@%' "
+    return "AND p.authorperm not like 'h@%' "
+
+
+@listing(
+    "created", tag=BOOLS, last_timestamp=BOOLS, hive=HIVE_FILTERS, full_metadata=BOOLS
+)
+def _created(tag, last_timestamp, hive, full_metadata):
+    tag_clause = "AND STRING_TO_ARRAY(p.tags, ',') @> :tags " if tag else ""
+    timestamp_clause = "AND p.created <= :last_timestamp " if last_timestamp else ""
+    metadata_column, metadata_join = metadata_select("p", full_metadata)
+    return f"SELECT p.*{metadata_column} FROM posts p {ACCOUNT_JOIN} {metadata_join} WHERE {ACTIVE_POSTS} AND p.token = :token AND p.main_post = 'true' AND p.created > :cutoff {tag_clause}{timestamp_clause}{_hive_clause(hive)}ORDER BY created DESC LIMIT :limit"
+
+
+@listing(
+    "blog", reblogs=BOOLS, last_timestamp=BOOLS, hive=HIVE_FILTERS, full_metadata=BOOLS
+)
+def _blog(reblogs, last_timestamp, hive, full_metadata):
+    hive_clause = _hive_clause(hive)
+    if reblogs:
+        timestamp_clause = "AND merged.t <= :last_timestamp " if last_timestamp else ""
+        metadata_column, metadata_join = metadata_select("p2", full_metadata)
+        return f"SELECT index.reblogged_by, p2.*{metadata_column} FROM (SELECT authorperm, reblogged_by, MIN(t) t FROM (SELECT r.account reblogged_by, p.authorperm, r.timestamp t FROM posts p INNER JOIN reblogs r ON p.authorperm = r.authorperm {ACCOUNT_JOIN} WHERE {ACTIVE_POSTS} AND token = :token AND main_post = 'true' AND r.account != p.author AND r.account in :accounts {hive_clause}UNION SELECT NULL reblogged_by, p.authorperm, p.created t FROM posts p WHERE token = :token AND main_post = 'true' AND p.muted = 'false' AND p.author in :accounts {hive_clause}) AS merged WHERE TRUE {timestamp_clause}GROUP BY authorperm, reblogged_by ORDER BY t desc LIMIT :limit) index INNER JOIN posts p2 ON p2.authorperm = index.authorperm AND p2.token = :token {metadata_join}"
+    timestamp_clause = "AND p.created <= :last_timestamp " if last_timestamp else ""
+    metadata_column, metadata_join = metadata_select("p", full_metadata)
+    return f"SELECT p.*{metadata_column} FROM posts p {ACCOUNT_JOIN} {metadata_join} WHERE {ACTIVE_POSTS} AND token = :token AND main_post = 'true' AND p.author in :accounts {timestamp_clause}{hive_clause}ORDER BY p.created desc LIMIT :limit"
+
+
+@listing("comments", last_timestamp=BOOLS, hive=HIVE_FILTERS, full_metadata=BOOLS)
+def _comments(last_timestamp, hive, full_metadata):
+    timestamp_clause = "AND p.created <= :last_timestamp " if last_timestamp else ""
+    metadata_column, metadata_join = metadata_select("p", full_metadata)
+    return f"SELECT p.*{metadata_column} FROM posts p {ACCOUNT_JOIN} {metadata_join} WHERE {ACTIVE_POSTS} AND token = :token AND main_post = 'false' AND p.author in :accounts AND p.created > :cutoff {timestamp_clause}{_hive_clause(hive)}ORDER BY p.created desc LIMIT :limit"
+
+
+@listing("replies", last_timestamp=BOOLS, hive=HIVE_FILTERS, full_metadata=BOOLS)
+def _replies(last_timestamp, hive, full_metadata):
+    timestamp_clause = "AND p.created <= :last_timestamp " if last_timestamp else ""
+    metadata_column, metadata_join = metadata_select("p", full_metadata)
+    return f"SELECT p.*{metadata_column} FROM posts p {ACCOUNT_JOIN} {metadata_join} WHERE {ACTIVE_POSTS} AND token = :token AND main_post = 'false' AND p.author NOT IN :accounts AND p.parent_author in :accounts AND p.created > :cutoff {timestamp_clause}{_hive_clause(hive)}ORDER BY p.created desc LIMIT :limit"
+
+
+@listing(
+    "feed", reblogs=BOOLS, last_timestamp=BOOLS, hive=HIVE_FILTERS, full_metadata=BOOLS
+)
+def _feed(reblogs, last_timestamp, hive, full_metadata):
+    following = "WITH following_table AS (SELECT following from follows where follower IN :accounts AND state = 1)"
+    hive_clause = _hive_clause(hive)
+    if reblogs:
+        timestamp_clause = (
+            "WHERE merged.t <= :last_timestamp " if last_timestamp else ""
+        )
+        metadata_column, metadata_join = metadata_select("p2", full_metadata)
+        return f"{following} SELECT index.accounts reblogged_by, p2.*{metadata_column} FROM (SELECT authorperm, string_agg(account, ',') accounts, MIN(t) t FROM (SELECT p.authorperm, r.account, r.timestamp t FROM posts p INNER JOIN reblogs r ON p.authorperm = r.authorperm {ACCOUNT_JOIN} WHERE author NOT IN :accounts AND {ACTIVE_POSTS} AND token = :token AND main_post = 'true' AND p.created > :cutoff AND r.account in (SELECT * FROM following_table) {hive_clause}UNION SELECT p.authorperm, NULL account, p.created t FROM posts p WHERE author NOT IN :accounts AND token = :token AND main_post = 'true' AND p.created > :cutoff AND p.muted = 'false' AND p.author in (SELECT * FROM following_table) {hive_clause}) AS merged {timestamp_clause}GROUP BY authorperm ORDER BY t desc LIMIT :limit) index INNER JOIN posts p2 ON p2.authorperm = index.authorperm AND p2.token = :token {metadata_join}"
+    timestamp_clause = "AND p.created <= :last_timestamp " if last_timestamp else ""
+    metadata_column, metadata_join = metadata_select("p", full_metadata)
+    return f"{following} SELECT p.*{metadata_column} FROM posts p {ACCOUNT_JOIN} {metadata_join} WHERE p.author NOT IN :accounts AND {ACTIVE_POSTS} AND p.token = :token AND p.main_post = 'true' AND p.created > :cutoff AND p.author in (SELECT * FROM following_table) {timestamp_clause}{hive_clause}ORDER BY p.created desc LIMIT :limit"
+
+
+@listing(
+    "score",
+    score_key=SCORE_KEYS,
+    tag=BOOLS,
+    last_authorperm=BOOLS,
+    hive=HIVE_FILTERS,
+    full_metadata=BOOLS,
+)
+def _score(score_key, tag, last_authorperm, hive, full_metadata):
+    if score_key not in SCORE_KEYS:
+        raise ValueError(f"Unknown score key {score_key}")
+    tag_clause = "AND STRING_TO_ARRAY(p.tags, ',') @> :tags " if tag else ""
+    # without decimal, floating point compare may miss target
+    last_score_clause = (
+        f"AND p.{score_key} <= (SELECT MAX({score_key}) FROM posts WHERE token = :token AND authorperm in (:last_authorperm, :last_hive_authorperm)) "
+        if last_authorperm
+        else ""
+    )
+    promoted_clause = (
+        "AND p.last_payout = '1970-01-01 00:00:00' AND p.promoted > '0' AND p.cashout_time > :current_time "
+        if score_key == "promoted"
+        else ""
+    )
+    metadata_column, metadata_join = metadata_select("p", full_metadata)
+    return f"SELECT p.*{metadata_column} FROM posts p {ACCOUNT_JOIN} {metadata_join} WHERE p.token = :token AND {ACTIVE_POSTS} AND p.main_post = :main_post AND p.created > :cutoff {tag_clause}{last_score_clause}{_hive_clause(hive)}{promoted_clause}ORDER BY {score_key} DESC LIMIT :limit"
+
+
+def _flag_key(name, flags):
+    """Hashable key of a listing variant; flags outside the domains are rejected.
+
+    The key names a cached statement and a metric label, so a value that
+    reaches this from a request must not add new variants.
+    """
+    _, domains = LISTINGS[name]
+    if set(flags) != set(domains):
+        raise ValueError(f"Listing {name} takes flags {sorted(domains)}")
+    for key, value in flags.items():
+        if not any(
+            type(value) is type(allowed) and value == allowed
+            for allowed in domains[key]
+        ):
+            raise ValueError(f"Invalid {key} {value!r} of listing {name}")
+    return tuple(sorted(flags.items()))
+
+
+def variant_name(name, flags):
+    """Short label of a listing variant, e.g. created[tag,hive=engine]."""
+    parts = []
+    for key, value in sorted(flags.items()):
+        if key == "hive" and value is not None:
+            parts.append("hive=hive" if value else "hive=engine")
+        elif isinstance(value, str):
+            parts.append(value)
+        elif value:
+            parts.append(key)
+    return f"{name}[{','.join(parts)}]"
+
+
+@functools.lru_cache(maxsize=None)
+def _statement(name, flag_key, prefix=""):
+    builder, _ = LISTINGS[name]
+    return text(prefix + builder(**dict(flag_key)))
+
+
+def statement(name, **flags):
+    """The text() construct of a listing variant.
+
+    Each variant is built once per process; SQLAlchemy caches the compiled
+    form of the construct, so repeated calls skip both the string assembly
+    and the statement compilation.
+    """
+    return _statement(name, _flag_key(name, flags))
+
+
+def variants(names=None):
+    """(name, flags) of every variant of the given listings, or of all."""
+    for name in names or LISTINGS:
+        _, domains = LISTINGS[name]
+        keys = sorted(domains)
+        for values in itertools.product(*(domains[key] for key in keys)):
+            yield name, dict(zip(keys, values))
+
+
+def query(db, name, params, **flags):
+    """Run a listing variant, timing it per variant."""
+    listing_statement = statement(name, **flags)
+    with LISTING_SECONDS.time(variant=variant_name(name, flags)):
+        return db.query(listing_statement, **params)
+
+
+def explain(db, name, params, **flags):
+    """Plan and execution time of a listing variant from EXPLAIN ANALYZE.
+
+    The statement is executed; use it on a database that may be read.
+    """
+    row = db.query(
+        _statement(name, _flag_key(name, flags), "EXPLAIN (ANALYZE, FORMAT JSON) "),
+        **params,
+    ).next()
+    result = row["QUERY PLAN"]
+    if isinstance(result, str):
+        result = json.loads(result)
+    plan = result[0]
+    return {
+        "variant": variant_name(name, flags),
+        "planning_ms": plan["Planning Time"],
+        "execution_ms": plan["Execution Time"],
+        "node": plan["Plan"]["Node Type"],
+        "rows": plan["Plan"]["Actual Rows"],
+        "plan": plan["Plan"],
+    }
@@ -0,0 +1,85 @@
+# This Python file uses the following encoding: utf-8
+
+import logging
+from builtins import object
+from datetime import datetime, timedelta, timezone
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+log.addHandler(logging.StreamHandler())
+
+
+class PostRepairQueue(object):
+    """Posts whose body has to be fetched from a Hive node.
+
+    The streamer queues edits it cannot apply, because the post is missing
+    from post_metadata, and moves on; repair_posts.py works the queue off.
+    """
+
+    __tablename__ = "post_repair_queue"
+
+    def __init__(self, db):
+        self.db = db
+
+    def enqueue(self, authorperm, timestamp):
+        """Queue a post, or remember a newer edit of one that is queued."""
+        self.db.query(
+            "INSERT INTO post_repair_queue (authorperm, queued_at, next_attempt_at) VALUES (:authorperm, :timestamp, :now) ON CONFLICT (authorperm) DO UPDATE SET queued_at = GREATEST(post_repair_queue.queued_at, EXCLUDED.queued_at)",
+            authorperm=authorperm,
+            timestamp=timestamp,
+            now=datetime.now(timezone.utc),
+        )
+
+    def is_queued(self, authorperm):
+        table = self.db[self.__tablename__]
+        return table.find_one(authorperm=authorperm) is not None
+
+    def claim(self, lease=600):
+        """Lease the next due job to the caller for lease seconds.
+
+        The lease moves next_attempt_at ahead, so other workers skip the job
+        without a row lock being held while its post is fetched. The caller
+        commits right away; a job whose worker died is due again once the
+        lease runs out.
+        """
+        now = datetime.now(timezone.utc)
+        for job in self.db.query(
+            "UPDATE post_repair_queue SET next_attempt_at = :lease_until WHERE authorperm = (SELECT authorperm FROM post_repair_queue WHERE next_attempt_at <= :now ORDER BY next_attempt_at LIMIT 1 FOR UPDATE SKIP LOCKED) RETURNING *",
+            now=now,
+            lease_until=now + timedelta(seconds=lease),
+        ):
+            return job
+        return None
+
+    def complete(self, authorperm, synced_at=None):
+        """Remove a job unless an edit newer than synced_at was queued meanwhile.
+
+        synced_at is the last update of the fetched body; without one the job
+        is removed unconditionally. Returns whether the job was removed.
+        """
+        return (
+            self.db.query(
+                "DELETE FROM post_repair_queue WHERE authorperm = :authorperm AND (CAST(:synced_at AS timestamp) IS NULL OR queued_at <= :synced_at)",
+                authorperm=authorperm,
+                synced_at=synced_at,
+            ).result_proxy.rowcount
+            > 0
+        )
+
+    def retry(self, job, error, base_delay=30, max_delay=3600):
+        """Push a failed job back with exponential backoff."""
+        delay = min(base_delay * 2 ** job["attempts"], max_delay)
+        self.db.query(
+            "UPDATE post_repair_queue SET attempts = attempts + 1, next_attempt_at = :next_attempt_at, last_error = :error WHERE authorperm = :authorperm",
+            next_attempt_at=datetime.now(timezone.utc) + timedelta(seconds=delay),
+            error=str(error)[:1000],
+            authorperm=job["authorperm"],
+        )
+
+    def count(self, due=False):
+        """Number of queued posts, or of those due for an attempt now."""
+        return self.db.query(
+            "SELECT count(*) c FROM post_repair_queue WHERE NOT :due OR next_attempt_at <= :now",
+            due=due,
+            now=datetime.now(timezone.utc),
+        ).next()["c"]
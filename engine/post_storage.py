@@ -4,6 +4,11 @@ import logging
 from builtins import object
 from datetime import datetime, timedelta, timezone
 
+from engine.post_body_storage import PostBodyStorage
+from engine import post_queries
+from engine.post_metadata_storage import thread_path_end
+from engine.post_pruner import PostPruner
+
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 log.addHandler(logging.StreamHandler())
@@ -70,6 +75,33 @@ class PostsTrx(object):
         table = self.db[self.__tablename__]
         table.upsert(data, ["authorperm", "token"])
 
+    def apply_payouts(self, payouts, chunk_size=1000):
+        """Add payout increments to posts with one UPDATE ... FROM (VALUES ...).
+
+        Each payout holds token, authorperm, last_payout, total_payout_value,
+        curator_payout_value and beneficiaries_payout_value, plus an optional
+        reset_scores flag that zeroes vote_rshares and the ranking scores.
+        """
+        for start in range(0, len(payouts), chunk_size):
+            values = []
+            params = {}
+            for i, payout in enumerate(payouts[start : start + chunk_size]):
+                values.append(
+                    f"(:token_{i}, :authorperm_{i}, CAST(:last_payout_{i} AS timestamp), CAST(:total_{i} AS numeric), CAST(:curator_{i} AS numeric), CAST(:beneficiaries_{i} AS numeric), CAST(:reset_scores_{i} AS boolean))"
+                )
+                params[f"token_{i}"] = payout["token"]
+                params[f"authorperm_{i}"] = payout["authorperm"]
+                params[f"last_payout_{i}"] = payout["last_payout"]
+                params[f"total_{i}"] = payout["total_payout_value"]
+                params[f"curator_{i}"] = payout["curator_payout_value"]
+                params[f"beneficiaries_{i}"] = payout["beneficiaries_payout_value"]
+                params[f"reset_scores_{i}"] = payout.get("reset_scores", False)
+            self.db.query(
+                "UPDATE posts p SET last_payout = v.last_payout, total_payout_value = p.total_payout_value + v.total, curator_payout_value = p.curator_payout_value + v.curator, beneficiaries_payout_value = p.beneficiaries_payout_value + v.beneficiaries, vote_rshares = CASE WHEN v.reset_scores THEN 0 ELSE p.vote_rshares END, score_hot = CASE WHEN v.reset_scores THEN 0 ELSE p.score_hot END, score_trend = CASE WHEN v.reset_scores THEN 0 ELSE p.score_trend END "
+                f"FROM (VALUES {', '.join(values)}) AS v(token, authorperm, last_payout, total, curator, beneficiaries, reset_scores) WHERE p.token = v.token AND p.authorperm = v.authorperm",
+                **params,
+            )
+
     def get_latest_token_post(self, token, author):
         table = self.db[self.__tablename__]
         ret = table.find_one(token=token, author=author, order_by="-created")
@@ -142,6 +174,19 @@ class PostsTrx(object):
         table = self.db[self.__tablename__]
         return table.find_one(token=token, authorperm=authorperm)
 
+    def get_token_posts(self, token, authorperms):
+        """Posts of a token keyed by authorperm, read with one query."""
+        if not authorperms:
+            return {}
+        return {
+            post["authorperm"]: post
+            for post in self.db.query(
+                "SELECT * FROM posts WHERE token = :token AND authorperm IN :authorperms",
+                token=token,
+                authorperms=tuple(authorperms),
+            )
+        }
+
     def get_posts_list(self, start_timestamp):
         table = self.db[self.__tablename__]
         posts = []
@@ -166,37 +211,31 @@ class PostsTrx(object):
         return posts
 
     def get_discussions_by_created(
-        self, token, tag=None, limit=100, last_timestamp=None, hive_select=None
+        self,
+        token,
+        tag=None,
+        limit=100,
+        last_timestamp=None,
+        hive_select=None,
+        full_metadata=False,
     ):
         cutoff = (
             last_timestamp if last_timestamp else datetime.now(timezone.utc)
         ) + timedelta(days=-30)
-        tag_clause = ""
-        last_timestamp_clause = ""
-        hive_select_clause = ""
-
-        if tag is not None:
-            tag_clause = "AND STRING_TO_ARRAY(p.tags, ',') @> :tags "
-        if last_timestamp is not None:
-            last_timestamp_clause = "AND p.created <= :last_timestamp  "
-        if hive_select is not None:
-            if not hive_select or hive_select == "0":
-                hive_select_clause = "AND p.authorperm not like 'h@%' "
-            else:
-                hive_select_clause = "AND p.authorperm like 'h@%' "
-
-        q = (
-            "SELECT p.*, pm.json_metadata FROM posts p LEFT JOIN accounts acc ON p.author = acc.name AND p.token = acc.symbol LEFT JOIN post_metadata pm ON p.authorperm = pm.authorperm WHERE p.muted = 'false' AND (acc is NULL OR acc.muted = 'false') AND p.token = :token AND p.main_post = 'true' AND p.created > :cutoff %s %s %s ORDER BY created DESC LIMIT :limit"
-            % (tag_clause, last_timestamp_clause, hive_select_clause)
-        )
-        return self.db.query(
-            q,
-            tags=[tag],
-            token=token,
-            last_timestamp=last_timestamp,
-            limit=limit,
-            hive_select=hive_select,
-            cutoff=cutoff,
+        return post_queries.query(
+            self.db,
+            "created",
+            dict(
+                tags=[tag],
+                token=token,
+                last_timestamp=last_timestamp,
+                limit=limit,
+                cutoff=cutoff,
+            ),
+            tag=tag is not None,
+            last_timestamp=last_timestamp is not None,
+            hive=post_queries.hive_filter(hive_select),
+            full_metadata=bool(full_metadata),
         )
 
     def get_discussions_by_blog(
@@ -207,106 +246,118 @@ class PostsTrx(object):
         last_timestamp=None,
         limit=100,
         hive_select=None,
+        full_metadata=False,
     ):
-        cutoff = (
-            last_timestamp if last_timestamp else datetime.now(timezone.utc)
-        ) + timedelta(days=-30)
-        # cutoff_clause = "AND p.created > :cutoff"
-        cutoff_clause = ""
-        timestamp_clause = ""
-        reblog_timestamp_clause = ""
-        hive_select_clause = ""
-        if last_timestamp is not None:
-            reblog_timestamp_clause = "AND merged.t <= :last_timestamp "
-            timestamp_clause = "AND p.created <= :last_timestamp "
-        if hive_select is not None:
-            if not hive_select or hive_select == "0":
-                hive_select_clause = "AND p.authorperm not like 'h@%' "
-            else:
-                hive_select_clause = "AND p.authorperm like 'h@%' "
-
-        if include_reblogs:
-            return self.db.query(
-                f"SELECT index.reblogged_by, p2.*, pm.json_metadata FROM (SELECT authorperm, reblogged_by, MIN(t) t FROM (SELECT r.account reblogged_by, p.authorperm, r.timestamp t FROM posts p INNER JOIN reblogs r ON p.authorperm = r.authorperm LEFT JOIN accounts acc ON p.author = acc.name AND p.token = acc.symbol WHERE p.muted = 'false' AND (acc is NULL OR acc.muted = 'false') AND token = :token AND main_post = 'true' AND r.account != p.author AND r.account in :accounts {cutoff_clause} {hive_select_clause} UNION SELECT NULL reblogged_by, p.authorperm, p.created t FROM posts p WHERE token = :token AND main_post = 'true' AND p.muted = 'false' AND p.author in :accounts {cutoff_clause} {hive_select_clause}) AS merged WHERE TRUE {reblog_timestamp_clause} GROUP BY authorperm, reblogged_by ORDER BY t desc LIMIT :limit) index INNER JOIN posts p2 ON p2.authorperm = index.authorperm AND p2.token = :token LEFT JOIN post_metadata pm ON p2.authorperm = pm.authorperm",
+        return post_queries.query(
+            self.db,
+            "blog",
+            dict(
                 token=token,
                 accounts=tuple(accounts),
                 last_timestamp=last_timestamp,
                 limit=str(limit),
-                cutoff=cutoff,
-            )
-        else:
-            return self.db.query(
-                f"SELECT p.*, pm.json_metadata FROM posts p LEFT JOIN accounts acc ON p.author = acc.name AND p.token = acc.symbol LEFT JOIN post_metadata pm ON p.authorperm = pm.authorperm WHERE p.muted = 'false' AND (acc is NULL OR acc.muted = 'false') AND token = :token AND main_post = 'true' AND p.author in :accounts {cutoff_clause} {timestamp_clause} {hive_select_clause} ORDER BY p.created desc LIMIT :limit",
-                token=token,
-                accounts=tuple(accounts),
-                last_timestamp=last_timestamp,
-                limit=str(limit),
-                cutoff=cutoff,
-            )
+            ),
+            reblogs=bool(include_reblogs),
+            last_timestamp=last_timestamp is not None,
+            hive=post_queries.hive_filter(hive_select),
+            full_metadata=bool(full_metadata),
+        )
 
     def get_discussions_by_comments(
-        self, token, accounts, last_timestamp=None, limit=100, hive_select=None
+        self,
+        token,
+        accounts,
+        last_timestamp=None,
+        limit=100,
+        hive_select=None,
+        full_metadata=False,
     ):
         cutoff = (
             last_timestamp if last_timestamp else datetime.now(timezone.utc)
         ) + timedelta(days=-30)
-        timestamp_clause = ""
-        hive_select_clause = ""
-        if last_timestamp is not None:
-            timestamp_clause = "AND p.created <= :last_timestamp "
-        if hive_select is not None:
-            if not hive_select or hive_select == "0":
-                hive_select_clause = "AND p.authorperm not like 'h@%' "
-            else:
-                hive_select_clause = "AND p.authorperm like 'h@%' "
-
-        return self.db.query(
-            (
-                "SELECT p.*, pm.json_metadata FROM posts p LEFT JOIN accounts acc ON p.author = acc.name AND p.token = acc.symbol LEFT JOIN post_metadata pm ON p.authorperm = pm.authorperm WHERE p.muted = 'false' AND (acc is NULL OR acc.muted = 'false') AND token = :token AND main_post = 'false' AND p.author in :accounts AND p.created > :cutoff %s %s ORDER BY p.created desc LIMIT :limit"
-                % (timestamp_clause, hive_select_clause)
+        return post_queries.query(
+            self.db,
+            "comments",
+            dict(
+                token=token,
+                accounts=tuple(accounts),
+                last_timestamp=last_timestamp,
+                limit=str(limit),
+                cutoff=cutoff,
             ),
-            token=token,
-            accounts=tuple(accounts),
-            last_timestamp=last_timestamp,
-            limit=str(limit),
-            cutoff=cutoff,
+            last_timestamp=last_timestamp is not None,
+            hive=post_queries.hive_filter(hive_select),
+            full_metadata=bool(full_metadata),
         )
 
     def get_discussions_by_replies(
-        self, token, accounts, last_timestamp=None, limit=100, hive_select=None
+        self,
+        token,
+        accounts,
+        last_timestamp=None,
+        limit=100,
+        hive_select=None,
+        full_metadata=False,
     ):
         cutoff = (
             last_timestamp if last_timestamp else datetime.now(timezone.utc)
         ) + timedelta(days=-30)
-        timestamp_clause = ""
-        hive_select_clause = ""
-        if last_timestamp is not None:
-            timestamp_clause = "AND p.created <= :last_timestamp "
-        if hive_select is not None:
-            if not hive_select or hive_select == "0":
-                hive_select_clause = "AND p.authorperm not like 'h@%' "
-            else:
-                hive_select_clause = "AND p.authorperm like 'h@%' "
-
-        return self.db.query(
-            (
-                "SELECT p.*, pm.json_metadata FROM posts p LEFT JOIN accounts acc ON p.author = acc.name AND p.token = acc.symbol LEFT JOIN post_metadata pm ON p.authorperm = pm.authorperm WHERE p.muted = 'false' AND (acc is NULL OR acc.muted = 'false') AND token = :token AND main_post = 'false' AND p.author NOT IN :accounts AND p.parent_author in :accounts AND p.created > :cutoff %s %s ORDER BY p.created desc LIMIT :limit"
-                % (timestamp_clause, hive_select_clause)
+        return post_queries.query(
+            self.db,
+            "replies",
+            dict(
+                token=token,
+                accounts=tuple(accounts),
+                last_timestamp=last_timestamp,
+                limit=str(limit),
+                cutoff=cutoff,
             ),
-            token=token,
-            accounts=tuple(accounts),
-            last_timestamp=last_timestamp,
-            limit=str(limit),
-            cutoff=cutoff,
+            last_timestamp=last_timestamp is not None,
+            hive=post_queries.hive_filter(hive_select),
+            full_metadata=bool(full_metadata),
         )
 
-    def get_thread_discussions(self, token, author, permlink):
+    def get_thread_discussions(self, token, author, permlink, with_body=True):
+        """Posts of a thread in rendering order.
+
+        The thread is one range of the (root_authorperm, sort_path) index.
+        Without with_body the bodies are left out, clients load them per post
+        from /get_post_bodies.
+        """
         authorperm = f"@{author}/{permlink}"
-        return self.db.query(
-            "WITH RECURSIVE post_tree AS ( SELECT authorperm, body, json_metadata, 0 __d FROM post_metadata WHERE authorperm = :authorperm UNION SELECT pm.authorperm, pm.body, pm.json_metadata, pt.__d + 1 FROM post_metadata pm INNER JOIN post_tree pt ON pm.parent_authorperm = pt.authorperm WHERE pt.__d <= 8) SELECT pt.__d, p.*, pt.body, pt.json_metadata FROM post_tree pt join posts p ON p.authorperm = pt.authorperm and p.token = :token",
-            authorperm=authorperm,
+        start = self.db["post_metadata"].find_one(authorperm=authorperm)
+        if start is None:
+            return []
+        if start["sort_path"] is None:
+            # the thread start was indexed without its parent
+            return self._get_thread_discussions_recursive(token, authorperm)
+        body_columns = "pm.body, pm.patch_count, " if with_body else ""
+        rows = self.db.query(
+            f"SELECT pm.depth - :depth __d, p.*, {body_columns}pm.json_metadata FROM post_metadata pm JOIN posts p ON p.authorperm = pm.authorperm AND p.token = :token WHERE pm.root_authorperm = :root_authorperm AND pm.sort_path >= :sort_path AND pm.sort_path < :sort_path_end ORDER BY pm.sort_path",
+            depth=start["depth"] or 0,
             token=token,
+            root_authorperm=start["root_authorperm"],
+            sort_path=start["sort_path"],
+            sort_path_end=thread_path_end(start["sort_path"]),
+        )
+        if not with_body:
+            return list(rows)
+        rows = PostBodyStorage(self.db).materialize_rows(rows)
+        for row in rows:
+            del row["patch_count"]
+        return rows
+
+    def _get_thread_discussions_recursive(self, token, authorperm):
+        rows = PostBodyStorage(self.db).materialize_rows(
+            self.db.query(
+                "WITH RECURSIVE post_tree AS ( SELECT authorperm, body, patch_count, json_metadata, 0 __d FROM post_metadata WHERE authorperm = :authorperm UNION SELECT pm.authorperm, pm.body, pm.patch_count, pm.json_metadata, pt.__d + 1 FROM post_metadata pm INNER JOIN post_tree pt ON pm.parent_authorperm = pt.authorperm WHERE pt.__d <= 8) SELECT pt.__d, p.*, pt.body, pt.patch_count, pt.json_metadata FROM post_tree pt join posts p ON p.authorperm = pt.authorperm and p.token = :token",
+                authorperm=authorperm,
+                token=token,
+            )
         )
+        for row in rows:
+            del row["patch_count"]
+        return rows
 
     def get_feed_discussions(
         self,
@@ -316,46 +367,26 @@ class PostsTrx(object):
         limit=100,
         include_reblogs=True,
         hive_select=None,
+        full_metadata=False,
     ):
         cutoff = (
             last_timestamp if last_timestamp else datetime.now(timezone.utc)
         ) + timedelta(days=-30)
-        timestamp_clause = ""
-        noreblog_timestamp_clause = ""
-        hive_select_clause = ""
-        if last_timestamp is not None:
-            timestamp_clause = "WHERE merged.t <= :last_timestamp "
-            noreblog_timestamp_clause = "AND p.created <= :last_timestamp "
-        if hive_select is not None:
-            if not hive_select or hive_select == "0":
-                hive_select_clause = "AND p.authorperm not like 'h@%' "
-            else:
-                hive_select_clause = "AND p.authorperm like 'h@%' "
-
-        if include_reblogs:
-            return self.db.query(
-                (
-                    "WITH following_table AS (SELECT following from follows where follower IN :accounts AND state = 1) SELECT index.accounts reblogged_by, p2.*, pm.json_metadata FROM (SELECT authorperm, string_agg(account, ',') accounts, MIN(t) t FROM (SELECT p.authorperm, r.account, r.timestamp t FROM posts p INNER JOIN reblogs r ON p.authorperm = r.authorperm LEFT JOIN accounts acc ON p.author = acc.name AND p.token = acc.symbol WHERE author NOT IN :accounts AND p.muted = 'false' AND (acc is NULL OR acc.muted = 'false') AND token = :token AND main_post = 'true' AND p.created > :cutoff AND r.account in (SELECT * FROM following_table) UNION SELECT p.authorperm, NULL account, p.created t FROM posts p WHERE author NOT IN :accounts AND token = :token AND main_post = 'true' AND p.created > :cutoff AND p.muted = 'false' AND p.author in (SELECT * FROM following_table) ) AS merged %s %s GROUP BY authorperm ORDER BY t desc LIMIT :limit) index INNER JOIN posts p2 ON p2.authorperm = index.authorperm AND p2.token = :token LEFT JOIN post_metadata pm ON p2.authorperm = pm.authorperm"
-                    % (timestamp_clause, hive_select_clause)
-                ),
+        return post_queries.query(
+            self.db,
+            "feed",
+            dict(
                 token=token,
                 accounts=tuple(accounts),
                 last_timestamp=last_timestamp,
                 limit=str(limit),
                 cutoff=cutoff,
-            )
-        else:
-            return self.db.query(
-                (
-                    "WITH following_table AS (SELECT following from follows where follower IN :accounts AND state = 1) SELECT p.*, pm.json_metadata FROM posts p LEFT JOIN accounts acc ON p.author = acc.name AND p.token = acc.symbol LEFT JOIN post_metadata pm ON p.authorperm = pm.authorperm WHERE p.author NOT IN :accounts AND p.muted = 'false' AND (acc is NULL OR acc.muted = 'false') AND p.token = :token AND p.main_post = 'true' AND p.created > :cutoff AND p.author in (SELECT * FROM following_table) %s %s ORDER BY p.created desc LIMIT :limit"
-                    % (noreblog_timestamp_clause, hive_select_clause)
-                ),
-                token=token,
-                accounts=tuple(accounts),
-                last_timestamp=last_timestamp,
-                limit=str(limit),
-                cutoff=cutoff,
-            )
+            ),
+            reblogs=bool(include_reblogs),
+            last_timestamp=last_timestamp is not None,
+            hive=post_queries.hive_filter(hive_select),
+            full_metadata=bool(full_metadata),
+        )
 
     def get_discussions_by_score(
         self,
@@ -366,38 +397,27 @@ class PostsTrx(object):
         last_authorperm=None,
         main_post=True,
         hive_select=None,
+        full_metadata=False,
     ):
-        last_month = datetime.now(timezone.utc) + timedelta(days=-30)
-        tag_clause = ""
-        last_score_clause = ""
-        hive_select_clause = ""
-        extra_conditions = ""
-
-        if tag is not None:
-            tag_clause = "AND STRING_TO_ARRAY(p.tags, ',') @> :tags "
-        if last_authorperm is not None:
-            # without decimal, floating point compare may miss target
-            last_score_clause = f"AND p.{score_key} <= (SELECT MAX({score_key}) FROM posts WHERE token = :token AND authorperm in (:last_authorperm, :last_hive_authorperm)) "
-        if hive_select is not None:
-            if not hive_select or hive_select == "0":
-                hive_select_clause = "AND p.authorperm not like 'h@%' "
-            else:
-                hive_select_clause = "AND p.authorperm like 'h@%' "
-        if score_key == "promoted":
-            extra_conditions = "AND p.last_payout = '1970-01-01 00:00:00' AND p.promoted > '0' AND p.cashout_time > :current_time"
-
-        q = f"SELECT p.*, pm.json_metadata FROM posts p LEFT JOIN accounts acc ON p.author = acc.name AND p.token = acc.symbol LEFT JOIN post_metadata pm ON p.authorperm = pm.authorperm WHERE p.token = :token AND p.muted = 'false' AND (acc is NULL OR acc.muted = 'false') AND p.main_post = :main_post AND p.created > :cutoff {tag_clause} {last_score_clause} {hive_select_clause} {extra_conditions} ORDER BY {score_key} DESC LIMIT :limit"
-        return self.db.query(
-            q,
+        now = datetime.now(timezone.utc)
+        return post_queries.query(
+            self.db,
+            "score",
+            dict(
+                tags=[tag],
+                token=token,
+                last_authorperm=last_authorperm,
+                last_hive_authorperm=f"h{last_authorperm}",
+                limit=limit,
+                main_post=main_post,
+                current_time=now,
+                cutoff=now + timedelta(days=-30),
+            ),
             score_key=score_key,
-            tags=[tag],
-            token=token,
-            last_authorperm=last_authorperm,
-            last_hive_authorperm=f"h{last_authorperm}",
-            limit=limit,
-            main_post=main_post,
-            current_time=datetime.now(timezone.utc),
-            cutoff=last_month,
+            tag=tag is not None,
+            last_authorperm=last_authorperm is not None,
+            hive=post_queries.hive_filter(hive_select),
+            full_metadata=bool(full_metadata),
         )
 
     def get_trending_tags(self, token, limit=20):
@@ -405,23 +425,16 @@ class PostsTrx(object):
         return [x["t"] for x in self.db.query(q, token=token, limit=limit)]
 
     def delete_posts(self, authorperm):
-        table = self.db[self.__tablename__]
-        # self.db.begin()
-        for post in table.find(authorperm=authorperm):
-            table.delete(authorperm=authorperm, token=post["token"])
-            print(f"deleted {authorperm} token {post['token']}")
-        # self.db.commit()
-
-    def delete_old_posts(self, days):
-        table = self.db[self.__tablename__]
-        del_posts = []
-        for post in table.find(order_by="created"):
-            if (
-                datetime.now(timezone.utc) - post["created"]
-            ).total_seconds() > 60 * 60 * 24 * days:
-                del_posts.append(post["authorperm"])
-        for post in del_posts:
-            table.delete(authorperm=post)
+        """Delete the posts of authorperm in every token, with their votes,
+        metadata, body patches and reblogs."""
+        counts = PostPruner(self.db).delete(authorperm)
+        if counts["posts"]:
+            log.info(f"deleted {authorperm} ({counts['posts']} token posts)")
+
+    def delete_old_posts(self, days, batch_size=500, pause=0.0):
+        """Delete the posts created more than days ago in bounded batches."""
+        cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=days)
+        return PostPruner(self.db, batch_size=batch_size, pause=pause).prune(cutoff)
 
     def delete(self, ID):
         """Delete a data set
@@ -0,0 +1,242 @@
+# This Python file uses the following encoding: utf-8
+
+import errno
+import fcntl
+import functools
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import time
+from builtins import object
+
+from flask import make_response, request
+
+from engine.metrics import CACHE_LOOKUPS
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+log.addHandler(logging.StreamHandler())
+
+
+class ResponseCache(object):
+    """Response cache shared by all API workers on a host.
+
+    Entries are pickled into ``cache_dir``, which should live on a tmpfs
+    (e.g. ``/mem`` or ``/dev/shm``) so that every gunicorn worker reads the
+    same shared-memory backed entries. Misses are coalesced with a per-key
+    ``flock``: one worker computes the response while the others wait for it.
+    Stale entries are served while a single worker revalidates them, and an
+    entry can be tied to the sidechain block height so it goes stale once
+    the indexer has moved on by ``max_blocks`` blocks.
+    """
+
+    HEIGHT_KEY = "__block_height__"
+
+    def __init__(
+        self,
+        cache_dir,
+        default_timeout=300,
+        default_stale=300,
+        lock_timeout=30,
+        height_fn=None,
+        height_timeout=2,
+        prune_interval=500,
+    ):
+        self.cache_dir = cache_dir
+        self.default_timeout = default_timeout
+        self.default_stale = default_stale
+        self.lock_timeout = lock_timeout
+        self.height_fn = height_fn
+        self.height_timeout = height_timeout
+        self.prune_interval = prune_interval
+        self._stores = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key, suffix):
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.{suffix}")
+
+    def _read(self, key):
+        try:
+            with open(self._path(key, "entry"), "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            log.warning(f"Dropping unreadable cache entry for {key}")
+            return None
+
+    def _write(self, key, entry):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(key, "entry"))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        self._stores += 1
+        if self.prune_interval and self._stores % self.prune_interval == 0:
+            self.prune()
+
+    def _lock(self, key, blocking):
+        """Returns an open, flock-ed file or None if the lock was not taken."""
+        lock_file = open(self._path(key, "lock"), "a+b")
+        deadline = time.time() + self.lock_timeout
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return lock_file
+            except OSError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    lock_file.close()
+                    raise
+            if not blocking or time.time() > deadline:
+                lock_file.close()
+                return None
+            time.sleep(0.05)
+
+    @staticmethod
+    def _unlock(lock_file):
+        if lock_file is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+    def block_height(self):
+        """Current sidechain block height, shared between workers for a few seconds."""
+        if self.height_fn is None:
+            return None
+        now = time.time()
+        entry = self._read(self.HEIGHT_KEY)
+        if entry is not None and now < entry["expires"]:
+            return entry["value"]
+        try:
+            height = self.height_fn()
+        except Exception:
+            log.exception("Could not read block height")
+            return entry["value"] if entry is not None else None
+        self._write(
+            self.HEIGHT_KEY,
+            {"value": height, "expires": now + self.height_timeout},
+        )
+        return height
+
+    def _is_fresh(self, entry, now, height, max_blocks):
+        if entry is None or now >= entry["expires"]:
+            return False
+        if max_blocks is None or height is None or entry["block"] is None:
+            return True
+        return height - entry["block"] < max_blocks
+
+    def get_or_compute(self, key, compute, timeout=None, stale=None, max_blocks=None):
+        """Returns the cached value for key, calling compute() at most once per host.
+
+        compute must return a ``(value, cacheable)`` tuple.
+        """
+        timeout = self.default_timeout if timeout is None else timeout
+        stale = self.default_stale if stale is None else stale
+        height = self.block_height() if max_blocks is not None else None
+
+        now = time.time()
+        entry = self._read(key)
+        if self._is_fresh(entry, now, height, max_blocks):
+            CACHE_LOOKUPS.inc(cache="response", result="hit")
+            return entry["value"]
+
+        serve_stale = entry is not None and now < entry["stale_until"]
+        lock_file = self._lock(key, blocking=not serve_stale)
+        if lock_file is None and serve_stale:
+            # another worker is revalidating this entry
+            CACHE_LOOKUPS.inc(cache="response", result="stale")
+            return entry["value"]
+        try:
+            if lock_file is not None:
+                entry = self._read(key)
+                if self._is_fresh(entry, time.time(), height, max_blocks):
+                    CACHE_LOOKUPS.inc(cache="response", result="coalesced")
+                    return entry["value"]
+            CACHE_LOOKUPS.inc(cache="response", result="miss")
+            value, cacheable = compute()
+            if cacheable:
+                now = time.time()
+                self._write(
+                    key,
+                    {
+                        "value": value,
+                        "block": height,
+                        "expires": now + timeout,
+                        "stale_until": now + timeout + stale,
+                    },
+                )
+            return value
+        finally:
+            self._unlock(lock_file)
+
+    def prune(self):
+        """Remove entries that are past their stale window."""
+        now = time.time()
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".entry"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                with open(path, "rb") as f:
+                    entry = pickle.load(f)
+                if now >= entry.get("stale_until", entry.get("expires", 0)):
+                    os.unlink(path)
+                    lock_path = path[: -len(".entry")] + ".lock"
+                    if os.path.exists(lock_path):
+                        os.unlink(lock_path)
+            except Exception:
+                continue
+
+    def clear(self):
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".entry"):
+                os.unlink(os.path.join(self.cache_dir, name))
+
+    @staticmethod
+    def _request_key():
+        args = sorted(request.args.items(multi=True))
+        query = "&".join(f"{k}={v}" for k, v in args)
+        return f"view:{request.path}?{query}"
+
+    def cached(self, timeout=None, stale=None, max_blocks=None):
+        """Decorator caching a view's response, keyed by path and query string.
+
+        Must be placed below ``@app.route``. Only 200 responses are stored.
+        """
+
+        def decorator(f):
+            @functools.wraps(f)
+            def decorated_function(*args, **kwargs):
+                def compute():
+                    response = make_response(f(*args, **kwargs))
+                    value = {
+                        "body": response.get_data(),
+                        "status": response.status_code,
+                        "mimetype": response.mimetype,
+                    }
+                    return value, response.status_code == 200
+
+                value = self.get_or_compute(
+                    self._request_key(),
+                    compute,
+                    timeout=timeout,
+                    stale=stale,
+                    max_blocks=max_blocks,
+                )
+                return make_response(
+                    (
+                        value["body"],
+                        value["status"],
+                        {"Content-Type": value["mimetype"]},
+                    )
+                )
+
+            return decorated_function
+
+        return decorator
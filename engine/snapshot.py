@@ -0,0 +1,389 @@
+# This Python file uses the following encoding: utf-8
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+from builtins import object
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone
+
+import psycopg2
+
+from engine.account_history_storage import AccountHistoryTrx
+from engine.account_storage import AccountsDB
+from engine.config_storage import ENGINE_SIDECHAIN, HIVED, ConfigurationDB
+from engine.follow_storage import FollowsDB
+from engine.notify import dsn_from_connector
+from engine.partition_storage import PARTITIONED_TABLES
+from engine.post_body_storage import PostBodyStorage
+from engine.post_metadata_storage import PostMetadataStorage
+from engine.post_storage import PostsTrx
+from engine.reblog_storage import ReblogsDB
+from engine.token_config_storage import TokenConfigDB
+from engine.vote_storage import VotesTrx
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+log.addHandler(logging.StreamHandler())
+
+# post bodies are stored as base text plus patches, so both go together
+SNAPSHOT_TABLES = tuple(
+    storage.__tablename__
+    for storage in (
+        PostsTrx,
+        PostMetadataStorage,
+        PostBodyStorage,
+        VotesTrx,
+        FollowsDB,
+        ReblogsDB,
+        AccountsDB,
+        AccountHistoryTrx,
+        TokenConfigDB,
+        ConfigurationDB,
+    )
+)
+MANIFEST = "manifest.json"
+FORMAT_VERSION = 1
+
+_MONTH_PARTITION = re.compile(r"_y(\d{4})m(\d{2})$")
+_NEXTVAL = re.compile(r"nextval\('([^']+)'")
+
+
+def read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST)) as f:
+        manifest = json.load(f)
+    if manifest.get("format") != FORMAT_VERSION:
+        raise ValueError(
+            f"{directory} holds a snapshot of format {manifest.get('format')}, expected {FORMAT_VERSION}"
+        )
+    return manifest
+
+
+def _applied_migrations(cur):
+    cur.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        return []
+    cur.execute("SELECT version FROM schema_migrations ORDER BY version")
+    return [row[0] for row in cur.fetchall()]
+
+
+def _columns(cur, table):
+    cur.execute(
+        "SELECT attname FROM pg_attribute WHERE attrelid = to_regclass(%s) AND attnum > 0 AND NOT attisdropped ORDER BY attnum",
+        (table,),
+    )
+    return [row[0] for row in cur.fetchall()]
+
+
+def _column_list(names):
+    return ", ".join(f'"{name}"' for name in names)
+
+
+def _jsonable(value):
+    return value.isoformat() if isinstance(value, (date, datetime)) else value
+
+
+class _Digest(object):
+    """File wrapper counting the rows and hashing the COPY text going through it."""
+
+    def __init__(self, f):
+        self.f = f
+        self.rows = 0
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.rows += data.count(b"\n")
+        self.sha256.update(data)
+        return self.f.write(data)
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.rows += data.count(b"\n")
+        self.sha256.update(data)
+        return data
+
+    def readline(self, size=-1):
+        data = self.f.readline(size)
+        self.rows += data.count(b"\n")
+        self.sha256.update(data)
+        return data
+
+
+class SnapshotExporter(object):
+    """Writes SNAPSHOT_TABLES as one gzipped COPY file per table plus a manifest.
+
+    The tables are copied by several connections that share the snapshot of
+    one REPEATABLE READ transaction, so all files and the configuration
+    checkpoint in the manifest are of the same moment. The manifest is
+    written last; a directory without one holds an incomplete export.
+    """
+
+    def __init__(self, databaseConnector, jobs=4, compresslevel=6):
+        self.dsn = dsn_from_connector(databaseConnector)
+        self.jobs = jobs
+        self.compresslevel = compresslevel
+
+    def _checkpoint(self, cur):
+        cur.execute(
+            "SELECT id, last_streamed_block, last_streamed_timestamp, last_engine_streamed_block, last_engine_streamed_timestamp FROM configuration"
+        )
+        rows = {row[0]: row for row in cur.fetchall()}
+        hived = rows.get(HIVED)
+        engine = rows.get(ENGINE_SIDECHAIN)
+        return {
+            "last_streamed_block": hived[1] if hived else None,
+            "last_streamed_timestamp": _jsonable(hived[2]) if hived else None,
+            "last_engine_streamed_block": engine[3] if engine else None,
+            "last_engine_streamed_timestamp": _jsonable(engine[4]) if engine else None,
+        }
+
+    def _months(self, cur, table):
+        """First days of the months the table has a partition for."""
+        cur.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(%s)",
+            (table,),
+        )
+        months = []
+        for (name,) in cur.fetchall():
+            match = _MONTH_PARTITION.search(name)
+            if match:
+                months.append(f"{match.group(1)}-{match.group(2)}-01")
+        return sorted(months)
+
+    def _copy_out(self, snapshot_id, table, columns, directory):
+        conn = psycopg2.connect(self.dsn)
+        try:
+            conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+            path = os.path.join(directory, f"{table}.copy.gz")
+            with conn.cursor() as cur:
+                cur.execute("SET TRANSACTION SNAPSHOT %s", (snapshot_id,))
+                with gzip.open(path, "wb", compresslevel=self.compresslevel) as f:
+                    digest = _Digest(f)
+                    cur.copy_expert(
+                        f'COPY (SELECT {_column_list(columns)} FROM "{table}") TO STDOUT',
+                        digest,
+                    )
+            conn.rollback()
+        finally:
+            conn.close()
+        log.info(f"Exported {digest.rows} rows of {table}")
+        return {
+            "file": os.path.basename(path),
+            "rows": digest.rows,
+            "sha256": digest.sha256.hexdigest(),
+            "bytes": os.path.getsize(path),
+        }
+
+    def export(self, directory):
+        """Export into directory and return the manifest."""
+        os.makedirs(directory, exist_ok=True)
+        conn = psycopg2.connect(self.dsn)
+        try:
+            conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_export_snapshot()")
+                snapshot_id = cur.fetchone()[0]
+                manifest = {
+                    "format": FORMAT_VERSION,
+                    "created": datetime.now(timezone.utc).isoformat(),
+                    "checkpoint": self._checkpoint(cur),
+                    "migrations": _applied_migrations(cur),
+                    "tables": {},
+                }
+                for table in SNAPSHOT_TABLES:
+                    manifest["tables"][table] = {"columns": _columns(cur, table)}
+                    if table in PARTITIONED_TABLES:
+                        manifest["tables"][table]["months"] = self._months(cur, table)
+            with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                futures = {
+                    table: pool.submit(
+                        self._copy_out,
+                        snapshot_id,
+                        table,
+                        manifest["tables"][table]["columns"],
+                        directory,
+                    )
+                    for table in SNAPSHOT_TABLES
+                }
+                for table, future in futures.items():
+                    manifest["tables"][table].update(future.result())
+        finally:
+            conn.close()
+        path = os.path.join(directory, MANIFEST)
+        with open(path + ".tmp", "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(path + ".tmp", path)
+        return manifest
+
+
+class SnapshotImporter(object):
+    """Loads a snapshot into a database created from sql/engine.sql.
+
+    The secondary indexes of the tables are dropped before the parallel
+    COPY and built again afterwards, also when the import fails. Primary
+    keys stay in place. The configuration rows of the snapshot replace the
+    ones of the database, so the streamers continue after its checkpoint;
+    they are loaded last, once every other table matched the manifest, so a
+    failed import leaves the old checkpoint in place.
+    """
+
+    def __init__(self, databaseConnector, jobs=4, maintenance_work_mem=None):
+        self.dsn = dsn_from_connector(databaseConnector)
+        self.jobs = jobs
+        self.maintenance_work_mem = maintenance_work_mem
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn)
+        with conn.cursor() as cur:
+            cur.execute("SET synchronous_commit = off")
+            if self.maintenance_work_mem:
+                cur.execute(
+                    "SELECT set_config('maintenance_work_mem', %s, false)",
+                    (self.maintenance_work_mem,),
+                )
+        conn.commit()
+        return conn
+
+    def _check(self, cur, manifest, truncate):
+        migrations = _applied_migrations(cur)
+        if migrations != manifest["migrations"]:
+            raise RuntimeError(
+                f"Snapshot was taken at migrations {manifest['migrations']}, the database is at {migrations}; run migrate.py on the older side first"
+            )
+        for table, info in manifest["tables"].items():
+            missing = set(info["columns"]) - set(_columns(cur, table))
+            if missing:
+                raise RuntimeError(
+                    f"{table} lacks the columns {', '.join(sorted(missing))}"
+                )
+            if table == ConfigurationDB.__tablename__ or truncate:
+                continue
+            cur.execute(f'SELECT EXISTS (SELECT 1 FROM "{table}")')
+            if cur.fetchone()[0]:
+                raise RuntimeError(f"{table} is not empty, pass truncate to replace it")
+
+    def _secondary_indexes(self, cur, table):
+        """(name, definition) of the indexes that do not back a constraint."""
+        cur.execute(
+            "SELECT i.relname, pg_get_indexdef(i.oid) FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid WHERE x.indrelid = to_regclass(%s) AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = x.indexrelid)",
+            (table,),
+        )
+        return cur.fetchall()
+
+    def _copy_in(self, directory, table, info, replace=False):
+        """COPY a table file in one transaction, emptying the table first on replace."""
+        conn = self._connect()
+        try:
+            with (
+                conn.cursor() as cur,
+                gzip.open(os.path.join(directory, info["file"]), "rb") as f,
+            ):
+                if replace:
+                    cur.execute(f'TRUNCATE "{table}"')
+                digest = _Digest(f)
+                cur.copy_expert(
+                    f'COPY "{table}" ({_column_list(info["columns"])}) FROM STDIN',
+                    digest,
+                )
+                if (
+                    digest.rows != info["rows"]
+                    or digest.sha256.hexdigest() != info["sha256"]
+                ):
+                    raise RuntimeError(f"{info['file']} does not match the manifest")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        log.info(f"Imported {info['rows']} rows of {table}")
+
+    def _execute(self, statements):
+        conn = self._connect()
+        try:
+            with conn.cursor() as cur:
+                for statement in statements:
+                    cur.execute(statement)
+                    conn.commit()
+        finally:
+            conn.close()
+
+    def _reset_sequences(self, cur, table):
+        cur.execute(
+            "SELECT column_name, column_default FROM information_schema.columns WHERE table_schema = 'public' AND table_name = %s AND column_default LIKE 'nextval(%%'",
+            (table,),
+        )
+        for column, default in cur.fetchall():
+            cur.execute(
+                f'SELECT setval(%s, COALESCE((SELECT max("{column}") FROM "{table}"), 0) + 1, false)',
+                (_NEXTVAL.match(default).group(1),),
+            )
+
+    def restore(self, directory, truncate=False):
+        """Import the snapshot of directory and return its manifest."""
+        manifest = read_manifest(directory)
+        tables = manifest["tables"]
+        conn = psycopg2.connect(self.dsn)
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                self._check(cur, manifest, truncate)
+                checkpoint = ConfigurationDB.__tablename__
+                emptied = [
+                    table for table in tables if truncate and table != checkpoint
+                ]
+                if emptied:
+                    cur.execute(f"TRUNCATE {_column_list(emptied)}")
+                for table, info in tables.items():
+                    for month in info.get("months", []):
+                        cur.execute(
+                            "SELECT engine_create_month_partition(%s, %s, %s)",
+                            (table, PARTITIONED_TABLES[table], month),
+                        )
+                indexes = {}
+                for table in tables:
+                    for name, definition in self._secondary_indexes(cur, table):
+                        cur.execute(f'DROP INDEX "{name}"')
+                        # ON ONLY would leave the partitions without the index
+                        indexes.setdefault(table, []).append(
+                            definition.replace(" ON ONLY ", " ON ", 1)
+                        )
+                count = sum(len(definitions) for definitions in indexes.values())
+                log.info(f"Dropped {count} indexes until the data is loaded")
+                try:
+                    with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                        # largest first, so the small ones fill the gaps
+                        futures = [
+                            pool.submit(self._copy_in, directory, table, info)
+                            for table, info in sorted(
+                                tables.items(), key=lambda item: -item[1]["bytes"]
+                            )
+                            if table != checkpoint
+                        ]
+                        for future in futures:
+                            future.result()
+                    if checkpoint in tables:
+                        self._copy_in(
+                            directory, checkpoint, tables[checkpoint], replace=True
+                        )
+                finally:
+                    # one table at a time per connection, concurrent builds on
+                    # a partitioned table race for the partition index names
+                    with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                        for future in [
+                            pool.submit(self._execute, definitions)
+                            for definitions in indexes.values()
+                        ]:
+                            future.result()
+                    log.info(f"Built {count} indexes")
+                for table in tables:
+                    self._reset_sequences(cur, table)
+                    cur.execute(f'ANALYZE "{table}"')
+        finally:
+            conn.close()
+        return manifest
@@ -0,0 +1,245 @@
+# This Python file uses the following encoding: utf-8
+
+import logging
+from builtins import object
+from concurrent.futures import ThreadPoolExecutor
+
+from nectar.utils import parse_time
+
+from engine.json_codec import dumps, loads
+from engine.post_body_storage import PostBodyStorage
+from engine.post_metadata_storage import PostMetadataStorage, thread_path_segment
+from engine.post_storage import PostsTrx
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+log.addHandler(logging.StreamHandler())
+
+
+def post_key(author, permlink):
+    return f"{author}/{permlink}"
+
+
+def normalize_post(post):
+    """Bridge and condenser posts as dicts with the fields the thread needs."""
+    json_metadata = post.get("json_metadata")
+    if isinstance(json_metadata, str):
+        try:
+            json_metadata = loads(json_metadata) if json_metadata else None
+        except ValueError:
+            json_metadata = None
+    if not isinstance(json_metadata, dict):
+        json_metadata = None
+    updated = post.get("updated") or post.get("last_update")
+    return {
+        "author": post["author"],
+        "permlink": post["permlink"],
+        "category": post.get("category"),
+        "body": post.get("body") or "",
+        "json_metadata": json_metadata,
+        "parent_author": post.get("parent_author") or "",
+        "parent_permlink": post.get("parent_permlink") or "",
+        "root_author": post.get("root_author"),
+        "root_permlink": post.get("root_permlink"),
+        "depth": post.get("depth", 0),
+        "updated": parse_time(updated) if isinstance(updated, str) else updated,
+        "replies": list(post.get("replies") or []),
+    }
+
+
+class ThreadHydrator(object):
+    """Rebuilds the post_metadata rows of a thread from a Hive node.
+
+    The whole discussion is read with one bridge.get_discussion call; nodes
+    without the bridge API are walked breadth-first, fetching the replies of
+    each level concurrently. All rows are then written in one transaction.
+    """
+
+    def __init__(self, hived, max_workers=8):
+        self.hived = hived
+        self.max_workers = max_workers
+
+    def fetch_discussion(self, author, permlink):
+        try:
+            discussion = self.hived.rpc.get_discussion(
+                {"author": author, "permlink": permlink}, api="bridge"
+            )
+        except Exception as e:
+            log.warning(f"bridge.get_discussion failed for @{author}/{permlink}: {e}")
+            return None
+        if not discussion:
+            return None
+        return {key: normalize_post(post) for key, post in discussion.items()}
+
+    def _get_replies(self, post):
+        return [
+            normalize_post(reply)
+            for reply in self.hived.rpc.get_content_replies(
+                post["author"], post["permlink"], api="condenser_api"
+            )
+            or []
+        ]
+
+    def fetch_tree(self, author, permlink):
+        """Walk the discussion level by level with bounded concurrency."""
+        root = normalize_post(
+            self.hived.rpc.get_content(author, permlink, api="condenser_api")
+        )
+        posts = {post_key(author, permlink): root}
+        level = [root]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while level:
+                next_level = []
+                for post, replies in zip(level, executor.map(self._get_replies, level)):
+                    for reply in replies:
+                        key = post_key(reply["author"], reply["permlink"])
+                        post["replies"].append(key)
+                        if key not in posts:
+                            posts[key] = reply
+                            next_level.append(reply)
+                level = next_level
+        return posts
+
+    def fetch(self, author, permlink):
+        """All posts of the discussion below a post, keyed by author/permlink."""
+        posts = self.fetch_discussion(author, permlink)
+        if posts is None or post_key(author, permlink) not in posts:
+            posts = self.fetch_tree(author, permlink)
+        return posts
+
+    def root_url(self, post):
+        """URL of the root post, looked up once for the whole thread."""
+        category = post["category"]
+        while post["depth"] > 0 and not (post["root_author"] and post["root_permlink"]):
+            # bridge posts lack the root fields, condenser ones have them
+            post = normalize_post(
+                self.hived.rpc.get_content(
+                    post["parent_author"], post["parent_permlink"], api="condenser_api"
+                )
+            )
+        if post["depth"] == 0:
+            return f"/{category}/@{post['author']}/{post['permlink']}"
+        # the category of a comment is the one of its root post
+        return f"/{category}/@{post['root_author']}/{post['root_permlink']}"
+
+    def build(self, posts, author, permlink, token_posts):
+        """post_metadata rows of the thread, each post followed by its replies.
+
+        Subtrees of posts that are not in token_posts are skipped, like the
+        comment processor drops orphaned data of the comments contract.
+        """
+        start = posts[post_key(author, permlink)]
+        url = self.root_url(start)
+        rows = []
+        stack = [start]
+        while stack:
+            post = stack.pop()
+            authorperm = f"@{post['author']}/{post['permlink']}"
+            if authorperm not in token_posts:
+                continue
+            json_metadata = post["json_metadata"]
+            rows.append(
+                (
+                    post,
+                    {
+                        "authorperm": authorperm,
+                        "body": post["body"],
+                        "json_metadata": dumps(json_metadata or {}),
+                        "tags": ",".join(json_metadata["tags"])
+                        if json_metadata and "tags" in json_metadata
+                        else None,
+                        "parent_authorperm": f"@{post['parent_author']}/{post['parent_permlink']}"
+                        if post["parent_author"]
+                        else None,
+                        "children": len(post["replies"]),
+                        "url": url,
+                        "depth": post["depth"],
+                    },
+                )
+            )
+            stack.extend(
+                posts[key] for key in reversed(post["replies"]) if key in posts
+            )
+        return rows
+
+    def thread_paths(self, postMetadataStorage, rows, token_posts):
+        """root_authorperm and sort_path of each row, keyed by authorperm.
+
+        Empty when the thread starts at a reply whose own path is unknown.
+        """
+        start = rows[0][1]
+        if start["depth"] == 0:
+            root_authorperm = start["authorperm"]
+            sort_path = None
+        else:
+            start_metadata = postMetadataStorage.get(start["authorperm"])
+            if start_metadata is None or start_metadata["sort_path"] is None:
+                return {}
+            root_authorperm = start_metadata["root_authorperm"]
+            sort_path = start_metadata["sort_path"]
+        paths = {}
+        for _, this_result in rows:
+            authorperm = this_result["authorperm"]
+            segment = thread_path_segment(
+                authorperm, token_posts[authorperm]["created"]
+            )
+            if not paths:
+                paths[authorperm] = (root_authorperm, sort_path or segment)
+            else:
+                parent_path = paths[this_result["parent_authorperm"]][1]
+                paths[authorperm] = (root_authorperm, f"{parent_path}.{segment}")
+        return paths
+
+    def hydrate(self, db, token, author, permlink):
+        """Refresh a thread and return its posts joined with their metadata."""
+        posts = self.fetch(author, permlink)
+        postTrx = PostsTrx(db)
+        token_posts = postTrx.get_token_posts(
+            token, [f"@{post['author']}/{post['permlink']}" for post in posts.values()]
+        )
+        if f"@{author}/{permlink}" not in token_posts:
+            return []
+        rows = self.build(posts, author, permlink, token_posts)
+        postMetadataStorage = PostMetadataStorage(db)
+        paths = self.thread_paths(postMetadataStorage, rows, token_posts)
+        if paths:
+            # render the refreshed thread in the order it is read back
+            rows.sort(key=lambda row: paths[row[1]["authorperm"]][1])
+        metadata_rows = []
+        for post, this_result in rows:
+            row = dict(this_result, patch_count=0, body_synced_at=post["updated"])
+            if paths:
+                row["root_authorperm"], row["sort_path"] = paths[row["authorperm"]]
+            metadata_rows.append(row)
+        db.begin()
+        try:
+            postMetadataStorage.upsert_many(metadata_rows)
+            PostBodyStorage(db).delete_patches_many(
+                [this_result["authorperm"] for _, this_result in rows]
+            )
+            results = []
+            for post, this_result in rows:
+                token_post = token_posts[this_result["authorperm"]]
+                main_post = post["parent_permlink"] == "" or post["parent_author"] == ""
+                # In the case where metadata never updated the original post data, fix the post
+                if (
+                    (not token_post["main_post"] and main_post)
+                    or (
+                        token_post["main_post"]
+                        and token_post["parent_permlink"] is None
+                    )
+                    or (token_post["main_post"] and token_post["desc"] is None)
+                ):
+                    token_post["main_post"] = True
+                    token_post["tags"] = this_result["tags"]
+                    token_post["parent_author"] = post["parent_author"]
+                    token_post["parent_permlink"] = post["category"]
+                    token_post["desc"] = post["body"][:300]
+                    postTrx.upsert(token_post)
+                this_result.update(token_post)
+                results.append(this_result)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        return results
@@ -0,0 +1,124 @@
+# This Python file uses the following encoding: utf-8
+
+import logging
+from builtins import object
+from datetime import datetime, timezone
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+log.addHandler(logging.StreamHandler())
+
+timeformat = "%Y%m%d-%H%M%S"
+
+
+class TokenHoldersDB(object):
+    """This is the token holder stake snapshot storage class"""
+
+    __tablename__ = "token_holders"
+    __snapshot_tablename__ = "token_holder_snapshots"
+
+    def __init__(self, db):
+        self.db = db
+
+    def mark_dirty(self, token, accounts):
+        """Flag accounts whose stake changed so the snapshot builder refetches them.
+
+        Accounts not held yet get a placeholder row with stake 0 until then.
+        dirty_at changes with every flag, so a refetch can tell whether an
+        account was flagged again while its stake was fetched.
+        """
+        if not accounts:
+            return
+        self.db.query(
+            "INSERT INTO token_holders (token, account, stake, dirty, dirty_at) SELECT :token, a, 0, true, clock_timestamp() FROM unnest(CAST(:accounts AS varchar[])) a ON CONFLICT (token, account) DO UPDATE SET dirty = true, dirty_at = EXCLUDED.dirty_at",
+            token=token,
+            accounts=sorted(accounts),
+        )
+
+    def get_dirty(self, token, limit=1000):
+        """Flagged accounts of a token, mapped to when they were flagged."""
+        return {
+            x["account"]: x["dirty_at"]
+            for x in self.db.query(
+                "SELECT account, dirty_at FROM token_holders WHERE token = :token AND dirty ORDER BY account LIMIT :limit",
+                token=token,
+                limit=limit,
+            )
+        }
+
+    def update_stakes(self, token, dirty, stakes):
+        """Store refreshed stakes of the accounts returned by get_dirty.
+
+        Accounts without a balance are removed. Accounts flagged again since
+        get_dirty keep their flag and old stake, and are fetched once more.
+        """
+        now = datetime.now(timezone.utc)
+        fetched = [account for account in dirty if account in stakes]
+        missing = [account for account in dirty if account not in stakes]
+        self.db.begin()
+        try:
+            self.db.query(
+                "UPDATE token_holders h SET stake = f.stake, dirty = false, updated = :now FROM unnest(CAST(:accounts AS varchar[]), CAST(:stakes AS numeric[]), CAST(:dirty_at AS timestamp[])) AS f(account, stake, dirty_at) WHERE h.token = :token AND h.account = f.account AND h.dirty AND h.dirty_at IS NOT DISTINCT FROM f.dirty_at",
+                token=token,
+                accounts=fetched,
+                stakes=[stakes[account] for account in fetched],
+                dirty_at=[dirty[account] for account in fetched],
+                now=now,
+            )
+            self.db.query(
+                "DELETE FROM token_holders h USING unnest(CAST(:accounts AS varchar[]), CAST(:dirty_at AS timestamp[])) AS f(account, dirty_at) WHERE h.token = :token AND h.account = f.account AND h.dirty AND h.dirty_at IS NOT DISTINCT FROM f.dirty_at",
+                token=token,
+                accounts=missing,
+                dirty_at=[dirty[account] for account in missing],
+            )
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+
+    def replace_snapshot(self, token, stakes):
+        """Replace all holders of a token with a full crawl, keeping dirty flags.
+
+        Rows are updated in place; holders missing from the crawl are removed
+        unless they are flagged, so flags set during the crawl survive it.
+        """
+        now = datetime.now(timezone.utc)
+        accounts = sorted(stakes)
+        self.db.begin()
+        try:
+            self.db.query(
+                "INSERT INTO token_holders (token, account, stake, dirty, updated) SELECT :token, c.account, c.stake, false, :now FROM unnest(CAST(:accounts AS varchar[]), CAST(:stakes AS numeric[])) AS c(account, stake) ON CONFLICT (token, account) DO UPDATE SET stake = EXCLUDED.stake, updated = EXCLUDED.updated",
+                token=token,
+                accounts=accounts,
+                stakes=[stakes[account] for account in accounts],
+                now=now,
+            )
+            self.db.query(
+                "DELETE FROM token_holders WHERE token = :token AND NOT dirty AND (updated IS NULL OR updated < :now)",
+                token=token,
+                now=now,
+            )
+            self.db[self.__snapshot_tablename__].upsert(
+                {"token": token, "last_full_refresh": now, "holders": len(stakes)},
+                ["token"],
+            )
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+
+    def get_snapshot_time(self, token):
+        snapshot = self.db[self.__snapshot_tablename__].find_one(token=token)
+        return snapshot["last_full_refresh"] if snapshot is not None else None
+
+    def get_staked(self, token, start=None, limit=1000, min_stake=None):
+        """Fetched stakes of a token, without the placeholders of mark_dirty."""
+        start_clause = "AND account >= :start" if start else ""
+        stake_clause = "AND stake >= :min_stake" if min_stake is not None else ""
+        return self.db.query(
+            f"SELECT account, stake FROM token_holders WHERE token = :token AND NOT (dirty AND stake = 0) {start_clause} {stake_clause} ORDER BY account LIMIT :limit",
+            token=token,
+            start=start,
+            min_stake=min_stake,
+            limit=limit,
+        )
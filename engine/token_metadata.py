@@ -0,0 +1,267 @@
+# This Python file uses the following encoding: utf-8
+
+import json
+import logging
+import os
+import time
+from builtins import object
+from decimal import Decimal
+
+from nectarengine.tokenobject import Token
+
+from engine.metrics import CACHE_LOOKUPS
+from engine.notify import TOKEN_METADATA_CHANNEL, NotificationListener
+from engine.token_config_storage import TokenConfigDB
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+log.addHandler(logging.StreamHandler())
+
+ENGINE_FIND_LIMIT = 1000
+
+
+def engine_find(engine_api, contract, table, query, limit=ENGINE_FIND_LIMIT, offset=0):
+    """Api.find that always returns a list.
+
+    nectarengine unwraps single element results into a bare dict.
+    """
+    result = engine_api.find(contract, table, query, limit=limit, offset=offset)
+    if result is None:
+        return []
+    if isinstance(result, dict):
+        return [result]
+    return list(result)
+
+
+def fetch_reward_pools(engine_api, reward_pool_ids):
+    """Fetch reward pools by id with one batched find per 1000 ids."""
+    ids = sorted({int(i) for i in reward_pool_ids})
+    pools = {}
+    for start in range(0, len(ids), ENGINE_FIND_LIMIT):
+        chunk = ids[start : start + ENGINE_FIND_LIMIT]
+        for pool in engine_find(
+            engine_api, "comments", "rewardPools", {"_id": {"$in": chunk}}, len(chunk)
+        ):
+            pools[int(pool["_id"])] = pool
+    return pools
+
+
+def fetch_tokens(engine_api, symbols):
+    """Fetch token objects by symbol with one batched find per 1000 symbols."""
+    symbols = sorted(set(symbols))
+    tokens = {}
+    for start in range(0, len(symbols), ENGINE_FIND_LIMIT):
+        chunk = symbols[start : start + ENGINE_FIND_LIMIT]
+        for token in engine_find(
+            engine_api, "tokens", "tokens", {"symbol": {"$in": chunk}}, len(chunk)
+        ):
+            tokens[token["symbol"]] = token
+    return tokens
+
+
+def load_token_cache(cache_file, ttl):
+    """Token dicts stored by save_token_cache and when they were fetched.
+
+    Returns ({}, 0) when there is no cache file or it is older than ttl.
+    """
+    if not cache_file or not os.path.isfile(cache_file):
+        return {}, 0
+    try:
+        with open(cache_file) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        log.warning("Ignoring unreadable token cache %s", cache_file)
+        return {}, 0
+    if time.time() - cached.get("fetched", 0) > ttl:
+        return {}, 0
+    return cached.get("tokens", {}), cached["fetched"]
+
+
+def save_token_cache(cache_file, tokens, fetched):
+    """Atomically write token dicts to cache_file."""
+    if not cache_file:
+        return
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+        with open(tmp_file, "w") as f:
+            json.dump({"fetched": fetched, "tokens": tokens}, f)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        log.warning("Could not write token cache %s", cache_file)
+
+
+class LazyTokenObjects(object):
+    """Token objects by symbol, fetched on first access.
+
+    The first lookup reads ``cache_file`` if it is younger than ``ttl``
+    seconds. Symbols missing from it are fetched together with one batched
+    ``find`` and written back. Once the objects are older than ``ttl``, the
+    next lookup refetches all of them.
+    """
+
+    def __init__(self, engine_api, symbols=(), cache_file=None, ttl=3600):
+        self.engine_api = engine_api
+        self.symbols = set(symbols)
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.tokens = {}
+        self.fetched = 0
+        self.stale = set()
+        # symbols the sidechain does not know, not asked for again until expiry
+        self.absent = set()
+        self.cache_read = False
+
+    def _add(self, token_dicts):
+        for symbol, token in token_dicts.items():
+            self.tokens[symbol] = Token(token, api=self.engine_api)
+
+    def _fresh(self, symbol):
+        return (
+            (symbol in self.tokens or symbol in self.absent)
+            and symbol not in self.stale
+            and time.time() - self.fetched <= self.ttl
+        )
+
+    def _load(self):
+        if not self.cache_read:
+            cached, self.fetched = load_token_cache(self.cache_file, self.ttl)
+            self._add(cached)
+            self.cache_read = True
+        now = time.time()
+        expired = now - self.fetched > self.ttl
+        if expired:
+            missing = self.symbols | self.stale
+        else:
+            missing = (self.symbols - set(self.tokens) - self.absent) | self.stale
+        if not missing:
+            return
+        try:
+            fetched = fetch_tokens(self.engine_api, missing)
+        except Exception:
+            log.exception("Could not fetch token objects")
+            return
+        self._add(fetched)
+        if expired:
+            self.absent = set()
+            self.fetched = now
+        self.absent = (self.absent - set(fetched)) | (missing - set(fetched))
+        self.stale -= missing
+        save_token_cache(
+            self.cache_file,
+            {symbol: dict(token) for symbol, token in self.tokens.items()},
+            self.fetched,
+        )
+
+    def __getitem__(self, symbol):
+        if self._fresh(symbol):
+            CACHE_LOOKUPS.inc(cache="token_objects", result="hit")
+        else:
+            CACHE_LOOKUPS.inc(cache="token_objects", result="miss")
+            self.symbols.add(symbol)
+            self._load()
+        return self.tokens[symbol]
+
+    def get(self, symbol, default=None):
+        try:
+            return self[symbol]
+        except KeyError:
+            return default
+
+    def __contains__(self, symbol):
+        return self.get(symbol) is not None
+
+    def invalidate(self, symbol):
+        """Refetch symbol on its next lookup, e.g. after its reward pool changed."""
+        self.symbols.add(symbol)
+        self.stale.add(symbol)
+
+
+class TokenMetadataService(object):
+    """Reward pool and token metadata held by the API process.
+
+    All reward pools are refreshed together with a single batched ``find`` once
+    they are older than ``pool_timeout`` seconds. Token precision/issuer and the
+    token config are kept until ``token_timeout`` expires or the sidechain
+    streamer announces a reward pool change on ``TOKEN_METADATA_CHANNEL``.
+    Token objects are shared with other processes through ``token_cache_file``.
+    """
+
+    def __init__(
+        self,
+        engine_api,
+        databaseConnector=None,
+        pool_timeout=10,
+        token_timeout=3600,
+        token_cache_file=None,
+    ):
+        self.engine_api = engine_api
+        self.pool_timeout = pool_timeout
+        self.token_timeout = token_timeout
+        self.listener = (
+            NotificationListener(databaseConnector, [TOKEN_METADATA_CHANNEL])
+            if databaseConnector
+            else None
+        )
+        self.token_config = {}
+        self.reward_pools = {}
+        self.tokens = LazyTokenObjects(
+            engine_api, cache_file=token_cache_file, ttl=token_timeout
+        )
+        self.config_refreshed = 0
+        self.pools_refreshed = 0
+
+    def _apply_notifications(self):
+        if self.listener is None:
+            return
+        for _, payload in self.listener.poll():
+            self.config_refreshed = 0
+            self.pools_refreshed = 0
+            for token in self.tokens.symbols if payload is None else [payload]:
+                self.tokens.invalidate(token)
+
+    def refresh(self, db):
+        """Bring token config, reward pools and token objects up to date."""
+        self._apply_notifications()
+        now = time.time()
+        if now - self.config_refreshed > self.token_timeout:
+            self.token_config = TokenConfigDB(db).get_all()
+            self.config_refreshed = now
+        if now - self.pools_refreshed > self.pool_timeout:
+            CACHE_LOOKUPS.inc(cache="reward_pools", result="miss")
+            try:
+                self.reward_pools = fetch_reward_pools(
+                    self.engine_api,
+                    [c["reward_pool_id"] for c in self.token_config.values()],
+                )
+                self.pools_refreshed = now
+            except Exception:
+                log.exception("Could not refresh reward pools")
+        else:
+            CACHE_LOOKUPS.inc(cache="reward_pools", result="hit")
+        self.tokens.symbols.update(self.token_config)
+
+    def token_info(self, token):
+        """Returns the /info data for one token."""
+        token_data_object = {}
+        token_config = self.token_config.get(token)
+        if token_config and "reward_pool_id" in token_config:
+            reward_pool = self.reward_pools.get(int(token_config["reward_pool_id"]))
+            if reward_pool is not None:
+                token_data_object["pending_rshares"] = Decimal(
+                    reward_pool["pendingClaims"]
+                )
+                token_data_object["reward_pool"] = Decimal(reward_pool["rewardPool"])
+        token_object = self.tokens.get(token)
+        if token_object is not None:
+            token_data_object["precision"] = token_object["precision"]
+            token_data_object["issuer"] = token_object["issuer"]
+        return token_data_object
+
+    def all_token_info(self):
+        token_data = {}
+        for token in self.token_config:
+            token_data_object = {"token": token}
+            token_data_object.update(self.token_info(token))
+            token_data[token] = token_data_object
+        return token_data
@@ -1,10 +1,11 @@
 #!/usr/bin/python
 import json
 import logging
+import logging.config
 import math
 import os
 
-from nectarengine.tokenobject import Token
+from engine.token_metadata import LazyTokenObjects
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -18,6 +19,15 @@ def setup_logging(default_path="logging.json", default_level=logging.INFO):
         with open(path, "rt") as f:
             config = json.load(f)
         logging.config.dictConfig(config)
+        # engine.* and processors.* modules attach their own StreamHandler on
+        # import; hand them over to the configured handlers, levels and filters
+        for name, module_logger in list(logging.Logger.manager.loggerDict.items()):
+            if isinstance(module_logger, logging.Logger) and name.split(".")[0] in (
+                "engine",
+                "processors",
+            ):
+                module_logger.handlers = []
+                module_logger.setLevel(logging.NOTSET)
     else:
         logging.basicConfig(level=default_level)
 
@@ -46,6 +56,15 @@ def _score(rshares, created_timestamp, timescale=480000):
     return sign * order + created_timestamp / timescale
 
 
+def insert_rows(db, tablename, rows, chunk_size=1000):
+    """Insert rows with one multi-row INSERT statement per chunk."""
+    if not rows:
+        return
+    table = db[tablename].table
+    for start in range(0, len(rows), chunk_size):
+        db.query(table.insert().values(rows[start : start + chunk_size]))
+
+
 def initialize_config(config_file):
     if not os.path.isfile(config_file):
         raise Exception("config.json is missing!")
@@ -61,11 +80,13 @@ def initialize_config(config_file):
     return config_data
 
 
-def initialize_token_metadata(token_config, engine_api):
-    token_objects = {}
+def initialize_token_metadata(token_config, engine_api, token_cache_file=None):
+    # token objects are only fetched when a processor first needs one
+    token_objects = LazyTokenObjects(
+        engine_api, token_config, cache_file=token_cache_file
+    )
     token_config_by_id = {}
     for token in token_config:
-        token_objects[token] = Token(token, api=engine_api)
         token_config_by_id[token_config[token]["reward_pool_id"]] = token_config[token]
     return {
         "config": token_config,
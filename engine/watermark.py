@@ -0,0 +1,76 @@
+# This Python file uses the following encoding: utf-8
+
+import logging
+from builtins import object
+from datetime import datetime, timezone
+
+from engine.notify import ENGINE_PROGRESS_CHANNEL, NotificationListener
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+log.addHandler(logging.StreamHandler())
+
+
+class EngineWatermark(object):
+    """In-memory copy of how far the sidechain streamer has committed.
+
+    The Hive streamer must stay behind the sidechain. Instead of reading the
+    engine checkpoint for every op, the timestamp is kept in memory and only
+    re-checked when an op is about to overtake it: first from the progress
+    notifications the sidechain streamer sends on commit, then from the
+    ``configuration`` table in case notifications were missed.
+    """
+
+    def __init__(self, confStorage, databaseConnector=None):
+        self.confStorage = confStorage
+        self.listener = (
+            NotificationListener(databaseConnector, [ENGINE_PROGRESS_CHANNEL])
+            if databaseConnector
+            else None
+        )
+        self.timestamp = None
+
+    def advance(self, timestamp):
+        if timestamp is not None and (
+            self.timestamp is None or timestamp > self.timestamp
+        ):
+            self.timestamp = timestamp
+
+    def refresh(self):
+        """Read the checkpoint from the database."""
+        engine_conf = self.confStorage.get_engine()
+        if engine_conf and engine_conf.get("last_engine_streamed_timestamp"):
+            self.advance(
+                engine_conf["last_engine_streamed_timestamp"].replace(
+                    tzinfo=timezone.utc
+                )
+            )
+        return self.timestamp
+
+    def poll(self):
+        """Apply progress notifications received so far."""
+        if self.listener is None:
+            return self.timestamp
+        for _, payload in self.listener.poll():
+            if payload is None:
+                # (re)connected, anything sent in between is lost
+                self.refresh()
+                continue
+            try:
+                self.advance(datetime.fromisoformat(payload))
+            except ValueError:
+                log.warning("Invalid engine progress payload %s", payload)
+        return self.timestamp
+
+    def allows(self, timestamp):
+        """True when an op at timestamp is behind the sidechain."""
+        if self.timestamp is not None and timestamp < self.timestamp:
+            return True
+        if self.poll() is not None and timestamp < self.timestamp:
+            return True
+        self.refresh()
+        return self.timestamp is not None and timestamp < self.timestamp
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.close()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse
+import logging
+import os
+import sys
+
+from engine.migrations import MigrationRunner
+from engine.utils import initialize_config, setup_logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logging.basicConfig()
+
+
+def print_status(runner):
+    for migration, applied in runner.status():
+        name = os.path.basename(migration.path)
+        if applied is None:
+            print(f"pending  {name}")
+        elif applied["checksum"] != migration.checksum:
+            print(f"changed  {name} (applied {applied['applied_at']:%Y-%m-%d %H:%M})")
+        else:
+            print(f"applied  {name} ({applied['applied_at']:%Y-%m-%d %H:%M})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Apply the pending schema migrations in sql/migrations."
+    )
+    parser.add_argument(
+        "--status", action="store_true", help="List the migrations and exit"
+    )
+    parser.add_argument(
+        "--target", type=int, help="Stop after the migration with this version"
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Only list what would be applied"
+    )
+    parser.add_argument(
+        "--database", help="Database connector, instead of the one of config.json"
+    )
+    args = parser.parse_args()
+
+    setup_logging("logger.json")
+
+    databaseConnector = args.database
+    if databaseConnector is None:
+        config_file = "config.json"
+        config_data = initialize_config(config_file)
+        databaseConnector = config_data["databaseConnector"]
+
+    runner = MigrationRunner(databaseConnector)
+    try:
+        if args.status:
+            print_status(runner)
+            sys.exit(0)
+        applied = runner.migrate(target=args.target, dry_run=args.dry_run)
+        if not applied:
+            logger.info("Schema is up to date")
+    finally:
+        runner.close()
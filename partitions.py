@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse
+import logging
+import os
+import sys
+from datetime import datetime
+
+import dataset
+
+from engine.partition_storage import PARTITIONED_TABLES, PartitionStorage, month_start
+from engine.utils import initialize_config, setup_logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logging.basicConfig()
+
+
+def print_status(storage, tables):
+    for table in tables:
+        for partition in storage.partitions(table):
+            rows = storage.db.query(
+                f'SELECT count(*) c FROM "{partition["name"]}"'
+            ).next()["c"]
+            if partition["lower"] is None:
+                print(f"{partition['name']:32} default              {rows:>10} rows")
+            else:
+                print(
+                    f"{partition['name']:32} {partition['lower']:%Y-%m-%d} - {partition['upper']:%Y-%m-%d} {rows:>10} rows"
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Create and drop the monthly partitions of posts, votes and account_history."
+    )
+    parser.add_argument(
+        "--status", action="store_true", help="List the partitions and exit"
+    )
+    parser.add_argument(
+        "--months-ahead",
+        type=int,
+        default=2,
+        help="Create the partitions of the current and this many coming months",
+    )
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="Drop the partitions older than --keep-months",
+    )
+    parser.add_argument(
+        "--keep-months",
+        type=int,
+        help="Months kept by --prune, in addition to the current one",
+    )
+    parser.add_argument(
+        "--archive-dir",
+        help="Write pruned partitions to this directory as gzipped CSV before dropping them",
+    )
+    parser.add_argument(
+        "--table",
+        action="append",
+        choices=sorted(PARTITIONED_TABLES),
+        help="Only this table (repeatable)",
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Only list what would be dropped"
+    )
+    parser.add_argument(
+        "--database", help="Database connector, instead of the one of config.json"
+    )
+    args = parser.parse_args()
+    if args.prune and args.keep_months is None:
+        parser.error("--prune needs --keep-months")
+
+    setup_logging("logger.json")
+
+    databaseConnector = args.database
+    if databaseConnector is None:
+        config_file = "config.json"
+        config_data = initialize_config(config_file)
+        databaseConnector = config_data["databaseConnector"]
+
+    db = dataset.connect(databaseConnector, ensure_schema=False)
+    storage = PartitionStorage(db)
+    tables = args.table or sorted(PARTITIONED_TABLES)
+    for table in tables:
+        if not storage.is_partitioned(table):
+            logger.error(
+                f"{table} is not partitioned, run migrate.py to apply sql/migrations/0003_partition_by_month.sql"
+            )
+            sys.exit(1)
+
+    if args.status:
+        print_status(storage, tables)
+        sys.exit(0)
+
+    now = datetime.utcnow()
+    for table in tables:
+        for months in range(args.months_ahead + 1):
+            storage.create_month(table, month_start(now, months))
+        for month in storage.default_months(table):
+            name = storage.create_month(table, month)
+            logger.info(f"Moved the rows of {table}_default to {name}")
+
+    if args.prune:
+        if args.archive_dir:
+            os.makedirs(args.archive_dir, exist_ok=True)
+        for table in tables:
+            for partition in storage.expired(table, args.keep_months, now):
+                if args.dry_run:
+                    logger.info(f"Would drop {partition['name']}")
+                    continue
+                if args.archive_dir:
+                    path = storage.archive(partition, args.archive_dir)
+                    logger.info(f"Archived {partition['name']} to {path}")
+                storage.drop(table, partition)
+                logger.info(f"Dropped {partition['name']}")
@@ -1,16 +1,21 @@
 # This Python file uses the following encoding: utf-8
 
-import json
 import logging
 import time
-import traceback
+from datetime import timezone
 
 from diff_match_patch import diff_match_patch
-from nectar.comment import Comment
 from nectar.utils import construct_authorperm
 
 from engine.account_storage import AccountsDB
-from engine.post_metadata_storage import PostMetadataStorage
+from engine.json_codec import decode_field, encode_field
+from engine.post_body_storage import PostBodyStorage
+from engine.post_metadata_storage import (
+    PostMetadataStorage,
+    metadata_projection,
+    thread_path_segment,
+)
+from engine.post_repair_storage import PostRepairQueue
 from engine.post_storage import PostsTrx
 
 log = logging.getLogger(__name__)
@@ -21,11 +26,15 @@ log.addHandler(logging.StreamHandler())
 class CommentProcessorForEngine(object):
     """Processor for handling comment operations for engine comments."""
 
-    def __init__(self, db, hived, token_metadata):
+    def __init__(self, db, hived, token_metadata, store_body_patches=False):
         self.db = db
         self.hived = hived
         self.postTrx = PostsTrx(db)
         self.postMetadataStorage = PostMetadataStorage(db)
+        self.postBodyStorage = PostBodyStorage(db)
+        self.postRepairQueue = PostRepairQueue(db)
+        # log edits as patches instead of rewriting the whole body
+        self.store_body_patches = store_body_patches
         self.accountsStorage = AccountsDB(db)
         self.token_metadata = token_metadata
 
@@ -52,15 +61,13 @@ class CommentProcessorForEngine(object):
             title = None
         children = 0
         try:
-            json_metadata = json.loads(ops["json_metadata"])
-            if isinstance(json_metadata, str):
-                json_metadata = json.loads(json_metadata)
+            json_metadata = decode_field(ops, "json_metadata")
         except Exception:
-            print("Metadata error for %s" % authorperm)
+            log.debug("Metadata error for %s", authorperm)
             json_metadata = {}
 
         if not isinstance(json_metadata, dict):
-            print("bad nondict json_metadata")
+            log.debug("bad nondict json_metadata")
             json_metadata = {}
 
         tags_set = set()
@@ -98,56 +105,69 @@ class CommentProcessorForEngine(object):
                 title = posts[0]["title"]
 
             old_post_metadata = self.postMetadataStorage.get(authorperm)
+            patch_count = None
 
             if "body" in ops:
                 try:
                     dmp = diff_match_patch()
                     patch = dmp.patch_fromText(ops["body"])
-                    if old_post_metadata and patch is not None and len(patch):
-                        new_body, _ = dmp.patch_apply(patch, old_post_metadata["body"])
-                    elif patch is not None and len(patch) and not old_post_metadata:
-                        print(f"Edit on post not in db, fetching {authorperm}")
-                        c = None
-                        cnt = 0
-                        while c is None and cnt < 5:
-                            cnt += 1
-                            try:
-                                c = Comment(
-                                    authorperm,
-                                    blockchain_instance=self.hived,
-                                )
-                            except Exception:
-                                print(f"Attempt {cnt}: Could not fetch comment")
-                                traceback.print_exc()
-                                c = None
-                        if c is not None:
-                            new_body = c["body"]
-                        else:
-                            new_body = ops["body"]
+                    is_patch = patch is not None and len(patch) > 0
+                    synced_at = (
+                        old_post_metadata["body_synced_at"]
+                        if old_post_metadata
+                        else None
+                    )
+                    if is_patch and (
+                        not old_post_metadata
+                        or self.postRepairQueue.is_queued(authorperm)
+                    ):
+                        # the body is unknown until repair_posts.py fetched it
+                        log.info("Edit on post not in db, queued %s", authorperm)
+                        self.postRepairQueue.enqueue(authorperm, timestamp)
+                        new_body = None
+                    elif is_patch and (
+                        synced_at is not None
+                        and timestamp <= synced_at.replace(tzinfo=timezone.utc)
+                    ):
+                        # the body fetched from the node already has this edit
+                        new_body = self.postBodyStorage.materialize(old_post_metadata)
+                        patch_count = old_post_metadata["patch_count"]
+                    elif is_patch and self.store_body_patches:
+                        new_body, patch_count = self.postBodyStorage.append(
+                            old_post_metadata, ops["body"], timestamp
+                        )
+                    elif is_patch:
+                        new_body, _ = dmp.patch_apply(
+                            patch, self.postBodyStorage.materialize(old_post_metadata)
+                        )
                     else:
                         new_body = ops["body"]
                 except Exception:
                     new_body = ops["body"]
 
-            desc = new_body[:300]
+            desc = new_body[:300] if new_body is not None else None
+            projection = metadata_projection(json_metadata)
             if posts[0]["children"] is not None:
                 children = posts[0]["children"]
 
             for post in posts:
                 token = post["token"]
-                posts_list.append(
-                    {
-                        "authorperm": authorperm,
-                        "token": token,
-                        "title": title[:256],
-                        "desc": desc,
-                        "tags": tags[:256],
-                        "parent_author": ops["parent_author"],
-                        "parent_permlink": ops["parent_permlink"],
-                        "main_post": main_post,
-                        "children": children,
-                    }
-                )
+                token_post = {
+                    "authorperm": authorperm,
+                    "token": token,
+                    "title": title[:256],
+                    "desc": desc,
+                    "tags": tags[:256],
+                    "parent_author": ops["parent_author"],
+                    "parent_permlink": ops["parent_permlink"],
+                    "main_post": main_post,
+                    "children": children,
+                }
+                token_post.update(projection)
+                if desc is None:
+                    # keep the old description until the post is repaired
+                    del token_post["desc"]
+                posts_list.append(token_post)
 
             if main_post:
                 self.accountsStorage.upsert(
@@ -171,14 +191,26 @@ class CommentProcessorForEngine(object):
                             "children": children,
                         }
                     )
+            # the path of a post is set once, edits keep its place in the thread
+            created = posts[0]["created"]
             post_metadata = {
                 "authorperm": authorperm,
-                "body": new_body,
-                "json_metadata": json.dumps(json_metadata),
+                "json_metadata": encode_field(ops, "json_metadata", json_metadata),
                 "parent_authorperm": parent_authorperm,
                 "title": title,
                 "tags": tags,
             }
+            if new_body is None:
+                if not old_post_metadata:
+                    post_metadata["body"] = ""
+            elif patch_count is not None:
+                # the base body stays, only the patch log grew
+                post_metadata["patch_count"] = patch_count
+            else:
+                post_metadata["body"] = new_body
+                post_metadata["patch_count"] = 0
+                if old_post_metadata and old_post_metadata.get("patch_count"):
+                    self.postBodyStorage.delete_patches(authorperm)
             if ops["parent_author"] and ops["parent_permlink"]:
                 parent_post_metadata = self.postMetadataStorage.get(parent_authorperm)
                 if parent_post_metadata:
@@ -194,16 +226,34 @@ class CommentProcessorForEngine(object):
                         post_metadata["depth"] = parent_post_metadata["depth"] + 1
                     if parent_post_metadata["url"] is not None:
                         post_metadata["url"] = parent_post_metadata["url"]
+                    if parent_post_metadata["sort_path"] is not None and not (
+                        old_post_metadata and old_post_metadata["sort_path"]
+                    ):
+                        post_metadata["root_authorperm"] = parent_post_metadata[
+                            "root_authorperm"
+                        ]
+                        post_metadata["sort_path"] = (
+                            parent_post_metadata["sort_path"]
+                            + "."
+                            + thread_path_segment(authorperm, created)
+                        )
             else:
                 post_metadata["depth"] = 0
                 post_metadata["url"] = f"/{ops['parent_permlink']}/{authorperm}"
+                if not (old_post_metadata and old_post_metadata["sort_path"]):
+                    post_metadata["root_authorperm"] = authorperm
+                    post_metadata["sort_path"] = thread_path_segment(
+                        authorperm, created
+                    )
 
             self.postMetadataStorage.upsert(post_metadata)
+            if "sort_path" in post_metadata:
+                # replies indexed before this post had a path get theirs now
+                self.postMetadataStorage.fill_thread_paths([authorperm])
 
         if len(posts_list) > 0:
             self.postTrx.add_batch(posts_list)
 
-        print(
-            "Adding comment/post (engine) took %.2f s"
-            % (time.time() - comment_start_time)
+        log.debug(
+            "Adding comment/post (engine) took %.2f s", time.time() - comment_start_time
         )
@@ -1,12 +1,11 @@
 # This Python file uses the following encoding: utf-8
 
-import json
 import logging
-import traceback
 
 from engine.account_history_storage import AccountHistoryTrx
 from engine.account_storage import AccountsDB
 from engine.follow_storage import FollowsDB
+from engine.json_codec import decode_field
 from engine.post_storage import PostsTrx
 from engine.reblog_storage import ReblogsDB
 from engine.token_config_storage import TokenConfigDB
@@ -21,12 +20,9 @@ def extract_json_data(ops):
     """Extract JSON data."""
     json_data = None
     try:
-        json_data = json.loads(ops["json"])
-        if isinstance(json_data, str):
-            json_data = json.loads(json_data)
+        json_data = decode_field(ops, "json")
     except Exception:
-        traceback.print_exc()
-        print("Skip json: %s" % str(ops["json"]))
+        log.debug("Skip json: %s", ops["json"])
     return json_data
 
 
@@ -43,26 +39,23 @@ def extract_user(ops, json_data):
     elif len(ops["required_auths"]) > 0:
         return ops["required_auths"][0]
     else:
-        print("Cannot parse transaction, as user could not be determined!")
+        log.debug("Cannot parse transaction, as user could not be determined!")
     return None
 
 
 def check_engine_op(op):
     """Check Engine API transaction."""
     if op is not None and "logs" in op:
-        logs = json.loads(op["logs"])
-        if isinstance(logs, str):
-            logs = json.loads(logs)
+        logs = decode_field(op, "logs")
         if "errors" not in logs:
             return True
         elif logs["errors"] == ["contract doesn't exist"]:
             # Ignore witness contract not existing, happens for ENG / BEE staking
             return True
         else:
-            print(op["logs"])
-            print("Op has errors.")
+            log.debug("Op has errors: %s", op["logs"])
             return False
-    print("Op has no logs.")
+    log.debug("Op has no logs.")
     return True
 
 
@@ -2,6 +2,7 @@
 
 import logging
 
+from engine.notify import TOKEN_METADATA_CHANNEL, notify
 from processors.custom_json_processor import CustomJsonProcessor, extract_user
 
 log = logging.getLogger(__name__)
@@ -34,7 +35,10 @@ class SetTribeSettingsProcessor(CustomJsonProcessor):
 
         reward_pool = self.token_metadata["config_by_id"][reward_pool_id]
         token = reward_pool["token"]
-        token_object = token_objects[token]
+        token_object = token_objects.get(token)
+        if token_object is None:
+            log.warning("No token object for %s", token)
+            return
 
         if user != token_object["issuer"]:
             print("User not issuer")
@@ -45,3 +49,4 @@ class SetTribeSettingsProcessor(CustomJsonProcessor):
         self.tokenConfigStorage.upsert(reward_pool)
         token_config[token] = self.tokenConfigStorage.get(token)
         token_config_by_id[reward_pool_id] = token_config[token]
+        notify(self.db, TOKEN_METADATA_CHANNEL, token)
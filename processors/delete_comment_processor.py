@@ -0,0 +1,28 @@
+# This Python file uses the following encoding: utf-8
+
+import logging
+from builtins import object
+
+from nectar.utils import construct_authorperm
+
+from engine.post_storage import PostsTrx
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+log.addHandler(logging.StreamHandler())
+
+
+class DeleteCommentProcessor(object):
+    """Processor for delete_comment operations."""
+
+    def __init__(self, db):
+        self.db = db
+        self.postTrx = PostsTrx(db)
+
+    def process(self, ops):
+        """Main process method."""
+        authorperm = construct_authorperm(ops["author"], ops["permlink"])
+        try:
+            self.postTrx.delete_posts(authorperm)
+        except Exception:
+            log.warning("Could not process delete of %s", authorperm)
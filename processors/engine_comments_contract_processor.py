@@ -1,13 +1,12 @@
 # This Python file uses the following encoding: utf-8
 
-import json
 import logging
 import traceback
 from datetime import timedelta
 from decimal import Decimal
 
-from nectarengine.tokenobject import Token
-
+from engine.json_codec import decode_field
+from engine.notify import TOKEN_METADATA_CHANNEL, notify
 from engine.utils import _score
 from processors.custom_json_processor import CustomJsonProcessor
 
@@ -29,7 +28,7 @@ class CommentsContractProcessor(CustomJsonProcessor):
         token_objects = self.token_metadata["objects"]
         token_config_by_id = self.token_metadata["config_by_id"]
 
-        logs = json.loads(op["logs"])
+        logs = decode_field(op, "logs")
         if op["action"] == "setMute" and "errors" not in logs:
             account = contractPayload["account"]
             reward_pool_id = contractPayload["rewardPoolId"]
@@ -51,6 +50,7 @@ class CommentsContractProcessor(CustomJsonProcessor):
         if "events" in logs:
             events = logs["events"]
             paid_out_posts = {}
+            history = []
             for event in events:
                 if event["contract"] == "comments":
                     if event["event"] == "newComment":
@@ -134,7 +134,7 @@ class CommentsContractProcessor(CustomJsonProcessor):
                                 curation_share
                             )
                             if curation_share > 0:
-                                self.accountHistoryTrx.add(
+                                history.append(
                                     {
                                         "account": event["data"]["account"],
                                         "token": token,
@@ -169,7 +169,7 @@ class CommentsContractProcessor(CustomJsonProcessor):
                                 beneficiary_share
                             )
                             if beneficiary_share > 0:
-                                self.accountHistoryTrx.add(
+                                history.append(
                                     {
                                         "account": event["data"]["account"],
                                         "token": token,
@@ -197,11 +197,9 @@ class CommentsContractProcessor(CustomJsonProcessor):
                             }
                         author_share = Decimal(event["data"]["quantity"])
                         paid_out_posts[authorperm]["total_payout_value"] += author_share
-                        paid_out_posts[authorperm]["vote_rshares"] = 0
-                        paid_out_posts[authorperm]["score_hot"] = 0
-                        paid_out_posts[authorperm]["score_trend"] = 0
+                        paid_out_posts[authorperm]["reset_scores"] = True
                         if author_share > 0:
-                            self.accountHistoryTrx.add(
+                            history.append(
                                 {
                                     "account": event["data"]["account"],
                                     "token": token,
@@ -271,34 +269,9 @@ class CommentsContractProcessor(CustomJsonProcessor):
                         )
                         token_config[token] = self.tokenConfigStorage.get(token)
                         token_config_by_id[reward_pool_id] = token_config[token]
-                        token_objects[token] = Token(token, api=self.api)
+                        token_objects.invalidate(token)
+                        notify(self.db, TOKEN_METADATA_CHANNEL, token)
                     else:
-                        print(event)
-            for paid_out_post in paid_out_posts.values():
-                old_paid_out_post = self.postTrx.get_token_post(
-                    paid_out_post["token"], paid_out_post["authorperm"]
-                )
-                if not old_paid_out_post:
-                    self.postTrx.update(
-                        {
-                            "token": paid_out_post["token"],
-                            "authorperm": paid_out_post["authorperm"],
-                            "last_payout": paid_out_post["last_payout"],
-                            "total_payout_value": paid_out_post["total_payout_value"],
-                            "curator_payout_value": paid_out_post[
-                                "curator_payout_value"
-                            ],
-                        }
-                    )
-                else:
-                    if old_paid_out_post["total_payout_value"]:
-                        print(
-                            f"! updating existing {old_paid_out_post}, {paid_out_post}"
-                        )
-                    old_paid_out_post["total_payout_value"] += paid_out_post[
-                        "total_payout_value"
-                    ]
-                    old_paid_out_post["curator_payout_value"] += paid_out_post[
-                        "curator_payout_value"
-                    ]
-                    self.postTrx.update(old_paid_out_post)
+                        log.debug("Unhandled comments event %s", event["event"])
+            self.accountHistoryTrx.insert_batch(history)
+            self.postTrx.apply_payouts(list(paid_out_posts.values()))
@@ -1,6 +1,5 @@
 # This Python file uses the following encoding: utf-8
 
-import json
 import logging
 import re
 import traceback
@@ -25,17 +24,15 @@ class PromotePostProcessor(CustomJsonProcessor):
 
     def process(self, op, contractPayload):
         """Main process method."""
-        print(json.dumps(contractPayload))
+        log.debug("promotion transfer %s", contractPayload)
 
         if not check_engine_op(op):
             return
         if "symbol" not in contractPayload:
-            print("No symbol field in contractPayload")
-            print(json.dumps(contractPayload))
+            log.warning("No symbol field in contractPayload %s", contractPayload)
             return
         if "quantity" not in contractPayload:
-            print("No quantity field in contractPayload")
-            print(json.dumps(contractPayload))
+            log.warning("No quantity field in contractPayload %s", contractPayload)
             return
 
         if isinstance(contractPayload["quantity"], (float, int)):
@@ -44,7 +41,7 @@ class PromotePostProcessor(CustomJsonProcessor):
             try:
                 quantity = float(contractPayload["quantity"])
             except Exception:
-                print("%s is not a valid amount" % contractPayload["quantity"])
+                log.warning("%s is not a valid amount", contractPayload["quantity"])
                 return
 
         transfer_token = contractPayload["symbol"]
@@ -55,20 +52,21 @@ class PromotePostProcessor(CustomJsonProcessor):
 
         promotion_success = False
         memo = contractPayload["memo"]
-        print("promotion detected %s" % str(memo))
+        log.debug("promotion detected %s", memo)
         try:
             if memo[0] == "'" or memo[0] == '"':
                 memo = memo[1:-1]
             at_sign_position = re.search(r"h?@", memo).start()
             if at_sign_position < 0:
-                print("Memo must include @ sign")
+                log.debug("Memo must include @ sign")
                 return
             else:
                 authorperm = memo[at_sign_position:]
 
-                print(
-                    "Transfer to null with memo %s and token %s detected"
-                    % (authorperm, transfer_token)
+                log.debug(
+                    "Transfer to null with memo %s and token %s detected",
+                    authorperm,
+                    transfer_token,
                 )
                 posts = self.postTrx.get_post(authorperm)
                 promoted = 0
@@ -96,6 +94,6 @@ class PromotePostProcessor(CustomJsonProcessor):
                     "score_promoted": sc_promoted,
                 }
             )
-            print(
-                "%s was promoted with %.2f %s" % (authorperm, quantity, transfer_token)
+            log.info(
+                "%s was promoted with %.2f %s", authorperm, quantity, transfer_token
             )
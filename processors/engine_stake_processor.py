@@ -0,0 +1,62 @@
+# This Python file uses the following encoding: utf-8
+
+import logging
+
+from engine.json_codec import decode_field
+from engine.token_holder_storage import TokenHoldersDB
+from processors.custom_json_processor import CustomJsonProcessor
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+log.addHandler(logging.StreamHandler())
+
+# tokens contract actions that change the stake of the accounts involved
+STAKE_ACTIONS = frozenset(
+    [
+        "stake",
+        "unstake",
+        "cancelUnstake",
+        "delegate",
+        "undelegate",
+        "checkPendingUnstakes",
+        "checkPendingUndelegations",
+    ]
+)
+ACCOUNT_FIELDS = ("account", "to", "from")
+
+
+class StakeProcessor(CustomJsonProcessor):
+    """Processor flagging stake changes for the staked accounts snapshot."""
+
+    def __init__(self, db, token_metadata):
+        super().__init__(db, token_metadata)
+        self.tokenHoldersDb = TokenHoldersDB(db)
+
+    def process(self, op, contractPayload):
+        """Main process method."""
+        token_config = self.token_metadata["config"]
+        changed = {}
+
+        def add(token, account):
+            if isinstance(token, str) and token in token_config and account:
+                changed.setdefault(token, set()).add(account)
+
+        if isinstance(contractPayload, dict):
+            token = contractPayload.get("symbol")
+            add(token, op.get("sender"))
+            for field in ACCOUNT_FIELDS:
+                add(token, contractPayload.get(field))
+
+        try:
+            logs = decode_field(op, "logs") if op.get("logs") else {}
+        except Exception:
+            logs = {}
+        for event in logs.get("events", []):
+            if event.get("contract") != "tokens":
+                continue
+            data = event.get("data") or {}
+            for field in ACCOUNT_FIELDS:
+                add(data.get("symbol"), data.get(field))
+
+        for token, accounts in changed.items():
+            self.tokenHoldersDb.mark_dirty(token, accounts)
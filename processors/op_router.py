@@ -0,0 +1,85 @@
+# This Python file uses the following encoding: utf-8
+
+import logging
+from builtins import object
+
+from engine.metrics import DECODE_SECONDS, PROCESSOR_SECONDS, ROUTED_OPS
+from processors.custom_json_processor import extract_json_data
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+log.addHandler(logging.StreamHandler())
+
+
+def is_reblog(json_data):
+    """["reblog", {"account": ..., "author": ..., "permlink": ...}]"""
+    return (
+        isinstance(json_data, list)
+        and len(json_data) == 2
+        and json_data[0] == "reblog"
+        and isinstance(json_data[1], dict)
+    )
+
+
+class Route(object):
+    """A processor and the ops it handles."""
+
+    def __init__(self, name, processor, match=None):
+        self.name = name
+        self.processor = processor
+        self.match = match
+
+
+class OpRouter(object):
+    """Dispatches ops to processors through a dict keyed by (op type, id).
+
+    The id is the custom_json id, or None for other op types. custom_json
+    payloads are only decoded when a route exists for their id, so ops of
+    other apps cost one dict lookup. Processors of custom_json ops are called
+    with process(ops, json_data), all others with process(ops).
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.routes = {}
+
+    def add(self, name, processor, op_type, custom_json_id=None, match=None):
+        """Register a processor; routes of the same key are tried in order.
+
+        match gets the decoded payload and tells whether the route applies.
+        """
+        self.routes.setdefault((op_type, custom_json_id), []).append(
+            Route(name, processor, match)
+        )
+
+    def op_types(self):
+        """Op types with at least one route, to filter fetched blocks with."""
+        return sorted({op_type for op_type, _ in self.routes})
+
+    def dispatch(self, ops):
+        """Run the first matching route and return its name, or None."""
+        op_type = ops["type"]
+        is_custom_json = op_type == "custom_json"
+        routes = self.routes.get((op_type, ops["id"] if is_custom_json else None))
+        if not routes:
+            ROUTED_OPS.inc(stream=self.stream, route="unhandled")
+            return None
+        json_data = None
+        if is_custom_json:
+            with DECODE_SECONDS.time(stream=self.stream):
+                json_data = extract_json_data(ops)
+            if not json_data:
+                ROUTED_OPS.inc(stream=self.stream, route="unhandled")
+                return None
+        for route in routes:
+            if route.match is not None and not route.match(json_data):
+                continue
+            with PROCESSOR_SECONDS.time(processor=route.name):
+                if is_custom_json:
+                    route.processor.process(ops, json_data)
+                else:
+                    route.processor.process(ops)
+            ROUTED_OPS.inc(stream=self.stream, route=route.name)
+            return route.name
+        ROUTED_OPS.inc(stream=self.stream, route="unhandled")
+        return None
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+import dataset
+
+from engine.post_pruner import PostPruner
+from engine.utils import initialize_config, setup_logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logging.basicConfig()
+
+
+def progress_logger(every):
+    """Progress callback logging the running totals every `every` batches."""
+    start_time = time.time()
+
+    def progress(batch, counts, totals):
+        if batch % every:
+            return
+        elapsed = time.time() - start_time
+        logger.info(
+            "Batch %d after %.1f s: %s",
+            batch,
+            elapsed,
+            ", ".join(f"{table} {count}" for table, count in totals.items() if count),
+        )
+
+    return progress
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Delete old posts with their votes, metadata, body patches and reblogs in small batches."
+    )
+    parser.add_argument(
+        "--days", type=int, help="Delete the posts created more than DAYS ago"
+    )
+    parser.add_argument("--token", help="Only delete posts of this token")
+    parser.add_argument(
+        "--orphans",
+        action="store_true",
+        help="Delete votes, metadata, body patches and reblogs no post is left for",
+    )
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument(
+        "--pause",
+        type=float,
+        default=0.5,
+        help="Seconds to sleep between batches, to leave room for the streamers",
+    )
+    parser.add_argument("--max-batches", type=int, help="Stop after this many batches")
+    parser.add_argument(
+        "--progress-every",
+        type=int,
+        default=10,
+        help="Log the totals every N batches",
+    )
+    parser.add_argument(
+        "--database", help="Database connector, instead of the one of config.json"
+    )
+    args = parser.parse_args()
+    if args.days is None and not args.orphans:
+        parser.error("give --days and/or --orphans")
+
+    setup_logging("logger.json")
+
+    databaseConnector = args.database
+    if databaseConnector is None:
+        config_file = "config.json"
+        config_data = initialize_config(config_file)
+        databaseConnector = config_data["databaseConnector"]
+
+    db = dataset.connect(databaseConnector, ensure_schema=False)
+    pruner = PostPruner(
+        db,
+        batch_size=args.batch_size,
+        pause=args.pause,
+        progress=progress_logger(args.progress_every),
+    )
+    start_time = time.time()
+    if args.days is not None:
+        cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(
+            days=args.days
+        )
+        pruner.prune(cutoff, token=args.token, max_batches=args.max_batches)
+    if args.orphans:
+        pruner.sweep_orphans(max_batches=args.max_batches)
+    logger.info(
+        "Deleted in %.1f s: %s",
+        time.time() - start_time,
+        ", ".join(f"{table} {count}" for table, count in pruner.totals.items()),
+    )
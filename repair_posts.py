@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse
+import logging
+import threading
+import time
+import traceback
+from datetime import datetime, timezone
+
+import dataset
+from nectar import Hive
+from nectar.comment import Comment
+from nectar.exceptions import ContentDoesNotExistsException
+
+from engine.post_body_storage import PostBodyStorage
+from engine.post_metadata_storage import PostMetadataStorage
+from engine.post_repair_storage import PostRepairQueue
+from engine.utils import initialize_config, setup_logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logging.basicConfig()
+
+
+def repair_post(db, comment):
+    """Store the body fetched from a node as the new base body of a post.
+
+    Returns the time the stored body was last updated at.
+    """
+    authorperm = f"@{comment['author']}/{comment['permlink']}"
+    postMetadataStorage = PostMetadataStorage(db)
+    old_post_metadata = postMetadataStorage.get(authorperm)
+    if old_post_metadata is None:
+        # the post was dropped from the index meanwhile
+        return None
+    synced_at = (
+        comment.get("last_update")
+        or comment.get("updated")
+        or datetime.now(timezone.utc)
+    )
+    postMetadataStorage.upsert(
+        {
+            "authorperm": authorperm,
+            "body": comment["body"],
+            "patch_count": 0,
+            "body_synced_at": synced_at,
+        }
+    )
+    if old_post_metadata["patch_count"]:
+        PostBodyStorage(db).delete_patches(authorperm)
+    db.query(
+        'UPDATE posts SET "desc" = :desc WHERE authorperm = :authorperm',
+        desc=comment["body"][:300],
+        authorperm=authorperm,
+    )
+    return synced_at
+
+
+def in_transaction(db, action, *args):
+    """Run action in its own short transaction."""
+    db.begin()
+    try:
+        result = action(*args)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return result
+
+
+def store(db, postRepairQueue, job, comment):
+    synced_at = repair_post(db, comment)
+    if postRepairQueue.complete(job["authorperm"], synced_at):
+        return True
+    # an edit newer than the fetched body was queued, fetch the post again
+    postRepairQueue.retry(
+        job, f"node served the body of {synced_at}, older than a queued edit"
+    )
+    return False
+
+
+def work(db, hived, postRepairQueue, stop, idle_sleep, lease):
+    """Claim and repair due jobs until stop is set.
+
+    A job is leased in one transaction and finished in another; no lock is
+    held while its post is fetched, so the streamer can queue newer edits of
+    it meanwhile.
+    """
+    while not stop.is_set():
+        try:
+            job = in_transaction(db, postRepairQueue.claim, lease)
+            if job is None:
+                if stop.wait(idle_sleep):
+                    break
+                continue
+            authorperm = job["authorperm"]
+            try:
+                comment = Comment(authorperm, blockchain_instance=hived)
+            except ContentDoesNotExistsException:
+                logger.info("%s no longer exists, dropping it", authorperm)
+                in_transaction(db, postRepairQueue.complete, authorperm)
+            except Exception as e:
+                logger.warning(
+                    "Could not fetch %s (attempt %d): %s",
+                    authorperm,
+                    job["attempts"] + 1,
+                    e,
+                )
+                in_transaction(db, postRepairQueue.retry, job, e)
+            else:
+                if in_transaction(db, store, db, postRepairQueue, job, comment):
+                    logger.debug("Repaired %s", authorperm)
+                else:
+                    logger.info(
+                        "%s was edited meanwhile, fetching it again", authorperm
+                    )
+        except Exception:
+            traceback.print_exc()
+            stop.wait(idle_sleep)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Fetch the bodies of posts queued by the Hive streamer."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="Posts fetched concurrently (default: 4)",
+    )
+    parser.add_argument(
+        "--idle-sleep",
+        type=float,
+        default=5,
+        help="Seconds to wait when no job is due",
+    )
+    parser.add_argument(
+        "--lease",
+        type=int,
+        default=600,
+        help="Seconds a claimed job is hidden from other workers (default: 600)",
+    )
+    parser.add_argument(
+        "--once",
+        action="store_true",
+        help="Exit once no job is due instead of waiting for new ones",
+    )
+    args = parser.parse_args()
+
+    setup_logging("logger.json")
+
+    config_file = "config.json"
+    config_data = initialize_config(config_file)
+
+    # connections are per thread, the pool has to fit all workers
+    db = dataset.connect(
+        config_data["databaseConnector"],
+        ensure_schema=False,
+        engine_kwargs={"pool_size": args.workers},
+    )
+    postRepairQueue = PostRepairQueue(db)
+
+    node_list = ["https://api.syncad.com", "https://api.hive.blog"]
+
+    stop = threading.Event()
+    threads = [
+        threading.Thread(
+            target=work,
+            args=(
+                db,
+                # one node connection per worker
+                Hive(node=node_list, num_retries=5, call_num_retries=3, timeout=15),
+                postRepairQueue,
+                stop,
+                args.idle_sleep,
+                args.lease,
+            ),
+            daemon=True,
+        )
+        for _ in range(args.workers)
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        while any(thread.is_alive() for thread in threads):
+            if args.once and postRepairQueue.count(due=True) == 0:
+                stop.set()
+            time.sleep(args.idle_sleep)
+    except KeyboardInterrupt:
+        logger.info("Exiting...")
+        stop.set()
+    for thread in threads:
+        thread.join()
@@ -0,0 +1,2 @@
+#!/bin/bash
+python3 -u stream_indexer.py
\ No newline at end of file
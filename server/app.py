@@ -1,6 +1,7 @@
 #!/usr/bin/python3.8
 # -*- coding: utf-8 -*-
 import json
+import os
 from datetime import datetime, timezone
 from decimal import Decimal
 
@@ -11,39 +12,37 @@ from flask import (
     jsonify,
     request,
 )
-from flask_caching import Cache
 from flask_compress import Compress
 from flask_cors import CORS
 from nectar import Hive
 from nectar.account import Account
-from nectar.comment import Comment
 from nectar.utils import (
     construct_authorperm,
     formatTimeString,
     resolve_authorperm,
 )
 from nectarengine.api import Api
-from nectarengine.tokenobject import Token
 
 from engine.account_history_storage import AccountHistoryTrx
 from engine.account_storage import AccountsDB
 from engine.config_storage import ConfigurationDB
 from engine.follow_storage import FollowsDB
-from engine.post_metadata_storage import PostMetadataStorage
+from engine.post_body_storage import PostBodyStorage
 from engine.post_storage import PostsTrx
 from engine.reblog_storage import ReblogsDB
+from engine.response_cache import ResponseCache
+from engine.thread_hydrator import ThreadHydrator
 from engine.token_config_storage import TokenConfigDB
+from engine.token_holder_storage import TokenHoldersDB
+from engine.token_metadata import TokenMetadataService
 from engine.vote_storage import VotesTrx
 
-config_file = "config.json"
+config_file = os.environ.get("ENGINE_CONFIG_FILE", "config.json")
 with open(config_file) as json_data_file:
     config_data = json.load(json_data_file)
 
 app = Flask(__name__)
 app.config["SEND_FILE_MAX_AGE_DEFAULT"] = 1
-app.config["CACHE_TYPE"] = "filesystem"
-app.config["CACHE_DIR"] = config_data["apiCacheDir"]
-app.config["CACHE_DEFAULT_TIMEOUT"] = 300
 app.config.from_object(__name__)
 
 app.wsgi_app = sqltap.wsgi.SQLTapMiddleware(app.wsgi_app)
@@ -51,11 +50,27 @@ app.wsgi_app = sqltap.wsgi.SQLTapMiddleware(app.wsgi_app)
 CORS(app, supports_credentials=True)
 Compress(app)
 
-cache = Cache(app)
-
 databaseConnector = config_data["databaseConnector"]
 
+
+def engine_block_height():
+    db = dataset.connect(databaseConnector, ensure_schema=False)
+    try:
+        engine_conf = ConfigurationDB(db).get_engine()
+        return engine_conf["last_engine_streamed_block"] if engine_conf else None
+    finally:
+        db.executable.close()
+        db = None
+
+
+cache = ResponseCache(
+    config_data["apiCacheDir"], default_timeout=300, height_fn=engine_block_height
+)
+
 engine_api = Api(url=config_data["engine_api"])
+token_metadata_service = TokenMetadataService(
+    engine_api, databaseConnector, token_cache_file=config_data.get("token_cache_file")
+)
 
 node_list = ["https://api.deathwing.me", "https://api.hive.blog"]
 hived = Hive(
@@ -66,6 +81,9 @@ hived = Hive(
     nobroadcast=True,
     bundle=True,
 )
+thread_hydrator = ThreadHydrator(
+    hived, max_workers=config_data.get("thread_workers", 8)
+)
 
 
 @app.route("/")
@@ -122,8 +140,8 @@ def state():
         db = None
 
 
-@cache.cached(timeout=60, query_string=True)
 @app.route("/info", methods=["GET"])
+@cache.cached(timeout=60, stale=600)
 def token():
     """
     Fetch reward pool info for token
@@ -133,70 +151,27 @@ def token():
         token = token.upper()
 
     db = dataset.connect(databaseConnector, ensure_schema=False)
-    tokenConfigStorage = TokenConfigDB(db)
     try:
+        token_metadata_service.refresh(db)
         if token:
-            token_config = tokenConfigStorage.get(token)
             # Always provide a predictable shape for the frontend
             token_data_object = {
                 "pending_rshares": Decimal(0),
                 "reward_pool": Decimal(0),
             }
-
-            # fetch from contract if we have token config
-            if token_config and "reward_pool_id" in token_config:
-                reward_pool_id = token_config["reward_pool_id"]
-                reward_pool = engine_api.find_one(
-                    "comments", "rewardPools", {"_id": int(reward_pool_id)}
-                )
-                if isinstance(reward_pool, list) and len(reward_pool) > 0:
-                    reward_pool = reward_pool[0]
-                if isinstance(reward_pool, dict):
-                    token_data_object["pending_rshares"] = Decimal(
-                        reward_pool["pendingClaims"]
-                    )
-                    token_data_object["reward_pool"] = Decimal(
-                        reward_pool["rewardPool"]
-                    )
-
-            tokenApi = Token(symbol=token, api=engine_api)
-            if tokenApi:
-                token_data_object["precision"] = tokenApi["precision"]
-                token_data_object["issuer"] = tokenApi["issuer"]
-            else:
-                # Fallback precision used when token metadata cannot be fetched
-                token_data_object.setdefault("precision", 0)
+            token_data_object.update(token_metadata_service.token_info(token))
+            # Fallback precision used when token metadata cannot be fetched
+            token_data_object.setdefault("precision", 0)
             return jsonify(token_data_object)
         else:
-            token_config = tokenConfigStorage.get_all()
-            token_data = {}
-            for token in token_config:
-                reward_pool_id = token_config[token]["reward_pool_id"]
-                reward_pool = engine_api.find_one(
-                    "comments", "rewardPools", {"_id": int(reward_pool_id)}
-                )
-                token_data_object = {"token": token}
-                if isinstance(reward_pool, list) and len(reward_pool) > 0:
-                    reward_pool = reward_pool[0]
-                if isinstance(reward_pool, dict):
-                    token_data_object["pending_rshares"] = Decimal(
-                        reward_pool["pendingClaims"]
-                    )
-                    token_data_object["reward_pool"] = Decimal(
-                        reward_pool["rewardPool"]
-                    )
-                tokenApi = Token(symbol=token, api=engine_api)
-                if tokenApi:
-                    token_data_object["precision"] = tokenApi["precision"]
-                    token_data_object["issuer"] = tokenApi["issuer"]
-                token_data[token] = token_data_object
-            return jsonify(token_data)
+            return jsonify(token_metadata_service.all_token_info())
     finally:
         db.executable.close()
         db = None
 
 
 @app.route("/config", methods=["GET"])
+@cache.cached(timeout=300, stale=3600)
 def config():
     """
     Fetch token config
@@ -222,10 +197,19 @@ def config():
         db = None
 
 
+def parse_history_cursor(cursor):
+    """Parse a "<timestamp>_<id>" account history cursor."""
+    timestamp, _, hist_id = cursor.rpartition("_")
+    return datetime.fromisoformat(timestamp), int(hist_id)
+
+
 @app.route("/get_account_history", methods=["GET"])
 def get_account_history():
     """
     get_account_history
+
+    Pass the ``cursor`` of the last entry to fetch the next page. ``type``
+    accepts a comma separated list, ``start_time``/``end_time`` an ISO time range.
     """
     account = request.args.get("account", None)
     if account is None:
@@ -237,31 +221,35 @@ def get_account_history():
     limit = request.args.get("limit", 100)
     offset = request.args.get("offset", 0)
     hist_type = request.args.get("type", None)
+    author = request.args.get("author", None)
+    start_time = request.args.get("start_time", None)
+    end_time = request.args.get("end_time", None)
+    cursor = request.args.get("cursor", None)
 
     try:
         limit = int(limit)
-    except Exception:
-        return jsonify([])
-    try:
         offset = int(offset)
+        start_time = datetime.fromisoformat(start_time) if start_time else None
+        end_time = datetime.fromisoformat(end_time) if end_time else None
+        cursor = parse_history_cursor(cursor) if cursor else None
     except Exception:
         return jsonify([])
+    types = [t for t in hist_type.split(",") if t] if hist_type else None
 
     db = dataset.connect(databaseConnector, ensure_schema=False)
     try:
         accountHistoryTrx = AccountHistoryTrx(db)
-        if hist_type is None and token is None:
-            history = accountHistoryTrx.get_history(account, limit, offset)
-        elif hist_type is None and token is not None:
-            history = accountHistoryTrx.get_token_history(token, account, limit, offset)
-        elif hist_type is not None and token is None:
-            history = accountHistoryTrx.get_history(
-                account, limit, offset, hist_type=hist_type
-            )
-        elif hist_type is not None and token is not None:
-            history = accountHistoryTrx.get_token_history(
-                token, account, limit, offset, hist_type=hist_type
-            )
+        history = accountHistoryTrx.find_history(
+            account,
+            token=token,
+            types=types,
+            author=author,
+            start_time=start_time,
+            end_time=end_time,
+            cursor=cursor,
+            limit=limit,
+            offset=offset,
+        )
 
         ret = []
         for h in history:
@@ -277,6 +265,7 @@ def get_account_history():
             h2["token"] = h["token"]
             h2["quantity"] = h["quantity"]
             h2["trx"] = h["trx"]
+            h2["cursor"] = f"{h['timestamp'].isoformat()}_{h['id']}"
             ret.append(h2)
         return jsonify(ret)
     finally:
@@ -354,27 +343,54 @@ def authorperm(account, permlink):
 
 
 @app.route("/get_staked_accounts", methods=["GET"])
-@cache.cached(timeout=86400, query_string=True)
+@cache.cached(timeout=300)
 def get_staked_accounts():
     """
-    Get Staked Accounts via engine API
+    Get staked accounts from the local holder snapshot
     """
     token = request.args.get("token", None)
     if token:
         token = token.upper()
-    tokenApi = Token(symbol=token, api=engine_api)
-    res = []
-    offset = 0
-    while True:
-        holders = tokenApi.get_holder(1000, offset)
-        for holder in holders:
-            res.append(
-                {"name": holder["account"], "staked_tokens": Decimal(holder["stake"])}
+    limit = request.args.get("limit", 1000)
+    # For pagination, optional
+    start = request.args.get("start", None)
+    min_stake = request.args.get("min_stake", None)
+
+    try:
+        limit = min(int(limit), 10000)
+        min_stake = Decimal(min_stake) if min_stake is not None else None
+    except Exception:
+        return jsonify([])
+    if token is None:
+        return jsonify([])
+
+    db = dataset.connect(databaseConnector, ensure_schema=False)
+    try:
+        tokenHoldersDb = TokenHoldersDB(db)
+        res = [
+            {"name": holder["account"], "staked_tokens": Decimal(holder["stake"])}
+            for holder in tokenHoldersDb.get_staked(
+                token, start=start, limit=limit, min_stake=min_stake
             )
-        offset = offset + 1000
-        if len(holders) < 1000:
-            break
-    return jsonify(res)
+        ]
+        return jsonify(res)
+    finally:
+        db.executable.close()
+        db = None
+
+
+def compact_json_metadata(post):
+    """
+    Rebuild the json_metadata fields listings use from the posts columns.
+    """
+    json_metadata = {"tags": post["tags"].split(",") if post["tags"] else []}
+    if post.get("image"):
+        json_metadata["image"] = [post["image"]]
+    if post.get("app"):
+        json_metadata["app"] = post["app"]
+    if post.get("format"):
+        json_metadata["format"] = post["format"]
+    return json.dumps(json_metadata)
 
 
 def format_feed_data(
@@ -434,6 +450,11 @@ def format_feed_data(
         elif "reblogged_by" in post:
             del post["reblogged_by"]
 
+        if "json_metadata" not in post:
+            post["json_metadata"] = compact_json_metadata(post)
+        post.pop("image", None)
+        post.pop("format", None)
+
         post["author"] = author
         post["authorperm"] = construct_authorperm(author, post["permlink"])
         post["hive"] = True
@@ -447,53 +468,6 @@ def format_feed_data(
     return jsonify(output_posts)
 
 
-def fetch_and_save(c, token, postTrx, postMetadataStorage):
-    """
-    Fetch from hived and save post metadata.
-    """
-    authorperm = f"@{c.author}/{c.permlink}"
-    token_post = postTrx.get_token_post(token, authorperm)
-    if not token_post:
-        # see from comment processor and match behavior for orphaned data that is not in comments contract
-        return []
-    replies = c.get_replies()
-    results = []
-    json_metadata = c.json_metadata
-    root_post = c.get_parent()
-    this_result = {
-        "authorperm": authorperm,
-        "body": c.body,
-        "json_metadata": json.dumps(json_metadata) if json_metadata else None,
-        "tags": ",".join(json_metadata["tags"]) if json_metadata and "tags" in json_metadata else None,
-        "parent_authorperm": f"@{c.parent_author}/{c.parent_permlink}"
-        if c.parent_author
-        else None,
-        "children": len(replies),
-        "url": f"/{root_post.category}/{root_post.authorperm}",
-        "depth": c.depth,
-        "main_post": c.parent_permlink == "" or c.parent_author == "",
-    }
-    # print(f"postMetadataStorage.upsert({this_result})")
-    postMetadataStorage.upsert(this_result)
-    # print(postMetadataStorage.get(this_result["authorperm"]))
-    # print(token_post)
-
-    # In the case where metadata never updated the original post data, fix the post
-    if (not token_post["main_post"] and this_result["main_post"]) or (token_post["main_post"] and token_post["parent_permlink"] is None) or (token_post["main_post"] and token_post["desc"] is None):
-        token_post["main_post"] = True
-        token_post["tags"] = this_result["tags"]
-        token_post["parent_author"] = c.parent_author
-        token_post["parent_permlink"] = c.category
-        token_post["desc"] = c.body[:300]
-        postTrx.upsert(token_post)
-    this_result.update(token_post)
-    results.append(this_result)
-    for reply in replies:
-        reply_result = fetch_and_save(reply, token, postTrx, postMetadataStorage)
-        results.extend(reply_result)
-    return results
-
-
 @app.route("/get_thread", methods=["GET"])
 def get_thread():
     """
@@ -505,6 +479,8 @@ def get_thread():
     author = request.args.get("author", None)
     permlink = request.args.get("permlink", None)
     refresh = request.args.get("refresh", False)
+    # bodies can be loaded per post from /get_post_bodies
+    with_body = not request.args.get("no_body", False)
 
     if token is None:
         return jsonify([])
@@ -516,21 +492,43 @@ def get_thread():
     db = dataset.connect(databaseConnector, ensure_schema=False)
     try:
         postTrx = PostsTrx(db)
-        postMetadataStorage = PostMetadataStorage(db)
-        posts = list(postTrx.get_thread_discussions(token, author, permlink))
         if (
             refresh
             #or (len(posts) == 0)
             #or ("url" not in posts[0] or posts[0]["url"] is None)
         ):
-            c = Comment(f"{author}/{permlink}", blockchain_instance=hived)
-            posts = fetch_and_save(c, token, postTrx, postMetadataStorage)
+            posts = thread_hydrator.hydrate(db, token, author, permlink)
+            if not with_body:
+                for post in posts:
+                    del post["body"]
+        else:
+            posts = postTrx.get_thread_discussions(
+                token, author, permlink, with_body=with_body
+            )
         return format_feed_data(db, token, posts, None, None, 1000, True)
     finally:
         db.executable.close()
         db = None
 
 
+@app.route("/get_post_bodies", methods=["GET"])
+def get_post_bodies():
+    """
+    Fetch the bodies of a comma separated list of authorperms
+    """
+    authorperms = request.args.get("authorperms", None)
+    if not authorperms:
+        return jsonify({})
+    authorperms = [a for a in authorperms.split(",") if a][:100]
+
+    db = dataset.connect(databaseConnector, ensure_schema=False)
+    try:
+        return jsonify(PostBodyStorage(db).get_bodies(authorperms))
+    finally:
+        db.executable.close()
+        db = None
+
+
 @app.route("/get_feed", methods=["GET"])
 def get_feed():
     """
@@ -546,6 +544,7 @@ def get_feed():
     include_reblogs = request.args.get("include_reblogs", True)
     fetch_votes = not request.args.get("no_votes", False)
     fetch_votes = request.args.get("voter", fetch_votes)
+    full_metadata = request.args.get("full_metadata", "") in ("1", "true")
 
     try:
         limit = int(limit)
@@ -587,6 +586,7 @@ def get_feed():
             [account],
             last_timestamp=last_timestamp,
             include_reblogs=include_reblogs,
+            full_metadata=full_metadata,
         )
         return format_feed_data(
             db, token, created_posts, start_author, start_permlink, limit, fetch_votes
@@ -607,6 +607,7 @@ def get_discussions_by_created():
     start_permlink = request.args.get("start_permlink", None)
     fetch_votes = not request.args.get("no_votes", False)
     fetch_votes = request.args.get("voter", fetch_votes)
+    full_metadata = request.args.get("full_metadata", "") in ("1", "true")
     try:
         limit = int(limit)
     except Exception:
@@ -629,7 +630,11 @@ def get_discussions_by_created():
                 last_timestamp = ensure_timezone_aware(post["created"])
 
         created_posts = postTrx.get_discussions_by_created(
-            token, tag=tag, limit=limit, last_timestamp=last_timestamp
+            token,
+            tag=tag,
+            limit=limit,
+            last_timestamp=last_timestamp,
+            full_metadata=full_metadata,
         )
         return format_feed_data(
             db, token, created_posts, start_author, start_permlink, limit, fetch_votes
@@ -649,6 +654,7 @@ def get_discussions_by_score(request, score_key, main_post=True):
     start_permlink = request.args.get("start_permlink", None)
     fetch_votes = not request.args.get("no_votes", False)
     fetch_votes = request.args.get("voter", fetch_votes)
+    full_metadata = request.args.get("full_metadata", "") in ("1", "true")
     try:
         limit = int(limit)
     except Exception:
@@ -675,6 +681,7 @@ def get_discussions_by_score(request, score_key, main_post=True):
             limit=limit,
             last_authorperm=last_authorperm,
             main_post=main_post,
+            full_metadata=full_metadata,
         )
         return format_feed_data(
             db, token, created_posts, start_author, start_permlink, limit, fetch_votes
@@ -685,26 +692,31 @@ def get_discussions_by_score(request, score_key, main_post=True):
 
 
 @app.route("/get_discussions_by_trending", methods=["GET"])
+@cache.cached(timeout=30, stale=120, max_blocks=10)
 def get_discussions_by_trending():
     return get_discussions_by_score(request, "score_trend")
 
 
 @app.route("/get_discussions_by_promoted", methods=["GET"])
+@cache.cached(timeout=30, stale=120, max_blocks=10)
 def get_discussions_by_promoted():
     return get_discussions_by_score(request, "promoted")
 
 
 @app.route("/get_discussions_by_hot", methods=["GET"])
+@cache.cached(timeout=30, stale=120, max_blocks=10)
 def get_discussions_by_hot():
     return get_discussions_by_score(request, "score_hot")
 
 
 @app.route("/get_discussions_by_payout", methods=["GET"])
+@cache.cached(timeout=30, stale=120, max_blocks=10)
 def get_discussions_by_payout():
     return get_discussions_by_score(request, "vote_rshares")
 
 
 @app.route("/get_comment_discussions_by_payout", methods=["GET"])
+@cache.cached(timeout=30, stale=120, max_blocks=10)
 def get_comment_discussions_by_payout():
     return get_discussions_by_score(request, "vote_rshares", main_post=False)
 
@@ -724,6 +736,7 @@ def get_discussions_by_blog():
     start_permlink = request.args.get("start_permlink", None)
     fetch_votes = not request.args.get("no_votes", False)
     fetch_votes = request.args.get("voter", fetch_votes)
+    full_metadata = request.args.get("full_metadata", "") in ("1", "true")
 
     try:
         limit = int(limit)
@@ -762,6 +775,7 @@ def get_discussions_by_blog():
             [account],
             include_reblogs=include_reblogs,
             last_timestamp=last_timestamp,
+            full_metadata=full_metadata,
         )
         return format_feed_data(
             db, token, created_posts, start_author, start_permlink, limit, fetch_votes
@@ -785,6 +799,7 @@ def get_discussions_by_comments():
     start_permlink = request.args.get("start_permlink", None)
     fetch_votes = not request.args.get("no_votes", False)
     fetch_votes = request.args.get("voter", fetch_votes)
+    full_metadata = request.args.get("full_metadata", "") in ("1", "true")
 
     try:
         limit = int(limit)
@@ -811,7 +826,7 @@ def get_discussions_by_comments():
                 last_timestamp = ensure_timezone_aware(post["created"])
 
         comment_posts = postTrx.get_discussions_by_comments(
-            token, [account], last_timestamp=last_timestamp
+            token, [account], last_timestamp=last_timestamp, full_metadata=full_metadata
         )
         return format_feed_data(
             db, token, comment_posts, start_author, start_permlink, limit, fetch_votes
@@ -835,6 +850,7 @@ def get_discussions_by_replies():
     start_permlink = request.args.get("start_permlink", None)
     fetch_votes = not request.args.get("no_votes", False)
     fetch_votes = request.args.get("voter", fetch_votes)
+    full_metadata = request.args.get("full_metadata", "") in ("1", "true")
 
     try:
         limit = int(limit)
@@ -861,7 +877,7 @@ def get_discussions_by_replies():
                 last_timestamp = ensure_timezone_aware(post["created"])
 
         reply_posts = postTrx.get_discussions_by_replies(
-            token, [account], last_timestamp=last_timestamp
+            token, [account], last_timestamp=last_timestamp, full_metadata=full_metadata
         )
         return format_feed_data(
             db, token, reply_posts, start_author, start_permlink, limit, fetch_votes
@@ -872,7 +888,7 @@ def get_discussions_by_replies():
 
 
 @app.route("/get_trending_tags", methods=["GET"])
-@cache.cached(timeout=86400, query_string=True)
+@cache.cached(timeout=86400, stale=86400)
 def get_trending_tags():
     """
     Get trending tags.
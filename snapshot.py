@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse
+import logging
+import time
+
+from engine.snapshot import SnapshotExporter, SnapshotImporter, read_manifest
+from engine.utils import initialize_config, setup_logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logging.basicConfig()
+
+
+def print_manifest(manifest):
+    checkpoint = manifest["checkpoint"]
+    print(f"created    {manifest['created']}")
+    print(f"migrations {', '.join(str(v) for v in manifest['migrations'])}")
+    print(
+        f"hive       block {checkpoint['last_streamed_block']} ({checkpoint['last_streamed_timestamp']})"
+    )
+    print(
+        f"engine     block {checkpoint['last_engine_streamed_block']} ({checkpoint['last_engine_streamed_timestamp']})"
+    )
+    for table, info in manifest["tables"].items():
+        print(f"{table:20} {info['rows']:>12} rows {info['bytes']:>14} bytes")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export the engine tables of a node to a snapshot directory, or bootstrap a node from one."
+    )
+    parser.add_argument("command", choices=["export", "import", "info"])
+    parser.add_argument("directory", help="Snapshot directory")
+    parser.add_argument(
+        "--jobs", type=int, default=4, help="Tables copied or indexed in parallel"
+    )
+    parser.add_argument(
+        "--compress-level", type=int, default=6, help="gzip level of the export"
+    )
+    parser.add_argument(
+        "--truncate",
+        action="store_true",
+        help="Replace the rows of tables that are not empty on import",
+    )
+    parser.add_argument(
+        "--maintenance-work-mem",
+        help="maintenance_work_mem for the index builds of an import, e.g. 1GB",
+    )
+    parser.add_argument(
+        "--database", help="Database connector, instead of the one of config.json"
+    )
+    args = parser.parse_args()
+
+    if args.command == "info":
+        print_manifest(read_manifest(args.directory))
+        raise SystemExit(0)
+
+    setup_logging("logger.json")
+
+    databaseConnector = args.database
+    if databaseConnector is None:
+        config_file = "config.json"
+        config_data = initialize_config(config_file)
+        databaseConnector = config_data["databaseConnector"]
+
+    start_time = time.time()
+    if args.command == "export":
+        manifest = SnapshotExporter(
+            databaseConnector, jobs=args.jobs, compresslevel=args.compress_level
+        ).export(args.directory)
+        logger.info(
+            "Exported %d rows to %s in %.1f s",
+            sum(info["rows"] for info in manifest["tables"].values()),
+            args.directory,
+            time.time() - start_time,
+        )
+    else:
+        manifest = SnapshotImporter(
+            databaseConnector,
+            jobs=args.jobs,
+            maintenance_work_mem=args.maintenance_work_mem,
+        ).restore(args.directory, truncate=args.truncate)
+        checkpoint = manifest["checkpoint"]
+        logger.info(
+            "Imported %d rows in %.1f s; the streamers continue after Hive block %s and engine block %s",
+            sum(info["rows"] for info in manifest["tables"].values()),
+            time.time() - start_time,
+            checkpoint["last_streamed_block"],
+            checkpoint["last_engine_streamed_block"],
+        )
@@ -1,7 +1,55 @@
 -- Adminer 4.8.0 PostgreSQL 10.15 (Ubuntu 10.15-0ubuntu0.18.04.1) dump
 
+-- posts, votes and account_history are partitioned by month, see
+-- sql/migrations/0003_partition_by_month.sql; partitions.py creates the
+-- monthly partitions, rows of months without one go to <table>_default
+CREATE OR REPLACE FUNCTION engine_create_month_partition(parent text, key text, month date) RETURNS text AS $$
+DECLARE
+    lower_bound date := date_trunc('month', month)::date;
+    upper_bound date := (date_trunc('month', month) + interval '1 month')::date;
+    name text := format('%s_y%sm%s', parent, to_char(lower_bound, 'YYYY'), to_char(lower_bound, 'MM'));
+BEGIN
+    IF to_regclass(name) IS NOT NULL THEN
+        RETURN name;
+    END IF;
+    EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', name, parent);
+    IF to_regclass(parent || '_default') IS NOT NULL THEN
+        EXECUTE format(
+            'WITH moved AS (DELETE FROM %I WHERE %I >= %L AND %I < %L RETURNING *) INSERT INTO %I SELECT * FROM moved',
+            parent || '_default', key, lower_bound, key, upper_bound, name
+        );
+    END IF;
+    EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)', parent, name, lower_bound, upper_bound);
+    RETURN name;
+END;
+$$ LANGUAGE plpgsql;
+
+-- gives replies indexed before their parent had a sort_path theirs, see
+-- sql/migrations/0004_fill_thread_paths.sql
+CREATE OR REPLACE FUNCTION engine_fill_thread_paths(starts varchar[]) RETURNS integer AS $$
+DECLARE
+    filled integer;
+BEGIN
+    WITH RECURSIVE thread AS (
+        SELECT pm.authorperm, pm.root_authorperm, pm.sort_path, 0 depth
+        FROM post_metadata pm WHERE pm.authorperm = ANY(starts) AND pm.sort_path IS NOT NULL
+        UNION ALL
+        SELECT pm.authorperm, t.root_authorperm,
+            t.sort_path || '.' || lpad(floor(extract(epoch FROM COALESCE((SELECT min(p.created) FROM posts p WHERE p.authorperm = pm.authorperm), 'epoch')))::bigint::text, 10, '0') || left(md5(pm.authorperm), 8),
+            t.depth + 1
+        FROM post_metadata pm INNER JOIN thread t ON pm.parent_authorperm = t.authorperm
+        WHERE pm.sort_path IS NULL AND t.depth < 255
+    )
+    UPDATE post_metadata pm SET root_authorperm = thread.root_authorperm, sort_path = thread.sort_path
+    FROM thread WHERE pm.authorperm = thread.authorperm AND pm.sort_path IS NULL;
+    GET DIAGNOSTICS filled = ROW_COUNT;
+    RETURN filled;
+END;
+$$ LANGUAGE plpgsql;
+
 DROP TABLE IF EXISTS "account_history";
 CREATE TABLE "public"."account_history" (
+    "id" bigserial NOT NULL,
     "account" character varying(20) NOT NULL,
     "token" character varying(20) NOT NULL,
     "timestamp" timestamp NOT NULL,
@@ -9,10 +57,14 @@ CREATE TABLE "public"."account_history" (
     "trx" character varying(50),
     "type" character varying(30) NOT NULL,
     "authorperm" character varying(300)
-) WITH (oids = false);
+) PARTITION BY RANGE ("timestamp");
+
+CREATE TABLE "public"."account_history_default" PARTITION OF "public"."account_history" DEFAULT;
 
 CREATE INDEX "account_history_account_token_timestamp" ON "public"."account_history" USING btree ("account", "token", "timestamp" DESC);
 
+CREATE INDEX "account_history_account_timestamp" ON "public"."account_history" USING btree ("account", "timestamp" DESC);
+
 CREATE INDEX "account_history_token_timestamp" ON "public"."account_history" USING btree ("token", "timestamp" DESC);
 
 
@@ -68,10 +120,39 @@ CREATE TABLE "public"."post_metadata" (
     "parent_authorperm" character varying(300),
     "url" character varying(350),
     "depth" smallint,
+    "patch_count" integer DEFAULT '0' NOT NULL,
+    "body_synced_at" timestamp,
+    "root_authorperm" character varying(300),
+    "sort_path" text COLLATE "C",
     CONSTRAINT "post_metadata_authorperm" PRIMARY KEY ("authorperm")
 ) WITH (oids = false);
 
 CREATE INDEX "post_metadata_parent_authorperm" ON "public"."post_metadata" USING btree ("parent_authorperm");
+CREATE INDEX "post_metadata_patch_count" ON "public"."post_metadata" USING btree ("patch_count") WHERE "patch_count" > 0;
+CREATE INDEX "post_metadata_root_authorperm_sort_path" ON "public"."post_metadata" USING btree ("root_authorperm", "sort_path");
+
+
+DROP TABLE IF EXISTS "post_body_patches";
+CREATE TABLE "public"."post_body_patches" (
+    "authorperm" character varying(300) NOT NULL,
+    "seq" integer NOT NULL,
+    "patch" text NOT NULL,
+    "timestamp" timestamp NOT NULL,
+    CONSTRAINT "post_body_patches_authorperm_seq" PRIMARY KEY ("authorperm", "seq")
+) WITH (oids = false);
+
+
+DROP TABLE IF EXISTS "post_repair_queue";
+CREATE TABLE "public"."post_repair_queue" (
+    "authorperm" character varying(300) NOT NULL,
+    "queued_at" timestamp NOT NULL,
+    "attempts" integer DEFAULT '0' NOT NULL,
+    "next_attempt_at" timestamp NOT NULL,
+    "last_error" text,
+    CONSTRAINT "post_repair_queue_authorperm" PRIMARY KEY ("authorperm")
+) WITH (oids = false);
+
+CREATE INDEX "post_repair_queue_next_attempt_at" ON "public"."post_repair_queue" USING btree ("next_attempt_at");
 
 
 DROP TABLE IF EXISTS "posts";
@@ -81,6 +162,8 @@ CREATE TABLE "public"."posts" (
     "created" timestamp NOT NULL,
     "tags" character varying(256),
     "app" character varying(256),
+    "image" character varying(512),
+    "format" character varying(20),
     "main_post" boolean DEFAULT true NOT NULL,
     "decline_payout" boolean DEFAULT false NOT NULL,
     "token" character varying(30) NOT NULL,
@@ -91,7 +174,7 @@ CREATE TABLE "public"."posts" (
     "curator_payout_value" numeric DEFAULT '0' NOT NULL,
     "score_trend" real DEFAULT '0' NOT NULL,
     "score_hot" real DEFAULT '0' NOT NULL,
-    "beneficiaries_payout_value" bigint DEFAULT '0' NOT NULL,
+    "beneficiaries_payout_value" numeric DEFAULT '0' NOT NULL,
     "promoted" numeric DEFAULT '0' NOT NULL,
     "title" character varying(512),
     "desc" character varying(512),
@@ -100,20 +183,26 @@ CREATE TABLE "public"."posts" (
     "parent_permlink" character varying(256),
     "score_promoted" real DEFAULT '0' NOT NULL,
     "muted" boolean DEFAULT false NOT NULL,
-    CONSTRAINT "posts_authorperm_token" PRIMARY KEY ("authorperm", "token")
-) WITH (oids = false);
+    CONSTRAINT "posts_authorperm_token_created" PRIMARY KEY ("authorperm", "token", "created")
+) PARTITION BY RANGE ("created");
+
+CREATE TABLE "public"."posts_default" PARTITION OF "public"."posts" DEFAULT;
 
 CREATE INDEX "posts_token_author_created" ON "public"."posts" USING btree ("token", "author", "created" DESC);
 
 CREATE INDEX "posts_token_cashout" ON "public"."posts" USING btree ("token", "cashout_time" DESC);
 
-CREATE INDEX "posts_token_main_post_created_tags" ON "public"."posts" USING btree ("token", "main_post", "created" DESC, "tags");
-
-CREATE INDEX "posts_token_main_post_promoted" ON "public"."posts" USING btree ("token", "main_post", "promoted" DESC);
-
-CREATE INDEX "posts_token_main_post_score_hot" ON "public"."posts" USING btree ("token", "main_post", "score_hot");
-
-CREATE INDEX "posts_token_main_post_score_trend" ON "public"."posts" USING btree ("token", "main_post" DESC, "score_trend");
+-- listings, see sql/migrations/0002_listing_indexes.sql
+CREATE INDEX "posts_listing_created" ON "public"."posts" USING btree ("token", "created" DESC) WHERE "main_post" AND NOT "muted";
+CREATE INDEX "posts_listing_tags" ON "public"."posts" USING gin (string_to_array("tags", ',')) WHERE "main_post" AND NOT "muted";
+CREATE INDEX "posts_listing_author_created" ON "public"."posts" USING btree ("token", "author", "created" DESC) INCLUDE ("authorperm") WHERE "main_post" AND NOT "muted";
+CREATE INDEX "posts_listing_comments_author_created" ON "public"."posts" USING btree ("token", "author", "created" DESC) WHERE NOT "main_post" AND NOT "muted";
+CREATE INDEX "posts_listing_comments_parent_author_created" ON "public"."posts" USING btree ("token", "parent_author", "created" DESC) WHERE NOT "main_post" AND NOT "muted";
+CREATE INDEX "posts_listing_score_trend" ON "public"."posts" USING btree ("token", "score_trend" DESC) WHERE "main_post" AND NOT "muted";
+CREATE INDEX "posts_listing_score_hot" ON "public"."posts" USING btree ("token", "score_hot" DESC) WHERE "main_post" AND NOT "muted";
+CREATE INDEX "posts_listing_vote_rshares" ON "public"."posts" USING btree ("token", "vote_rshares" DESC) WHERE "main_post" AND NOT "muted";
+CREATE INDEX "posts_listing_comments_vote_rshares" ON "public"."posts" USING btree ("token", "vote_rshares" DESC) WHERE NOT "main_post" AND NOT "muted";
+CREATE INDEX "posts_listing_promoted" ON "public"."posts" USING btree ("token", "promoted" DESC) WHERE "main_post" AND NOT "muted" AND "last_payout" = '1970-01-01 00:00:00' AND "promoted" > 0;
 
 
 DROP TABLE IF EXISTS "reblogs";
@@ -148,6 +237,29 @@ CREATE TABLE "public"."token_config" (
 ) WITH (oids = false);
 
 
+DROP TABLE IF EXISTS "token_holders";
+CREATE TABLE "public"."token_holders" (
+    "token" character varying(20) NOT NULL,
+    "account" character varying(20) NOT NULL,
+    "stake" numeric DEFAULT '0' NOT NULL,
+    "dirty" boolean DEFAULT false NOT NULL,
+    "updated" timestamp,
+    "dirty_at" timestamp,
+    CONSTRAINT "token_holders_token_account" PRIMARY KEY ("token", "account")
+) WITH (oids = false);
+
+CREATE INDEX "token_holders_token_dirty" ON "public"."token_holders" USING btree ("token", "account") WHERE "dirty";
+
+
+DROP TABLE IF EXISTS "token_holder_snapshots";
+CREATE TABLE "public"."token_holder_snapshots" (
+    "token" character varying(20) NOT NULL,
+    "last_full_refresh" timestamp NOT NULL,
+    "holders" integer DEFAULT '0' NOT NULL,
+    CONSTRAINT "token_holder_snapshots_token" PRIMARY KEY ("token")
+) WITH (oids = false);
+
+
 DROP TABLE IF EXISTS "votes";
 CREATE TABLE "public"."votes" (
     "authorperm" character varying(300) NOT NULL,
@@ -156,8 +268,10 @@ CREATE TABLE "public"."votes" (
     "token" character varying(20) NOT NULL,
     "rshares" numeric NOT NULL,
     "percent" smallint DEFAULT '0' NOT NULL,
-    CONSTRAINT "votes_authorperm_token_voter" PRIMARY KEY ("authorperm", "token", "voter")
-) WITH (oids = false);
+    CONSTRAINT "votes_authorperm_token_voter_timestamp" PRIMARY KEY ("authorperm", "token", "voter", "timestamp")
+) PARTITION BY RANGE ("timestamp");
+
+CREATE TABLE "public"."votes_default" PARTITION OF "public"."votes" DEFAULT;
 
 CREATE INDEX "votes_authorperm_token_timestamp" ON "public"."votes" USING btree ("authorperm", "token", "timestamp");
 
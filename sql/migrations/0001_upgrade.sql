@@ -0,0 +1,102 @@
+-- Schema changes made before versioned migrations, formerly sql/upgrade.sql.
+-- Every statement is idempotent, so databases that already ran upgrade.sql
+-- apply it again without changes.
+
+CREATE TABLE IF NOT EXISTS "public"."token_holders" (
+    "token" character varying(20) NOT NULL,
+    "account" character varying(20) NOT NULL,
+    "stake" numeric DEFAULT '0' NOT NULL,
+    "dirty" boolean DEFAULT false NOT NULL,
+    "updated" timestamp,
+    CONSTRAINT "token_holders_token_account" PRIMARY KEY ("token", "account")
+);
+
+CREATE INDEX IF NOT EXISTS "token_holders_token_dirty" ON "public"."token_holders" USING btree ("token", "account") WHERE "dirty";
+
+CREATE TABLE IF NOT EXISTS "public"."token_holder_snapshots" (
+    "token" character varying(20) NOT NULL,
+    "last_full_refresh" timestamp NOT NULL,
+    "holders" integer DEFAULT '0' NOT NULL,
+    CONSTRAINT "token_holder_snapshots_token" PRIMARY KEY ("token")
+);
+
+-- account history keyset pagination on (timestamp, id)
+ALTER TABLE "public"."account_history" ADD COLUMN IF NOT EXISTS "id" bigserial NOT NULL;
+
+CREATE INDEX IF NOT EXISTS "account_history_account_timestamp" ON "public"."account_history" USING btree ("account", "timestamp" DESC);
+
+-- beneficiary rewards are fractional token amounts
+ALTER TABLE "public"."posts" ALTER COLUMN "beneficiaries_payout_value" TYPE numeric;
+
+-- post bodies: base version in post_metadata.body plus a log of edit patches
+ALTER TABLE "public"."post_metadata" ADD COLUMN IF NOT EXISTS "patch_count" integer DEFAULT '0' NOT NULL;
+
+CREATE INDEX IF NOT EXISTS "post_metadata_patch_count" ON "public"."post_metadata" USING btree ("patch_count") WHERE "patch_count" > 0;
+
+CREATE TABLE IF NOT EXISTS "public"."post_body_patches" (
+    "authorperm" character varying(300) NOT NULL,
+    "seq" integer NOT NULL,
+    "patch" text NOT NULL,
+    "timestamp" timestamp NOT NULL,
+    CONSTRAINT "post_body_patches_authorperm_seq" PRIMARY KEY ("authorperm", "seq")
+);
+
+-- edits of posts missing from post_metadata are repaired by repair_posts.py
+ALTER TABLE "public"."post_metadata" ADD COLUMN IF NOT EXISTS "body_synced_at" timestamp;
+
+CREATE TABLE IF NOT EXISTS "public"."post_repair_queue" (
+    "authorperm" character varying(300) NOT NULL,
+    "queued_at" timestamp NOT NULL,
+    "attempts" integer DEFAULT '0' NOT NULL,
+    "next_attempt_at" timestamp NOT NULL,
+    "last_error" text,
+    CONSTRAINT "post_repair_queue_authorperm" PRIMARY KEY ("authorperm")
+);
+
+CREATE INDEX IF NOT EXISTS "post_repair_queue_next_attempt_at" ON "public"."post_repair_queue" USING btree ("next_attempt_at");
+
+-- threads are read with one range scan over (root_authorperm, sort_path)
+ALTER TABLE "public"."post_metadata" ADD COLUMN IF NOT EXISTS "root_authorperm" character varying(300);
+ALTER TABLE "public"."post_metadata" ADD COLUMN IF NOT EXISTS "sort_path" text COLLATE "C";
+
+CREATE INDEX IF NOT EXISTS "post_metadata_root_authorperm_sort_path" ON "public"."post_metadata" USING btree ("root_authorperm", "sort_path");
+
+-- same segments as engine.post_metadata_storage.thread_path_segment
+WITH RECURSIVE thread AS (
+    SELECT pm.authorperm, pm.authorperm root_authorperm,
+        lpad(floor(extract(epoch FROM COALESCE((SELECT min(p.created) FROM posts p WHERE p.authorperm = pm.authorperm), 'epoch')))::bigint::text, 10, '0') || left(md5(pm.authorperm), 8) sort_path
+    FROM post_metadata pm WHERE pm.parent_authorperm IS NULL AND pm.sort_path IS NULL
+    UNION ALL
+    SELECT pm.authorperm, t.root_authorperm,
+        t.sort_path || '.' || lpad(floor(extract(epoch FROM COALESCE((SELECT min(p.created) FROM posts p WHERE p.authorperm = pm.authorperm), 'epoch')))::bigint::text, 10, '0') || left(md5(pm.authorperm), 8)
+    FROM post_metadata pm INNER JOIN thread t ON pm.parent_authorperm = t.authorperm
+)
+UPDATE post_metadata pm SET root_authorperm = thread.root_authorperm, sort_path = thread.sort_path
+FROM thread WHERE pm.authorperm = thread.authorperm AND pm.sort_path IS NULL;
+
+-- listings read the json_metadata fields they need from posts instead of joining post_metadata
+ALTER TABLE "public"."posts" ADD COLUMN IF NOT EXISTS "image" character varying(512);
+ALTER TABLE "public"."posts" ADD COLUMN IF NOT EXISTS "format" character varying(20);
+
+CREATE OR REPLACE FUNCTION pg_temp.try_jsonb(t text) RETURNS jsonb AS $$
+BEGIN
+    RETURN t::jsonb;
+EXCEPTION WHEN others THEN
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+-- same fields as engine.post_metadata_storage.metadata_projection
+UPDATE posts p SET
+    image = CASE WHEN length(pm.image) <= 512 THEN pm.image END,
+    app = left(pm.app, 256),
+    format = CASE WHEN length(pm.format) <= 20 THEN pm.format END
+FROM (
+    SELECT authorperm,
+        CASE jsonb_typeof(j->'image') WHEN 'array' THEN CASE WHEN jsonb_typeof(j->'image'->0) = 'string' THEN j->'image'->>0 END WHEN 'string' THEN j->>'image' END image,
+        CASE jsonb_typeof(j->'app') WHEN 'string' THEN j->>'app' WHEN 'object' THEN CASE WHEN jsonb_typeof(j->'app'->'name') = 'string' THEN j->'app'->>'name' END END app,
+        CASE WHEN jsonb_typeof(j->'format') = 'string' THEN j->>'format' END format
+    FROM (SELECT authorperm, pg_temp.try_jsonb(json_metadata) j FROM post_metadata) parsed
+    WHERE jsonb_typeof(j) = 'object'
+) pm
+WHERE p.authorperm = pm.authorperm AND p.image IS NULL AND p.app IS NULL AND p.format IS NULL;
@@ -0,0 +1,31 @@
+-- migrate:no-transaction
+-- Partial indexes matching the predicates of the listings in
+-- engine/post_queries.py: every listing reads unmuted posts of one token and
+-- either root posts or comments only. They replace the indexes on
+-- (token, main_post, ...) that also held muted posts. The indexes are built
+-- concurrently, so the streamers keep writing meanwhile.
+
+-- created listing, and the tag filter of the created and score listings
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "posts_listing_created" ON "public"."posts" USING btree ("token", "created" DESC) WHERE "main_post" AND NOT "muted";
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "posts_listing_tags" ON "public"."posts" USING gin (string_to_array("tags", ',')) WHERE "main_post" AND NOT "muted";
+
+-- blog and feed; their union branches only read authorperm and created
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "posts_listing_author_created" ON "public"."posts" USING btree ("token", "author", "created" DESC) INCLUDE ("authorperm") WHERE "main_post" AND NOT "muted";
+
+-- comments and replies of accounts
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "posts_listing_comments_author_created" ON "public"."posts" USING btree ("token", "author", "created" DESC) WHERE NOT "main_post" AND NOT "muted";
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "posts_listing_comments_parent_author_created" ON "public"."posts" USING btree ("token", "parent_author", "created" DESC) WHERE NOT "main_post" AND NOT "muted";
+
+-- trending, hot, payout and comment payout
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "posts_listing_score_trend" ON "public"."posts" USING btree ("token", "score_trend" DESC) WHERE "main_post" AND NOT "muted";
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "posts_listing_score_hot" ON "public"."posts" USING btree ("token", "score_hot" DESC) WHERE "main_post" AND NOT "muted";
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "posts_listing_vote_rshares" ON "public"."posts" USING btree ("token", "vote_rshares" DESC) WHERE "main_post" AND NOT "muted";
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "posts_listing_comments_vote_rshares" ON "public"."posts" USING btree ("token", "vote_rshares" DESC) WHERE NOT "main_post" AND NOT "muted";
+
+-- promoted posts that are not paid out yet
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "posts_listing_promoted" ON "public"."posts" USING btree ("token", "promoted" DESC) WHERE "main_post" AND NOT "muted" AND "last_payout" = '1970-01-01 00:00:00' AND "promoted" > 0;
+
+DROP INDEX CONCURRENTLY IF EXISTS "public"."posts_token_main_post_created_tags";
+DROP INDEX CONCURRENTLY IF EXISTS "public"."posts_token_main_post_promoted";
+DROP INDEX CONCURRENTLY IF EXISTS "public"."posts_token_main_post_score_hot";
+DROP INDEX CONCURRENTLY IF EXISTS "public"."posts_token_main_post_score_trend";
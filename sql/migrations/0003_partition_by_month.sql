@@ -0,0 +1,88 @@
+-- posts, votes and account_history become range partitioned by month on
+-- created / timestamp, so old months can be dropped as a whole by
+-- partitions.py and listings bounded by created > cutoff skip older months.
+-- The rows are copied into the new tables; stop the streamers and the API
+-- while this runs.
+
+-- Monthly partitions are named <table>_yYYYYmMM. Rows of the month that
+-- landed in <table>_default before the partition existed are moved over.
+CREATE OR REPLACE FUNCTION engine_create_month_partition(parent text, key text, month date) RETURNS text AS $$
+DECLARE
+    lower_bound date := date_trunc('month', month)::date;
+    upper_bound date := (date_trunc('month', month) + interval '1 month')::date;
+    name text := format('%s_y%sm%s', parent, to_char(lower_bound, 'YYYY'), to_char(lower_bound, 'MM'));
+BEGIN
+    IF to_regclass(name) IS NOT NULL THEN
+        RETURN name;
+    END IF;
+    EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', name, parent);
+    IF to_regclass(parent || '_default') IS NOT NULL THEN
+        EXECUTE format(
+            'WITH moved AS (DELETE FROM %I WHERE %I >= %L AND %I < %L RETURNING *) INSERT INTO %I SELECT * FROM moved',
+            parent || '_default', key, lower_bound, key, upper_bound, name
+        );
+    END IF;
+    EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)', parent, name, lower_bound, upper_bound);
+    RETURN name;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION pg_temp.partition_by_month(parent text, key text, primary_key_name text, primary_key text) RETURNS void AS $$
+DECLARE
+    old_name text := parent || '_unpartitioned';
+    first_month date;
+    month date;
+    r record;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = to_regclass(parent)) <> 'r' THEN
+        RETURN;
+    END IF;
+    EXECUTE format('ALTER TABLE %I RENAME TO %I', parent, old_name);
+    EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY RANGE (%I)', parent, old_name, key);
+    EXECUTE format('CREATE TABLE %I PARTITION OF %I DEFAULT', parent || '_default', parent);
+    EXECUTE format('SELECT date_trunc(''month'', min(%I))::date FROM %I', key, old_name) INTO first_month;
+    FOR month IN SELECT generate_series(COALESCE(first_month, date_trunc('month', now())::date), (date_trunc('month', now()) + interval '1 month')::date, interval '1 month')::date LOOP
+        PERFORM engine_create_month_partition(parent, key, month);
+    END LOOP;
+    EXECUTE format('INSERT INTO %I SELECT * FROM %I', parent, old_name);
+    -- serial columns keep their sequence
+    FOR r IN
+        SELECT s.relname seq, a.attname col FROM pg_depend d
+        JOIN pg_class s ON s.oid = d.objid AND s.relkind = 'S'
+        JOIN pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid
+        WHERE d.refobjid = to_regclass(old_name) AND d.deptype = 'a'
+    LOOP
+        EXECUTE format('ALTER SEQUENCE %I OWNED BY %I.%I', r.seq, parent, r.col);
+    END LOOP;
+    EXECUTE format('DROP TABLE %I', old_name);
+    IF primary_key IS NOT NULL THEN
+        EXECUTE format('ALTER TABLE %I ADD CONSTRAINT %I PRIMARY KEY (%s)', parent, primary_key_name, primary_key);
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- the partition key has to be part of the primary key; lookups by its other
+-- columns use it as a prefix in every partition
+SELECT pg_temp.partition_by_month('posts', 'created', 'posts_authorperm_token_created', '"authorperm", "token", "created"');
+SELECT pg_temp.partition_by_month('votes', 'timestamp', 'votes_authorperm_token_voter_timestamp', '"authorperm", "token", "voter", "timestamp"');
+SELECT pg_temp.partition_by_month('account_history', 'timestamp', NULL, NULL);
+
+-- indexes are built after the copy, on every partition
+CREATE INDEX IF NOT EXISTS "posts_token_author_created" ON "public"."posts" USING btree ("token", "author", "created" DESC);
+CREATE INDEX IF NOT EXISTS "posts_token_cashout" ON "public"."posts" USING btree ("token", "cashout_time" DESC);
+CREATE INDEX IF NOT EXISTS "posts_listing_created" ON "public"."posts" USING btree ("token", "created" DESC) WHERE "main_post" AND NOT "muted";
+CREATE INDEX IF NOT EXISTS "posts_listing_tags" ON "public"."posts" USING gin (string_to_array("tags", ',')) WHERE "main_post" AND NOT "muted";
+CREATE INDEX IF NOT EXISTS "posts_listing_author_created" ON "public"."posts" USING btree ("token", "author", "created" DESC) INCLUDE ("authorperm") WHERE "main_post" AND NOT "muted";
+CREATE INDEX IF NOT EXISTS "posts_listing_comments_author_created" ON "public"."posts" USING btree ("token", "author", "created" DESC) WHERE NOT "main_post" AND NOT "muted";
+CREATE INDEX IF NOT EXISTS "posts_listing_comments_parent_author_created" ON "public"."posts" USING btree ("token", "parent_author", "created" DESC) WHERE NOT "main_post" AND NOT "muted";
+CREATE INDEX IF NOT EXISTS "posts_listing_score_trend" ON "public"."posts" USING btree ("token", "score_trend" DESC) WHERE "main_post" AND NOT "muted";
+CREATE INDEX IF NOT EXISTS "posts_listing_score_hot" ON "public"."posts" USING btree ("token", "score_hot" DESC) WHERE "main_post" AND NOT "muted";
+CREATE INDEX IF NOT EXISTS "posts_listing_vote_rshares" ON "public"."posts" USING btree ("token", "vote_rshares" DESC) WHERE "main_post" AND NOT "muted";
+CREATE INDEX IF NOT EXISTS "posts_listing_comments_vote_rshares" ON "public"."posts" USING btree ("token", "vote_rshares" DESC) WHERE NOT "main_post" AND NOT "muted";
+CREATE INDEX IF NOT EXISTS "posts_listing_promoted" ON "public"."posts" USING btree ("token", "promoted" DESC) WHERE "main_post" AND NOT "muted" AND "last_payout" = '1970-01-01 00:00:00' AND "promoted" > 0;
+
+CREATE INDEX IF NOT EXISTS "votes_authorperm_token_timestamp" ON "public"."votes" USING btree ("authorperm", "token", "timestamp");
+
+CREATE INDEX IF NOT EXISTS "account_history_account_token_timestamp" ON "public"."account_history" USING btree ("account", "token", "timestamp" DESC);
+CREATE INDEX IF NOT EXISTS "account_history_account_timestamp" ON "public"."account_history" USING btree ("account", "timestamp" DESC);
+CREATE INDEX IF NOT EXISTS "account_history_token_timestamp" ON "public"."account_history" USING btree ("token", "timestamp" DESC);
@@ -0,0 +1,38 @@
+-- Replies indexed while their parent had no sort_path kept a NULL path and
+-- were left out of the thread range scans. engine_fill_thread_paths() gives
+-- the NULL path descendants of posts with a path their path; the comment
+-- processor calls it whenever a post gets its path, and this migration runs
+-- it once over the existing rows.
+
+-- segments are the same as engine.post_metadata_storage.thread_path_segment
+CREATE OR REPLACE FUNCTION engine_fill_thread_paths(starts varchar[]) RETURNS integer AS $$
+DECLARE
+    filled integer;
+BEGIN
+    WITH RECURSIVE thread AS (
+        SELECT pm.authorperm, pm.root_authorperm, pm.sort_path, 0 depth
+        FROM post_metadata pm WHERE pm.authorperm = ANY(starts) AND pm.sort_path IS NOT NULL
+        UNION ALL
+        SELECT pm.authorperm, t.root_authorperm,
+            t.sort_path || '.' || lpad(floor(extract(epoch FROM COALESCE((SELECT min(p.created) FROM posts p WHERE p.authorperm = pm.authorperm), 'epoch')))::bigint::text, 10, '0') || left(md5(pm.authorperm), 8),
+            t.depth + 1
+        FROM post_metadata pm INNER JOIN thread t ON pm.parent_authorperm = t.authorperm
+        WHERE pm.sort_path IS NULL AND t.depth < 255
+    )
+    UPDATE post_metadata pm SET root_authorperm = thread.root_authorperm, sort_path = thread.sort_path
+    FROM thread WHERE pm.authorperm = thread.authorperm AND pm.sort_path IS NULL;
+    GET DIAGNOSTICS filled = ROW_COUNT;
+    RETURN filled;
+END;
+$$ LANGUAGE plpgsql;
+
+-- root posts indexed without a path
+UPDATE post_metadata pm SET root_authorperm = pm.authorperm,
+    sort_path = lpad(floor(extract(epoch FROM COALESCE((SELECT min(p.created) FROM posts p WHERE p.authorperm = pm.authorperm), 'epoch')))::bigint::text, 10, '0') || left(md5(pm.authorperm), 8)
+WHERE pm.parent_authorperm IS NULL AND pm.sort_path IS NULL;
+
+SELECT engine_fill_thread_paths(ARRAY(
+    SELECT DISTINCT parent.authorperm FROM post_metadata reply
+    JOIN post_metadata parent ON parent.authorperm = reply.parent_authorperm
+    WHERE reply.sort_path IS NULL AND parent.sort_path IS NOT NULL
+));
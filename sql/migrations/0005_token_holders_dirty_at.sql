@@ -0,0 +1,4 @@
+-- When mark_dirty last flagged a holder. update_staked_accounts.py clears
+-- the flag only on rows not flagged again while their stake was fetched, so
+-- a stake change streamed during the fetch is not overwritten.
+ALTER TABLE "public"."token_holders" ADD COLUMN IF NOT EXISTS "dirty_at" timestamp;
@@ -9,20 +9,34 @@ import dataset
 from nectar import Hive
 from nectar.block import Blocks
 from nectar.blockchain import Blockchain
-from nectar.utils import construct_authorperm
 from nectarengine.api import Api
 
 from engine.config_storage import ConfigurationDB
 from engine.follow_storage import FollowsDB
+from engine.log_utils import ProgressSummary
+from engine.metrics import (
+    BLOCKS,
+    FETCH_SECONDS,
+    LAG_BLOCKS,
+    LAG_SECONDS,
+    LAST_BLOCK,
+    OPS,
+    OPS_PER_BLOCK,
+    start_metrics_server,
+    timed_iter,
+    track_db_time,
+)
 from engine.post_storage import PostsTrx
 from engine.reblog_storage import ReblogsDB
 from engine.token_config_storage import TokenConfigDB
+from engine.watermark import EngineWatermark
 from engine.utils import initialize_config, initialize_token_metadata, setup_logging
 from processors.comment_processor_for_engine import CommentProcessorForEngine
 from processors.custom_json_follow_processor import FollowProcessor
-from processors.custom_json_processor import extract_json_data
 from processors.custom_json_reblog_processor import ReblogProcessor
 from processors.custom_json_set_tribe_settings import SetTribeSettingsProcessor
+from processors.delete_comment_processor import DeleteCommentProcessor
+from processors.op_router import OpRouter, is_reblog
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -31,7 +45,18 @@ logging.basicConfig()
 
 class HiveStreamProcessor:
     def __init__(
-        self, db, hived, token_metadata, confStorage, postTrx, reblogsStorage, followsDb
+        self,
+        db,
+        hived,
+        token_metadata,
+        confStorage,
+        postTrx,
+        reblogsStorage,
+        followsDb,
+        watermark=None,
+        enable_bulk_blocks=False,
+        batch_size=1000,
+        store_body_patches=False,
     ):
         self.db = db
         self.hived = hived
@@ -40,71 +65,107 @@ class HiveStreamProcessor:
         self.postTrx = postTrx
         self.reblogsStorage = reblogsStorage
         self.followsDb = followsDb
+        self.watermark = watermark or EngineWatermark(confStorage)
+        self.enable_bulk_blocks = enable_bulk_blocks
+        self.batch_size = batch_size
 
-        # Correctly instantiate Blockchain object
-        self.blockchain = Blockchain(
-            mode="head", max_block_wait_repetition=27, steem_instance=hived
-        )
+        # created on first use, so process_op can run without a node
+        self._blockchain = None
 
         self.comment_processor_for_engine = CommentProcessorForEngine(
-            db, hived, token_metadata
+            db, hived, token_metadata, store_body_patches=store_body_patches
         )
         self.reblog_processor = ReblogProcessor(db, token_metadata)
         self.follow_processor = FollowProcessor(db, token_metadata)
         self.set_tribe_settings_processor = SetTribeSettingsProcessor(
             db, token_metadata
         )
+        self.delete_comment_processor = DeleteCommentProcessor(db)
+
+        self.router = OpRouter("hive")
+        self.router.add("comment", self.comment_processor_for_engine, "comment")
+        self.router.add(
+            "delete_comment", self.delete_comment_processor, "delete_comment"
+        )
+        # reblogs are sent with either id, other "follow" payloads are follows
+        self.router.add(
+            "reblog", self.reblog_processor, "custom_json", "follow", match=is_reblog
+        )
+        self.router.add("follow", self.follow_processor, "custom_json", "follow")
+        self.router.add(
+            "reblog", self.reblog_processor, "custom_json", "reblog", match=is_reblog
+        )
+        self.router.add(
+            "set_tribe_settings",
+            self.set_tribe_settings_processor,
+            "custom_json",
+            "scot_set_tribe_settings",
+        )
 
         self.last_streamed_block = 0
+        self.next_block = None
         self.last_streamed_timestamp = None
         self.last_engine_streamed_timestamp = None
         self.block_processing_time = time.time()
-        self.last_block_print = 0
+        self.progress = ProgressSummary(logger, "hive")
+        self.head_block = None
+        self.block_ops = 0
+
+    @property
+    def blockchain(self):
+        if self._blockchain is None:
+            self._blockchain = Blockchain(
+                mode="head", max_block_wait_repetition=27, steem_instance=self.hived
+            )
+        return self._blockchain
 
     def process_op(self, ops):
-        engine_conf = self.confStorage.get_engine()
-        if engine_conf and engine_conf.get("last_engine_streamed_timestamp"):
-            self.last_engine_streamed_timestamp = engine_conf[
-                "last_engine_streamed_timestamp"
-            ].replace(tzinfo=timezone.utc)
-
         current_op_block_num = ops["block_num"]
 
         if current_op_block_num - self.last_streamed_block > 1:
-            print(
-                f"Skip block last block {self.last_streamed_block} - now {current_op_block_num}"
+            logger.debug(
+                "Skip block last block %d - now %d",
+                self.last_streamed_block,
+                current_op_block_num,
             )
         elif current_op_block_num - self.last_streamed_block == 1:
-            print(f"Current block {current_op_block_num}")
+            logger.debug("Current block %d", current_op_block_num)
 
         delay_sec = int((datetime.now(timezone.utc) - ops["timestamp"]).total_seconds())
 
         if delay_sec < 15:
-            print(f"Blocks too recent {delay_sec} ago, waiting.")
+            logger.info("Blocks too recent %d s ago, waiting.", delay_sec)
             return False  # Indicate that processing should pause
 
-        if (
-            not self.last_engine_streamed_timestamp
-            or ops["timestamp"] >= self.last_engine_streamed_timestamp
-        ):
-            print(
-                f"Waiting for engine refblock to catch up to {self.last_engine_streamed_timestamp}"
+        if not self.watermark.allows(ops["timestamp"]):
+            self.last_engine_streamed_timestamp = self.watermark.timestamp
+            logger.info(
+                "Waiting for engine refblock to catch up to %s",
+                self.last_engine_streamed_timestamp,
             )
             return False  # Indicate that processing should pause
 
-        delay_string = (
-            f"(+ {delay_sec} s): "
-            if delay_sec < 60
-            else f"(+ {delay_sec / 60:.1f} min)"
-        )
-
         if current_op_block_num > self.last_streamed_block:
-            if len(self.token_metadata["config"]) > 0:
-                print(
-                    f"{delay_string}: Block processing took {time.time() - self.block_processing_time:.2f} s"
-                )
+            logger.debug(
+                "Block processing took %.2f s", time.time() - self.block_processing_time
+            )
             self.block_processing_time = time.time()
 
+            if self.block_ops > 0:
+                self.progress.block(
+                    self.last_streamed_block,
+                    self.last_streamed_timestamp,
+                    self.block_ops,
+                    delay_sec,
+                )
+                BLOCKS.inc(stream="hive")
+                OPS_PER_BLOCK.observe(self.block_ops, stream="hive")
+                LAST_BLOCK.set(self.last_streamed_block, stream="hive")
+            self.block_ops = 0
+            LAG_SECONDS.set(delay_sec, stream="hive")
+            if self.head_block is not None:
+                LAG_BLOCKS.set(self.head_block - current_op_block_num, stream="hive")
+
             self.confStorage.upsert(
                 {
                     "last_streamed_block": self.last_streamed_block,
@@ -116,51 +177,14 @@ class HiveStreamProcessor:
 
         self.last_streamed_block = current_op_block_num
         self.last_streamed_timestamp = ops["timestamp"]
+        self.block_ops += 1
+        OPS.inc(stream="hive", type=ops["type"])
 
-        if current_op_block_num - self.last_block_print > 20:
-            self.last_block_print = current_op_block_num
-            print(f"{delay_string}: {current_op_block_num} - {ops['timestamp']}")
-            # Removed 'blocks left' as stop_block is dynamic in continuous streaming
-
-        if ops["type"] == "custom_json":
-            custom_json_start_time = time.time()
-            json_data = extract_json_data(ops)
-            if (
-                json_data
-                and ops["id"] == "follow"
-                and isinstance(json_data, list)
-                and len(json_data) == 2
-                and json_data[0] == "reblog"
-                and isinstance(json_data[1], dict)
-            ):
-                self.reblog_processor.process(ops, json_data)
-            elif (
-                json_data
-                and ops["id"] == "reblog"
-                and isinstance(json_data, list)
-                and len(json_data) == 2
-                and json_data[0] == "reblog"
-                and isinstance(json_data[1], dict)
-            ):
-                self.reblog_processor.process(ops, json_data)
-            elif json_data and ops["id"] == "follow":
-                self.follow_processor.process(ops, json_data)
-                print(f"follow op took {time.time() - custom_json_start_time:.2f} s")
-            elif json_data and ops["id"] == "scot_set_tribe_settings":
-                self.set_tribe_settings_processor.process(ops, json_data)
-        elif ops["type"] == "delete_comment":
-            try:
-                authorperm = construct_authorperm(ops["author"], ops["permlink"])
-                self.postTrx.delete_posts(authorperm)
-            except Exception:
-                print(f"Could not process {authorperm}")
-        elif ops["type"] == "comment":
-            self.comment_processor_for_engine.process(ops)
+        self.router.dispatch(ops)
         return True
 
-    def run(self):
-        # Use self.blockchain here
-        current_block_num = self.blockchain.get_current_block_num()
+    def load_checkpoint(self):
+        """Read where the last run stopped and pick the next block to fetch."""
         conf_setup = self.confStorage.get()
         if conf_setup is None:
             self.confStorage.upsert(
@@ -171,7 +195,7 @@ class HiveStreamProcessor:
                     ),
                 }
             )
-            self.last_streamed_block = current_block_num
+            self.last_streamed_block = self.blockchain.get_current_block_num()
             self.last_streamed_timestamp = datetime(
                 1970, 1, 1, 0, 0, 0, tzinfo=timezone.utc
             )
@@ -183,90 +207,111 @@ class HiveStreamProcessor:
                 else datetime(1970, 1, 1, 0, 0, 0, tzinfo=timezone.utc)
             )
 
-        engine_conf = self.confStorage.get_engine()
-        if engine_conf and engine_conf.get("last_engine_streamed_timestamp"):
-            self.last_engine_streamed_timestamp = engine_conf[
-                "last_engine_streamed_timestamp"
-            ].replace(tzinfo=timezone.utc)
+        self.last_engine_streamed_timestamp = self.watermark.refresh()
 
-        start_block = (
+        self.next_block = (
             self.last_streamed_block + 1
             if self.last_streamed_block != 0
             else self.blockchain.get_current_block_num()
         )
-        self.last_block_print = start_block
-
-        print(f"Starting stream from block {start_block}")
+        logger.info("Starting stream from block %d", self.next_block)
 
-        # Changed to a single pass, then exit
-        current_head_block = self.blockchain.get_current_block_num()
-        if start_block > current_head_block:
-            print("Caught up. Exiting...")
-            return  # Exit the run method
+    def save_checkpoint(self):
+        self.confStorage.upsert(
+            {
+                "last_streamed_block": self.last_streamed_block,
+                "last_streamed_timestamp": self.last_streamed_timestamp,
+            }
+        )
+        self.db.commit()
 
-        if ENABLE_BULK_BLOCKS:
-            print(
-                f"Starting batch processing from {start_block} to {current_head_block}"
-            )
+    def fetch_ops(self, start_block, stop_block):
+        """Yield the relevant ops of blocks start_block..stop_block."""
+        op_names = self.router.op_types()
+        if self.enable_bulk_blocks:
             current_batch_start = start_block
-            while current_batch_start <= current_head_block:
+            while current_batch_start <= stop_block:
                 current_batch_end = min(
-                    current_batch_start + BATCH_SIZE - 1, current_head_block
+                    current_batch_start + self.batch_size - 1, stop_block
+                )
+                logger.info(
+                    "Processing batch %d - %d", current_batch_start, current_batch_end
                 )
-                print(f"Processing batch {current_batch_start} - {current_batch_end}")
                 blocks_generator = Blocks(
                     starting_block_num=current_batch_start,
-                    end_block=current_batch_end,
+                    count=current_batch_end - current_batch_start + 1,
                     only_ops=True,
-                    ops=["comment", "custom_json", "delete_comment"],
                     blockchain_instance=self.hived,
                 )
-                batch_completed = True
-                for block in blocks_generator:
-                    print(f"Processing block {block.block_num}")
+                for block in timed_iter(blocks_generator, FETCH_SECONDS, stream="hive"):
+                    logger.debug("Processing block %d", block.block_num)
                     for op in block.operations:
                         op_dict = op["value"]
                         op_dict["type"] = op["type"].replace("_operation", "")
+                        if op_dict["type"] not in op_names:
+                            continue
                         op_dict["block_num"] = block.block_num
                         op_dict["timestamp"] = block["timestamp"].replace(
                             tzinfo=timezone.utc
                         )  # Ensure timezone-aware
-                        if not self.process_op(op_dict):
-                            batch_completed = False
-                            break
-                    if not batch_completed:
-                        break
-                if not batch_completed:
-                    return  # Exit if process_op returned False
+                        yield op_dict
                 current_batch_start = current_batch_end + 1
         else:
-            print(
-                f"Starting stream processing from {start_block} to {current_head_block}"
-            )
-            # Use self.blockchain here
-            for ops in self.blockchain.stream(
-                start=start_block,
-                stop=current_head_block,  # Stream up to the current head block
-                opNames=["comment", "custom_json", "delete_comment"],
-                max_batch_size=None,  # Use default streaming behavior
-                threading=False,
-                thread_num=1,
+            for ops in timed_iter(
+                self.blockchain.stream(
+                    start=start_block,
+                    stop=stop_block,
+                    opNames=op_names,
+                    max_batch_size=None,  # Use default streaming behavior
+                    threading=False,
+                    thread_num=1,
+                ),
+                FETCH_SECONDS,
+                stream="hive",
             ):
                 ops["timestamp"] = ops["timestamp"].replace(
                     tzinfo=timezone.utc
                 )  # Ensure timezone-aware
-                if not self.process_op(ops):
-                    break  # Exit loop if process_op returned False
-
-        # Final update of last streamed block and timestamp before exiting
-        self.confStorage.upsert(
-            {
-                "last_streamed_block": self.last_streamed_block,
-                "last_streamed_timestamp": self.last_streamed_timestamp,
-            }
+                yield ops
+
+    def step(self, max_blocks=None):
+        """Process up to max_blocks blocks starting at next_block.
+
+        Returns the number of blocks consumed. 0 means caught up with the head,
+        or the next block is too recent or ahead of the sidechain.
+        """
+        start_block = self.next_block
+        if self.head_block is None or start_block > self.head_block:
+            self.head_block = self.blockchain.get_current_block_num()
+        if start_block > self.head_block:
+            return 0
+        stop_block = min(
+            start_block + (max_blocks or self.batch_size) - 1, self.head_block
         )
-        self.db.commit()
-        print("Stream processing completed. Exiting.")
+        logger.info("Processing blocks %d - %d", start_block, stop_block)
+
+        resume_block = stop_block + 1
+        for ops in self.fetch_ops(start_block, stop_block):
+            if not self.process_op(ops):
+                # nothing of this block was written yet, retry it next time
+                resume_block = ops["block_num"]
+                break
+        self.save_checkpoint()
+        self.next_block = resume_block
+        return resume_block - start_block
+
+    def run(self):
+        self.load_checkpoint()
+
+        # Single pass up to the current head, then exit
+        self.head_block = self.blockchain.get_current_block_num()
+        if self.next_block > self.head_block:
+            logger.info("Caught up. Exiting...")
+            return
+
+        while self.next_block <= self.head_block and self.step():
+            pass
+        logger.info("Stream processing completed. Exiting.")
 
 
 if __name__ == "__main__":
@@ -279,10 +324,10 @@ if __name__ == "__main__":
     engine_api = Api(url=config_data["engine_api"])
     engine_id = config_data["engine_id"]
 
-    ENABLE_BULK_BLOCKS = bool(config_data.get("enable_hive_bulk_blocks", False))
-    BATCH_SIZE = 1000  # Define BATCH_SIZE here
-
     db = dataset.connect(databaseConnector, ensure_schema=False)
+    track_db_time(db.engine)
+    if config_data.get("hive_metrics_port"):
+        start_metrics_server(int(config_data["hive_metrics_port"]))
 
     postTrx = PostsTrx(db)
     confStorage = ConfigurationDB(db)
@@ -295,9 +340,20 @@ if __name__ == "__main__":
     print(f"using node {hived.rpc.url}")
 
     token_config = tokenConfigStorage.get_all()
-    token_metadata = initialize_token_metadata(token_config, engine_api)
+    token_metadata = initialize_token_metadata(
+        token_config, engine_api, config_data.get("token_cache_file")
+    )
 
     processor = HiveStreamProcessor(
-        db, hived, token_metadata, confStorage, postTrx, reblogsStorage, followsDb
+        db,
+        hived,
+        token_metadata,
+        confStorage,
+        postTrx,
+        reblogsStorage,
+        followsDb,
+        watermark=EngineWatermark(confStorage, databaseConnector),
+        enable_bulk_blocks=bool(config_data.get("enable_hive_bulk_blocks", False)),
+        store_body_patches=bool(config_data.get("store_body_patches", False)),
     )
     processor.run()
@@ -1,6 +1,5 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
-import json
 import logging
 import logging.config
 import time
@@ -13,10 +12,27 @@ from nectar.utils import parse_time
 from nectarengine.api import Api
 
 from engine.config_storage import ConfigurationDB
+from engine.json_codec import decode_field
+from engine.log_utils import ProgressSummary
+from engine.metrics import (
+    BLOCKS,
+    DECODE_SECONDS,
+    FETCH_SECONDS,
+    LAG_BLOCKS,
+    LAG_SECONDS,
+    LAST_BLOCK,
+    OPS,
+    OPS_PER_BLOCK,
+    PROCESSOR_SECONDS,
+    start_metrics_server,
+    track_db_time,
+)
+from engine.notify import ENGINE_PROGRESS_CHANNEL, notify
 from engine.token_config_storage import TokenConfigDB
 from engine.utils import initialize_config, initialize_token_metadata, setup_logging
 from processors.engine_comments_contract_processor import CommentsContractProcessor
 from processors.engine_promote_post_processor import PromotePostProcessor
+from processors.engine_stake_processor import STAKE_ACTIONS, StakeProcessor
 
 load_dotenv()
 
@@ -24,45 +40,70 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 logging.basicConfig()
 
+# most blocks a single get_block_range_info call returns
+BLOCK_RANGE_SIZE = 1000
+
 
 class EngineStreamProcessor:
-    def __init__(self, db, engine_api, token_metadata, confStorage):
+    def __init__(
+        self,
+        db,
+        engine_api,
+        token_metadata,
+        confStorage,
+        watermark=None,
+        enable_bulk_blocks=False,
+    ):
         self.db = db
         self.engine_api = engine_api
         self.token_metadata = token_metadata
         self.confStorage = confStorage
+        # advanced after every commit when the Hive stream runs in this process
+        self.watermark = watermark
+        self.enable_bulk_blocks = enable_bulk_blocks
 
         self.promote_post_processor = PromotePostProcessor(db, token_metadata)
+        self.stake_processor = StakeProcessor(db, token_metadata)
         self.comments_processor = CommentsContractProcessor(
             db, engine_api, token_metadata
         )
 
         self.last_engine_streamed_block = 0
         self.last_engine_streamed_timestamp = None
-        self.last_block_print = 0
+        self.progress = ProgressSummary(logger, "engine")
+        self.head_block = None
 
     def process_engine_block(self, block_dict):
         timestamp = parse_time(block_dict["timestamp"]).replace(tzinfo=timezone.utc)
 
         self.db.begin()
         if not block_dict["transactions"]:
-            print("No transactions in block.")
+            logger.debug("No transactions in block.")
         else:
             for op in block_dict["transactions"]:
                 contract_action = op["action"]
-                contractPayload = op["payload"]
+                OPS.inc(stream="engine", type=f"{op['contract']}.{contract_action}")
                 try:
-                    contractPayload = json.loads(contractPayload)
+                    with DECODE_SECONDS.time(stream="engine"):
+                        contractPayload = decode_field(op, "payload")
 
                     if op["contract"] == "comments":
-                        self.comments_processor.process(op, contractPayload, timestamp)
+                        with PROCESSOR_SECONDS.time(processor="comments_contract"):
+                            self.comments_processor.process(
+                                op, contractPayload, timestamp
+                            )
                         continue
+                    elif (
+                        op["contract"] == "tokens" and contract_action in STAKE_ACTIONS
+                    ):
+                        with PROCESSOR_SECONDS.time(processor="stake"):
+                            self.stake_processor.process(op, contractPayload)
                     elif op["contract"] == "tokens" and contract_action == "transfer":
                         if (
                             "memo" not in contractPayload
                             or contractPayload["memo"] is None
                         ):
-                            print("No memo field in contractPayload")
+                            logger.debug("No memo field in contractPayload")
                             continue
                         memo = contractPayload["memo"]
                         if not isinstance(memo, str) or len(memo) < 3:
@@ -84,20 +125,53 @@ class EngineStreamProcessor:
                                 contractPayload["to"]
                                 == transfer_token_config["promoted_post_account"]
                             ):
-                                self.promote_post_processor.process(op, contractPayload)
+                                with PROCESSOR_SECONDS.time(processor="promote_post"):
+                                    self.promote_post_processor.process(
+                                        op, contractPayload
+                                    )
                 except Exception as e:
                     logger.error(f"Error processing contract action: {e}")
                     traceback.print_exc()
 
+        # pending unstakes / undelegations complete in virtual transactions
+        for op in block_dict.get("virtualTransactions") or []:
+            if op["contract"] != "tokens" or op["action"] not in STAKE_ACTIONS:
+                continue
+            try:
+                contractPayload = decode_field(op, "payload") if op["payload"] else {}
+                with PROCESSOR_SECONDS.time(processor="stake"):
+                    self.stake_processor.process(op, contractPayload)
+            except Exception as e:
+                logger.error(f"Error processing virtual transaction: {e}")
+                traceback.print_exc()
+
         self.confStorage.upsert_engine(
             {
                 "last_engine_streamed_block": block_dict["blockNumber"],
                 "last_engine_streamed_timestamp": timestamp,
             }
         )
+        notify(self.db, ENGINE_PROGRESS_CHANNEL, timestamp.isoformat())
         self.db.commit()
+        self.last_engine_streamed_timestamp = timestamp
+        if self.watermark is not None:
+            self.watermark.advance(timestamp)
 
-    def run(self):
+        lag_seconds = (datetime.now(timezone.utc) - timestamp).total_seconds()
+        self.progress.block(
+            block_dict["blockNumber"],
+            timestamp,
+            len(block_dict["transactions"]),
+            lag_seconds,
+        )
+        BLOCKS.inc(stream="engine")
+        OPS_PER_BLOCK.observe(len(block_dict["transactions"]), stream="engine")
+        LAST_BLOCK.set(block_dict["blockNumber"], stream="engine")
+        LAG_SECONDS.set(lag_seconds, stream="engine")
+        if self.head_block is not None:
+            LAG_BLOCKS.set(self.head_block - block_dict["blockNumber"], stream="engine")
+
+    def load_checkpoint(self):
         conf_setup = self.confStorage.get_engine()
         if conf_setup is None:
             self.confStorage.upsert_engine(
@@ -121,58 +195,61 @@ class EngineStreamProcessor:
                 if conf_setup["last_engine_streamed_timestamp"]
                 else datetime(1970, 1, 1, 0, 0, 0, tzinfo=timezone.utc)
             )
+        if self.watermark is not None:
+            self.watermark.advance(self.last_engine_streamed_timestamp)
 
-        print("stream new engine blocks")
+    def fetch_blocks(self, start_block, stop_block):
+        """Yield the sidechain blocks start_block..stop_block."""
+        if self.enable_bulk_blocks:
+            logger.debug("Fetching sidechain blocks in chunks of %d", BLOCK_RANGE_SIZE)
+            current = start_block
+            while current <= stop_block:
+                count = min(BLOCK_RANGE_SIZE, stop_block - current + 1)
+                with FETCH_SECONDS.time(stream="engine"):
+                    block_range = self.engine_api.get_block_range_info(current, count)
+                yield from block_range
+                current += count
+        else:
+            for block_num in range(start_block, stop_block + 1):
+                with FETCH_SECONDS.time(stream="engine"):
+                    current_block = self.engine_api.get_block_info(block_num)
+                yield current_block
 
-        while True:
-            try:
+    def step(self, max_blocks=BLOCK_RANGE_SIZE):
+        """Process up to max_blocks blocks after the checkpoint.
+
+        Returns the number of blocks processed, 0 when caught up with the head.
+        """
+        start_block = self.last_engine_streamed_block + 1
+        if self.head_block is None or start_block > self.head_block:
+            with FETCH_SECONDS.time(stream="engine"):
                 current_block_info = self.engine_api.get_latest_block_info()
-                current_block_num = current_block_info["blockNumber"]
+            self.head_block = current_block_info["blockNumber"]
+        if start_block > self.head_block:
+            return 0
+        stop_block = min(start_block + max_blocks - 1, self.head_block)
+        logger.info("Processing blocks %d - %d", start_block, stop_block)
 
-                start_block = self.last_engine_streamed_block + 1
-                stop_block = current_block_num + 1
+        processed = 0
+        for block_dict in self.fetch_blocks(start_block, stop_block):
+            logger.debug("Processing engine block %d", block_dict["blockNumber"])
+            self.process_engine_block(block_dict)
+            self.last_engine_streamed_block = block_dict["blockNumber"]
+            processed += 1
+        return processed
 
-                if start_block >= stop_block:
-                    print("Caught up. Waiting for new blocks...")
-                    time.sleep(3)
-                    self.last_engine_streamed_block = current_block_num
-                    continue
-
-                print(f"Processing blocks {start_block} - {stop_block}")
-
-                if ENABLE_BULK_BLOCKS:
-                    print(
-                        "Bulk block fetching ENABLED. Fetching sidechain blocks in chunks of 1000 …"
-                    )
-                    CHUNK_SIZE = 1000
-                    current = start_block
-                    while current < stop_block:
-                        count = min(CHUNK_SIZE, stop_block - current)
-                        try:
-                            block_range = self.engine_api.get_block_range_info(
-                                current, count
-                            )
-                        except Exception:
-                            traceback.print_exc()
-                            block_range = []
-                        for block_dict in block_range:
-                            print(
-                                f"Processing engine block {block_dict['blockNumber']}"
-                            )
-                            self.process_engine_block(block_dict)
-                            self.last_engine_streamed_block = block_dict["blockNumber"]
-                        current += count
-                else:
-                    for current_block_num_iter in range(start_block, stop_block):
-                        current_block = self.engine_api.get_block_info(
-                            current_block_num_iter
-                        )
-                        print(f"Processing engine block {current_block_num_iter}")
-                        self.process_engine_block(current_block)
-                        self.last_engine_streamed_block = current_block_num_iter
+    def run(self):
+        self.load_checkpoint()
 
+        logger.info("stream new engine blocks")
+
+        while True:
+            try:
+                if not self.step():
+                    logger.debug("Caught up. Waiting for new blocks...")
+                    time.sleep(3)
             except KeyboardInterrupt:
-                print("Exiting...")
+                logger.info("Exiting...")
                 break
             except Exception as e:
                 logger.error(f"An error occurred in the main loop: {e}")
@@ -189,15 +266,24 @@ if __name__ == "__main__":
     engine_api = Api(url=config_data["engine_api"])
     engine_id = config_data["engine_id"]
 
-    ENABLE_BULK_BLOCKS = bool(config_data.get("enable_engine_bulk_blocks", False))
-
     db = dataset.connect(databaseConnector, ensure_schema=False)
+    track_db_time(db.engine)
+    if config_data.get("engine_metrics_port"):
+        start_metrics_server(int(config_data["engine_metrics_port"]))
 
     confStorage = ConfigurationDB(db)
     tokenConfigStorage = TokenConfigDB(db)
 
     token_config = tokenConfigStorage.get_all()
-    token_metadata = initialize_token_metadata(token_config, engine_api)
+    token_metadata = initialize_token_metadata(
+        token_config, engine_api, config_data.get("token_cache_file")
+    )
 
-    processor = EngineStreamProcessor(db, engine_api, token_metadata, confStorage)
+    processor = EngineStreamProcessor(
+        db,
+        engine_api,
+        token_metadata,
+        confStorage,
+        enable_bulk_blocks=bool(config_data.get("enable_engine_bulk_blocks", False)),
+    )
     processor.run()
@@ -0,0 +1,154 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Runs the sidechain and Hive streams in one process.
+
+Both streams share the database connection, the token metadata and the
+sidechain watermark. A scheduler alternates between them in bounded steps,
+so the Hive stream stays just behind the sidechain instead of exiting and
+being restarted whenever it catches up with it.
+"""
+
+import logging
+import logging.config
+import time
+import traceback
+from builtins import object
+
+import dataset
+from nectar import Hive
+from nectarengine.api import Api
+
+from engine.config_storage import ConfigurationDB
+from engine.follow_storage import FollowsDB
+from engine.metrics import start_metrics_server, track_db_time
+from engine.post_storage import PostsTrx
+from engine.reblog_storage import ReblogsDB
+from engine.token_config_storage import TokenConfigDB
+from engine.utils import initialize_config, initialize_token_metadata, setup_logging
+from engine.watermark import EngineWatermark
+from stream_blocks import HiveStreamProcessor
+from stream_engine_sidechain_blocks import EngineStreamProcessor
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logging.basicConfig()
+
+
+class IndexerScheduler(object):
+    """Interleaves the sidechain and Hive streams by their timestamps.
+
+    Each tick runs one step of at most ``max_blocks`` blocks. The Hive stream
+    gets the turn while it is behind the sidechain watermark, the sidechain
+    stream otherwise or when Hive cannot move. When neither stream makes
+    progress, the scheduler sleeps ``idle_sleep`` seconds.
+    """
+
+    def __init__(
+        self, db, engine_processor, hive_processor, max_blocks=100, idle_sleep=3
+    ):
+        self.db = db
+        self.engine = engine_processor
+        self.hive = hive_processor
+        self.watermark = hive_processor.watermark
+        self.max_blocks = max_blocks
+        self.idle_sleep = idle_sleep
+
+    def _step(self, name, processor):
+        try:
+            return processor.step(self.max_blocks)
+        except Exception as e:
+            logger.error(f"Error in the {name} stream: {e}")
+            traceback.print_exc()
+            # drop the half-written block and continue from the checkpoint
+            while self.db.in_transaction:
+                self.db.rollback()
+            processor.load_checkpoint()
+            time.sleep(5)
+            return 0
+
+    def tick(self):
+        hive_timestamp = self.hive.last_streamed_timestamp
+        engine_timestamp = self.watermark.timestamp
+        if (
+            hive_timestamp is not None
+            and engine_timestamp is not None
+            and hive_timestamp < engine_timestamp
+        ):
+            order = (("hive", self.hive), ("engine", self.engine))
+        else:
+            order = (("engine", self.engine), ("hive", self.hive))
+        for name, processor in order:
+            processed = self._step(name, processor)
+            if processed:
+                return processed
+        return 0
+
+    def run(self):
+        self.engine.load_checkpoint()
+        self.hive.load_checkpoint()
+        logger.info("Running the sidechain and Hive streams")
+        while True:
+            try:
+                if not self.tick():
+                    time.sleep(self.idle_sleep)
+            except KeyboardInterrupt:
+                logger.info("Exiting...")
+                break
+
+
+if __name__ == "__main__":
+    setup_logging("logger.json")
+
+    config_file = "config.json"
+    config_data = initialize_config(config_file)
+    databaseConnector = config_data["databaseConnector"]
+    engine_api = Api(url=config_data["engine_api"])
+
+    db = dataset.connect(databaseConnector, ensure_schema=False)
+    track_db_time(db.engine)
+    if config_data.get("indexer_metrics_port"):
+        start_metrics_server(int(config_data["indexer_metrics_port"]))
+
+    confStorage = ConfigurationDB(db)
+    tokenConfigStorage = TokenConfigDB(db)
+
+    node_list = ["https://api.syncad.com", "https://api.hive.blog"]
+    hived = Hive(node=node_list, num_retries=5, call_num_retries=3, timeout=15)
+    logger.info("using node %s", hived.rpc.url)
+
+    token_config = tokenConfigStorage.get_all()
+    token_metadata = initialize_token_metadata(
+        token_config, engine_api, config_data.get("token_cache_file")
+    )
+
+    # advanced in-process by the sidechain stream, no notifications needed
+    watermark = EngineWatermark(confStorage)
+
+    engine_processor = EngineStreamProcessor(
+        db,
+        engine_api,
+        token_metadata,
+        confStorage,
+        watermark=watermark,
+        enable_bulk_blocks=bool(config_data.get("enable_engine_bulk_blocks", False)),
+    )
+    hive_processor = HiveStreamProcessor(
+        db,
+        hived,
+        token_metadata,
+        confStorage,
+        PostsTrx(db),
+        ReblogsDB(db),
+        FollowsDB(db),
+        watermark=watermark,
+        enable_bulk_blocks=bool(config_data.get("enable_hive_bulk_blocks", False)),
+        store_body_patches=bool(config_data.get("store_body_patches", False)),
+    )
+
+    scheduler = IndexerScheduler(
+        db,
+        engine_processor,
+        hive_processor,
+        max_blocks=int(config_data.get("indexer_step_blocks", 100)),
+    )
+    scheduler.run()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse
+import logging
+import time
+import traceback
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import dataset
+from nectarengine.api import Api
+
+from engine.token_config_storage import TokenConfigDB
+from engine.token_holder_storage import TokenHoldersDB
+from engine.token_metadata import engine_find
+from engine.utils import initialize_config, setup_logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logging.basicConfig()
+
+PAGE_SIZE = 1000
+
+
+def crawl_holders(engine_api, token):
+    """Fetch the stake of every holder of a token."""
+    stakes = {}
+    offset = 0
+    while True:
+        holders = engine_find(
+            engine_api, "tokens", "balances", {"symbol": token}, PAGE_SIZE, offset
+        )
+        for holder in holders:
+            stakes[holder["account"]] = Decimal(holder["stake"])
+        offset += PAGE_SIZE
+        if len(holders) < PAGE_SIZE:
+            return stakes
+
+
+def fetch_stakes(engine_api, token, accounts):
+    """Fetch the stake of a batch of accounts with one find call."""
+    balances = engine_find(
+        engine_api,
+        "tokens",
+        "balances",
+        {"symbol": token, "account": {"$in": list(accounts)}},
+        len(accounts),
+    )
+    return {b["account"]: Decimal(b["stake"]) for b in balances}
+
+
+def update_token(engine_api, tokenHoldersDb, token, full_refresh_age):
+    snapshot_time = tokenHoldersDb.get_snapshot_time(token)
+    if snapshot_time is not None and snapshot_time.tzinfo is None:
+        snapshot_time = snapshot_time.replace(tzinfo=timezone.utc)
+    if (
+        snapshot_time is None
+        or datetime.now(timezone.utc) - snapshot_time > full_refresh_age
+    ):
+        start_time = time.time()
+        stakes = crawl_holders(engine_api, token)
+        tokenHoldersDb.replace_snapshot(token, stakes)
+        print(
+            f"{token}: full snapshot of {len(stakes)} holders took {time.time() - start_time:.2f} s"
+        )
+
+    refreshed = 0
+    while True:
+        dirty = tokenHoldersDb.get_dirty(token, limit=PAGE_SIZE)
+        if not dirty:
+            break
+        # accounts flagged again during the fetch stay dirty for the next batch
+        tokenHoldersDb.update_stakes(
+            token, dirty, fetch_stakes(engine_api, token, dirty)
+        )
+        refreshed += len(dirty)
+    if refreshed > 0:
+        print(f"{token}: refreshed {refreshed} changed holders")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build and incrementally refresh the staked accounts snapshot."
+    )
+    parser.add_argument(
+        "--full-refresh-hours",
+        type=float,
+        default=24,
+        help="Recrawl all holders of a token when its snapshot is older than this",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=0,
+        help="Keep running and refresh every INTERVAL seconds (default: run once)",
+    )
+    args = parser.parse_args()
+
+    setup_logging("logger.json")
+
+    config_file = "config.json"
+    config_data = initialize_config(config_file)
+
+    db = dataset.connect(config_data["databaseConnector"], ensure_schema=False)
+    engine_api = Api(url=config_data["engine_api"])
+    tokenConfigStorage = TokenConfigDB(db)
+    tokenHoldersDb = TokenHoldersDB(db)
+    full_refresh_age = timedelta(hours=args.full_refresh_hours)
+
+    while True:
+        for token in tokenConfigStorage.get_all():
+            try:
+                update_token(engine_api, tokenHoldersDb, token, full_refresh_age)
+            except Exception:
+                traceback.print_exc()
+        if args.interval <= 0:
+            break
+        time.sleep(args.interval)